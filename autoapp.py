@@ -1,16 +1,28 @@
 import os
+import time
 import click
+from sqlalchemy.exc import IntegrityError
 
 from config import config
 from myapp import create_app
 from myapp.logger import setup_logging
-from myapp.models.db_orm import db
+from myapp.models.db_orm import db, create_missing_indexes
 from myapp.models.db_data import load_users_from_json
 from myapp.models.db_data import load_countries_from_json
 from myapp.models.db_data import load_distribution_centers_from_json
 from myapp.models.db_data import load_stores_status_from_json
+from myapp.models.db_data import load_component_types_from_json
 from myapp.models.db_data import load_stores_from_json
 from myapp.models.db_data import load_store_components_from_json
+from myapp.models.db_stats import rebuild_statistics
+from myapp.models.db_migrations import migrate_ip_addresses
+from myapp.models.db_migrations import migrate_component_types
+from myapp.models.db_import import READERS, RESOURCES
+from myapp.models.db_import import get_progress, import_file, reset_progress
+from myapp.models.db_import import provision_users
+from myapp.models.db_sync import sync_stores
+from myapp.utils.argon2 import argon2_workers
+from myapp.api.export import EXPORTS, generate_csv
 
 
 # Flask - Command Line Interface
@@ -84,6 +96,33 @@ def db_create(drop_first=True):
     db.create_all()
 
 
+@app.cli.command()
+def db_create_indexes():
+    """ Creating missing indexes, keeping tables and data. """
+    click.echo('Starting db_create_indexes')
+    for name in create_missing_indexes():
+        click.echo('Created index {}'.format(name))
+
+
+@app.cli.command()
+def db_migrate_ip_addresses():
+    """ Converting store component ip addresses to the IPAddress type. """
+    click.echo('Starting db_migrate_ip_addresses')
+    converted, invalid = migrate_ip_addresses()
+    click.echo('Converted {} ip addresses'.format(converted))
+    for row_id, value in invalid:
+        click.echo('Invalid ip address {!r} of store component {} set to '
+                   'NULL'.format(value, row_id))
+
+
+@app.cli.command()
+def db_migrate_component_types():
+    """ Moving store component types to table component_types. """
+    click.echo('Starting db_migrate_component_types')
+    converted = migrate_component_types()
+    click.echo('Converted {} store components'.format(converted))
+
+
 @app.cli.command()
 def db_load_users():
     """ Importing JSON data to table users. """
@@ -112,6 +151,13 @@ def db_load_store_status():
     load_stores_status_from_json()
 
 
+@app.cli.command()
+def db_load_component_types():
+    """ Importing JSON data to table component_types. """
+    click.echo('Starting db_load_component_types')
+    load_component_types_from_json()
+
+
 @app.cli.command()
 def db_load_stores():
     """ Importing JSON data to table stores. """
@@ -123,4 +169,127 @@ def db_load_stores():
 def db_load_store_components():
     """ Importing JSON data to table store_components. """
     click.echo('Starting db_load_store_components')
-    load_store_components_from_json()
+    start = time.perf_counter()
+    count = load_store_components_from_json()
+    elapsed = time.perf_counter() - start
+    click.echo('Loaded {} store components in {:.2f}s ({:.0f} rows/s)'.format(
+        count, elapsed, count / elapsed if elapsed else 0))
+
+
+@app.cli.command()
+@click.argument('resource', type=click.Choice(sorted(RESOURCES)))
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(sorted(READERS)),
+              help='File format, by default by the file extension.')
+@click.option('--batch-size', type=int,
+              help='Records per transaction, default IMPORT_BATCH_SIZE.')
+@click.option('--restart', is_flag=True,
+              help='Start over instead of resuming an unfinished import.')
+def db_import(resource, filename, file_format, batch_size, restart):
+    """ Importing stores or store_components from NDJSON, CSV or JSON. """
+    click.echo('Starting db_import {}'.format(resource))
+    if restart:
+        reset_progress(filename)
+    progress = get_progress(filename)
+    if progress is not None:
+        click.echo('Resuming after record {}'.format(progress.records))
+
+    def on_invalid(record_number, message):
+        click.echo('Invalid record {}: {}'.format(record_number, message),
+                   err=True)
+
+    try:
+        imported, invalid = import_file(
+            resource, filename, file_format=file_format,
+            batch_size=batch_size, on_invalid=on_invalid)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except IntegrityError as e:
+        progress = get_progress(filename)
+        raise click.ClickException(
+            'Batch after record {} failed, fix the file and run again to '
+            'resume: {}'.format(progress.records if progress else 0, e.orig))
+    click.echo('Imported {} records, {} invalid'.format(imported, invalid))
+
+
+@app.cli.command()
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(sorted(READERS)),
+              help='File format, by default by the file extension.')
+@click.option('--batch-size', type=int,
+              help='Users per transaction, default IMPORT_BATCH_SIZE.')
+@click.option('--workers', type=int,
+              help='Hashing processes, by default per core and memory.')
+def db_provision_users(filename, file_format, batch_size, workers):
+    """ Creating users from NDJSON, CSV or JSON, hashing in parallel. """
+    click.echo('Starting db_provision_users')
+    if workers is None:
+        workers = argon2_workers(
+            app.config['ARGON2_MAX_WORKERS'],
+            app.config['ARGON2_MEMORY_FRACTION'])
+    click.echo('Hashing passwords with {} processes'.format(workers))
+
+    def on_invalid(record_number, message):
+        click.echo('Invalid record {}: {}'.format(record_number, message),
+                   err=True)
+
+    start = time.perf_counter()
+    created, skipped, invalid = provision_users(
+        filename, file_format=file_format, batch_size=batch_size,
+        workers=workers, on_invalid=on_invalid)
+    elapsed = time.perf_counter() - start
+    click.echo('Created {} users in {:.2f}s ({:.1f} hashes/s), {} existing '
+               'skipped, {} invalid'.format(
+                   created, elapsed, created / elapsed if elapsed else 0,
+                   skipped, invalid))
+
+
+@app.cli.command()
+@click.option('--file', 'filename', default='db/json/stores.json',
+              type=click.Path(exists=True, dir_okay=False),
+              help='Store master, default db/json/stores.json.')
+@click.option('--delete', is_flag=True,
+              help='Delete the stores missing in the master.')
+@click.option('--dry-run', is_flag=True,
+              help='Only report the differences.')
+def db_sync_stores(filename, delete, dry_run):
+    """ Applying the changes of the store master to table stores. """
+    click.echo('Starting db_sync_stores')
+    start = time.perf_counter()
+    result = sync_stores(filename, delete=delete, dry_run=dry_run)
+    elapsed = time.perf_counter() - start
+    for number, message in result['invalid']:
+        click.echo('Invalid store {}: {}'.format(number, message), err=True)
+    if result['deletes_skipped']:
+        click.echo('Skipped {} deletes, the master has invalid '
+                   'stores'.format(result['deletes_skipped']), err=True)
+    click.echo('{}{} inserted, {} updated, {} deleted, {} unchanged in '
+               '{:.2f}s'.format(
+                   'Dry run: ' if dry_run else '', result['inserted'],
+                   result['updated'], result['deleted'],
+                   result['unchanged'], elapsed))
+
+
+@app.cli.command()
+def db_rebuild_stats():
+    """ Recounting table statistics from stores and store_components. """
+    click.echo('Starting db_rebuild_stats')
+    rebuild_statistics()
+
+
+@app.cli.command()
+@click.argument('name', type=click.Choice(sorted(EXPORTS)))
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help='CSV file to write, default standard output.')
+def export_csv(name, output):
+    """ Exporting table stores or store_components to CSV. """
+    click.echo('Starting export_csv {}'.format(name), err=True)
+    # The csv module writes its own line endings, no newline translation
+    f = (open(output, 'w', encoding='utf-8', newline='') if output
+         else click.get_text_stream('stdout'))
+    try:
+        for chunk in generate_csv(name):
+            f.write(chunk)
+    finally:
+        if output:
+            f.close()
@@ -0,0 +1,91 @@
+"""
+Compares the two ways of serializing /api/stores:
+
+    - ORM: Store instances (identity map) and Store.to_dict()
+    - Core: select() rows turned straight into dicts (myapp/models/db_rows.py)
+
+Both produce the same JSON document, the benchmark verifies it.
+Usage (from the project root):
+
+    python -m benchmarks.serialization [number of stores]
+"""
+import sys
+import time
+import tracemalloc
+
+from flask import json
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import Store
+from myapp.models.db_rows import select_fields, to_dicts
+
+
+def load_stores(count):
+    """ Inserts count stores with a single executemany """
+    db.session.execute(Store.__table__.insert(), [{
+        'user_id': 1,
+        'country_code': 'BE',
+        'dc_id': 1,
+        'number': number,
+        'name': 'Store {}'.format(number),
+        'status_id': 1,
+        'street_number': str(number),
+        'street_name': 'Stormestraat',
+        'postal_code': '8790',
+        'city': 'Waregem'} for number in range(1, count + 1)])
+    db.session.commit()
+
+
+def serialize_orm():
+    stores = Store.query.order_by(Store.country_code, Store.number).all()
+    return json.dumps({'stores': [store.to_dict() for store in stores]})
+
+
+def serialize_core():
+    statement = select_fields(Store).order_by(
+        Store.country_code, Store.number)
+    return json.dumps({'stores': to_dicts(
+        db.session.execute(statement), Store.api_fields)})
+
+
+def measure(function, repeat=3):
+    """ Returns the best time in seconds and the peak memory in bytes """
+    best = None
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    db.session.remove()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main(count):
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        load_stores(count)
+        if serialize_orm() != serialize_core():
+            sys.exit('Serialized output differs')
+        print('Serializing {} stores'.format(count))
+        print('{:<6} {:>10} {:>14}'.format('path', 'time (s)', 'peak (KiB)'))
+        results = {}
+        for name, function in (('orm', serialize_orm),
+                               ('core', serialize_core)):
+            results[name] = measure(function)
+            print('{:<6} {:>10.3f} {:>14.0f}'.format(
+                name, results[name][0], results[name][1] / 1024))
+        print('core path: {:.1f}x faster, {:.1f}x less memory'.format(
+            results['orm'][0] / results['core'][0],
+            results['orm'][1] / results['core'][1]))
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
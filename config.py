@@ -97,6 +97,76 @@ class BaseConfig(object):
     }
     # print(OAUTH2_PROVIDERS)
 
+    # Reference data cache (myapp/models/db_cache.py)
+    # Seconds before the cached countries, distribution centers and store
+    # statuses are reloaded, this bounds how long writes done by other
+    # processes can go unnoticed. Use 0 to only reload after local writes.
+    REFERENCE_CACHE_TTL = 300
+
+    # Rendered-fragment cache of the store pages (myapp/stores/cache.py)
+    # Fragments are dropped when the store changes in this process,
+    # STORES_FRAGMENT_CACHE_TTL bounds how long (in seconds) writes done by
+    # other processes can go unnoticed. Use 0 to only drop after local writes.
+    STORES_FRAGMENT_CACHE = True
+    STORES_FRAGMENT_CACHE_SIZE = 1000
+    STORES_FRAGMENT_CACHE_TTL = 60
+
+    # Streaming import of stores and components (myapp/models/db_import.py)
+    # Records per batch, each batch is one transaction: memory use and the
+    # work redone after a failure grow with it.
+    IMPORT_BATCH_SIZE = 1000
+    # Bulk user provisioning (flask db-provision-users)
+    # Passwords are hashed in a pool of processes: one per core, at most
+    # ARGON2_MAX_WORKERS (None for no limit) and as many as fit in
+    # ARGON2_MEMORY_FRACTION of the available memory, an Argon2 hash needs
+    # 64 MiB (see myapp/utils/argon2.py).
+    ARGON2_MAX_WORKERS = None
+    ARGON2_MEMORY_FRACTION = 0.5
+
+    # API - Keyset pagination (?limit=&after=) on the collection resources
+    # API_PAGE_SIZE is used when a cursor is given without a limit,
+    # larger limits are capped to API_MAX_PAGE_SIZE.
+    API_PAGE_SIZE = 100
+    API_MAX_PAGE_SIZE = 1000
+    # API - Streaming mode (Accept: application/x-ndjson or ?stream=1)
+    # Number of rows fetched from the server-side cursor and written per chunk
+    API_STREAM_BATCH_SIZE = 500
+    # API - Batch lookup of stores (POST /api/stores/lookup)
+    # Maximum number of keys per request, keys are queried in chunks
+    API_LOOKUP_MAX_STORES = 1000
+    API_LOOKUP_CHUNK_SIZE = 500
+    # API - Batch writes of stores (POST/PATCH/DELETE /api/stores/batch)
+    # Maximum number of stores per request, written in transactions of
+    # API_BATCH_CHUNK_SIZE stores
+    API_BATCH_MAX_STORES = 10000
+    API_BATCH_CHUNK_SIZE = 500
+
+    # API - Change events (/api/events, myapp/events.py)
+    # EVENTS_BACKEND is local for a single process, polling when several
+    # processes write to the database (they are read every
+    # EVENTS_POLL_INTERVAL seconds), or the import path of a backend class.
+    # Subscribers that fall EVENTS_QUEUE_SIZE events behind are disconnected
+    # and resume with Last-Event-ID, at most EVENTS_REPLAY_LIMIT changes are
+    # replayed. EVENTS_KEEPALIVE is the seconds between keepalive comments.
+    EVENTS_BACKEND = 'local'
+    EVENTS_POLL_INTERVAL = 2
+    EVENTS_BATCH_SIZE = 500
+    EVENTS_QUEUE_SIZE = 1000
+    EVENTS_REPLAY_LIMIT = 1000
+    EVENTS_KEEPALIVE = 15
+
+    # Response compression (myapp/utils/compression.py)
+    # gzip or deflate, as accepted by the client. Buffered responses smaller
+    # than COMPRESS_MIN_SIZE bytes are sent as they are, streamed responses
+    # are always compressed. COMPRESS_LEVEL goes from 1 (fastest) to 9
+    # (smallest), 6 is the zlib default.
+    COMPRESS_ENABLED = True
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_MIMETYPES = (
+        'text/html', 'text/css', 'text/csv', 'text/plain',
+        'application/javascript', 'application/json', 'application/x-ndjson')
+
 
 class DevelopmentConfig(BaseConfig):
     """
@@ -135,6 +205,8 @@ class ProductionConfig(BaseConfig):
     HOST = '0.0.0.0'
     # Change the listening port - app.run(port=5001)
     PORT = '5001'
+    # Several gunicorn workers (gunicorn.conf.py) write to the database
+    EVENTS_BACKEND = 'polling'
 
 
 class TestingConfig(BaseConfig):
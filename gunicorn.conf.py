@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+
+
+# Gunicorn - Production Web Server
+# http://docs.gunicorn.org/en/stable/settings.html
+# Use it as follows:
+# gunicorn -c gunicorn.conf.py autoapp:app
+
+# The change events (/api/events, myapp/events.py) are long-lived responses:
+# every subscriber waits on its queue between two events. With the gevent
+# worker the standard library is monkey-patched before the application is
+# loaded, the queues, locks and the reader thread of the events backend
+# become cooperative: an idle subscriber is a parked greenlet, not a worker
+# thread. A sync worker (or flask run) serves one stream per thread.
+worker_class = 'gevent'
+# Open connections (requests and event streams) per worker
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+# Each worker has its own events broker, the production configuration uses
+# the polling backend so events written by any worker reach every stream
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+
+
+def post_fork(server, worker):
+    """
+    Makes psycopg2 cooperative in the gevent workers, queries to PostgreSQL
+    yield to the other greenlets instead of blocking the worker.
+    """
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -2,8 +2,13 @@ from flask import Flask
 
 from config import config
 
-from .extensions import debug_toolbar, csrf, login_manager, oauth
+from .extensions import compress, debug_toolbar, csrf, login_manager, oauth
 from .models.db_orm import db
+from .models.db_cache import reference_cache
+from .models import db_versions  # noqa
+from .models.db_resolver import store_resolver
+from .stores.cache import fragment_cache
+from .events import event_broker
 
 
 # We are using application factory functions to create the application.
@@ -30,6 +35,24 @@ def create_app(config_name):
     # Initialize extension SQLAlchemy
     db.init_app(app)
 
+    # Initialize the reference data cache (countries, dcs, store statuses)
+    reference_cache.init_app(app)
+
+    # Initialize the request-scoped store lookups (Store.get)
+    store_resolver.init_app(app)
+
+    # Initialize the rendered-fragment cache of the store pages
+    fragment_cache.init_app(app)
+
+    # Initialize the broker pushing change events (/api/events)
+    event_broker.init_app(app)
+
+    # Initialize response compression
+    # after_request handlers run in reverse order of registration, so it is
+    # initialized before the extensions that modify responses (the debug
+    # toolbar injects itself into the HTML) and compresses their result
+    compress.init_app(app)
+
     # Initialize extension Flask-DebugToolbar
     # By default, it's only enabled in debug mode but we will only Initialize
     # it in development mode
@@ -6,4 +6,4 @@ api = Blueprint('api', __name__)
 
 
 # routes separated by resource type, each in own module
-from . import views  # noqa
+from . import views, errors  # noqa
@@ -0,0 +1,24 @@
+from functools import wraps
+
+from flask_login import current_user
+
+from .errors import unauthorized
+
+
+# Authentication of the API
+# Write endpoints require a user, signed in with a session (the web
+# application) or with HTTP Basic authentication (see load_user_from_request
+# in myapp/extensions.py). Unlike Flask-Login's login_required, which
+# redirects to the sign-in page, API clients get a JSON 401 response.
+
+
+def auth_required(f):
+    """
+    Decorator for API views that require an authenticated user.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return unauthorized('authentication required')
+        return f(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,281 @@
+from collections import Counter, OrderedDict
+
+from flask import current_app, request
+from sqlalchemy import and_, bindparam, or_
+from sqlalchemy.exc import DataError, IntegrityError
+
+from myapp.exceptions import ValidationError
+from myapp.models.db_orm import db
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_rows import StoreRow
+from myapp.models import db_changes
+from myapp.models import db_stats
+
+from .filters import parse_key
+
+
+# Batch writes of stores (POST / PATCH / DELETE /api/stores/batch)
+# The whole batch is validated first, without queries. Valid items are then
+# written in chunks of API_BATCH_CHUNK_SIZE stores, one transaction per
+# chunk:
+#   - one query reads the existing stores of the chunk (ownership, current
+#     values for the statistics)
+#   - inserts, updates and deletes are sent as executemany statements, as
+#     are the statistics (db_stats.py) and the change log (db_changes.py)
+# Each item gets its own result, in the order of the request. An item that
+# fails validation or ownership doesn't stop the others. If a chunk hits an
+# integrity error (e.g. a store created concurrently) or a data error (e.g.
+# a string too long for its column on PostgreSQL) the chunk is rolled back
+# and all its items report the error, earlier chunks stay committed.
+#
+# Stores are identified by country_code and number, these can't be changed
+# with a batch.
+
+WRITABLE_FIELDS = (
+    'country_code',
+    'dc_id',
+    'number',
+    'name',
+    'status_id',
+    'street_name',
+    'street_number',
+    'postal_code',
+    'city'
+    )
+
+REQUIRED_FIELDS = ('country_code', 'dc_id', 'number', 'name', 'status_id')
+
+STRING_FIELDS = (
+    'name', 'street_name', 'street_number', 'postal_code', 'city')
+
+
+def get_batch_items():
+    """
+    Returns the list of stores of a batch request body:
+    {"stores": [...]}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('stores'), list):
+        raise ValidationError('expected a JSON object with a list of stores')
+    max_stores = current_app.config['API_BATCH_MAX_STORES']
+    if len(data['stores']) > max_stores:
+        raise ValidationError(
+            'at most {} stores can be written at once'.format(max_stores))
+    return data['stores']
+
+
+def parse_store_key(item):
+    """
+    Returns the key (country_code, number) of a store given as 'BE-101' or
+    as {"country_code": "BE", "number": 101}.
+    """
+    if isinstance(item, str):
+        return parse_key('store', item)
+    if isinstance(item, dict):
+        country_code, number = item.get('country_code'), item.get('number')
+        if (isinstance(country_code, str) and isinstance(number, int) and
+                not isinstance(number, bool)):
+            return country_code, number
+    raise ValidationError(
+        'store must be given with country_code and number, e.g. BE-101')
+
+
+def parse_store(item):
+    """
+    Validates the values of a store, the reference keys are checked
+    against the reference data cache.
+
+    Returns:
+        key (country_code, number), dict of values
+    Raises:
+        ValidationError
+    """
+    if not isinstance(item, dict):
+        raise ValidationError('store must be a JSON object')
+    unknown = sorted(set(item) - set(WRITABLE_FIELDS))
+    if unknown:
+        raise ValidationError('unknown fields: {}'.format(', '.join(unknown)))
+    key = parse_store_key(item)
+
+    reference = reference_cache.get()
+    if key[0] not in reference.countries_by_code:
+        raise ValidationError('unknown country_code: {}'.format(key[0]))
+    # Ids must be integers: a list isn't hashable and True == 1
+    for field, by_id in (('dc_id', reference.distribution_centers_by_id),
+                         ('status_id', reference.store_status_by_id)):
+        if field in item and (
+                not isinstance(item[field], int) or
+                isinstance(item[field], bool) or
+                item[field] not in by_id):
+            raise ValidationError(
+                'unknown {}: {}'.format(field, item[field]))
+    for field in STRING_FIELDS:
+        if item.get(field) is not None and not isinstance(item[field], str):
+            raise ValidationError('{} must be a string'.format(field))
+    if 'name' in item and not item['name']:
+        raise ValidationError('name must not be empty')
+    return key, dict(item)
+
+
+def check_required(values):
+    missing = [field for field in REQUIRED_FIELDS if field not in values]
+    if missing:
+        raise ValidationError(
+            'missing fields: {}'.format(', '.join(missing)))
+
+
+def result(index, key, **kwargs):
+    """ Returns the result of one item """
+    data = OrderedDict(
+        index=index, store='{}-{}'.format(*key) if key else None)
+    data.update(kwargs)
+    return data
+
+
+def fetch_stores(keys):
+    """
+    Returns the existing stores {(country_code, number): StoreRow} of keys,
+    with one query.
+    """
+    numbers = OrderedDict()
+    for country_code, number in keys:
+        numbers.setdefault(country_code, []).append(number)
+    stores = StoreRow.fetch(StoreRow.select().where(or_(*[
+        and_(Store.country_code == country_code, Store.number.in_(n))
+        for country_code, n in numbers.items()])))
+    return {(store.country_code, store.number): store for store in stores}
+
+
+def write_chunk(chunk, action, user_id, results):
+    """
+    Writes a chunk of parsed items [(index, key, values)] in one transaction
+    and sets their results.
+    """
+    table = Store.__table__
+    existing = fetch_stores([key for index, key, values in chunk])
+
+    inserts, updates, deletes = [], [], []
+    for index, key, values in chunk:
+        store = existing.get(key)
+        try:
+            if store is not None and store.user_id != user_id:
+                raise ValidationError(
+                    'you can only change stores you created')
+            if action == 'delete':
+                if store is None:
+                    raise ValidationError('store not found')
+                deletes.append((index, key, store))
+            elif store is not None:
+                if action == 'create':
+                    raise ValidationError('store already exists')
+                updates.append((index, key, store, values))
+            else:
+                check_required(values)
+                inserts.append((index, key, values))
+        except ValidationError as e:
+            results[index] = result(index, key, error=e.args[0])
+
+    # Statistics deltas of the whole chunk, applied at once: an update that
+    # doesn't move a store to another group costs nothing
+    deltas = Counter()
+    try:
+        if inserts:
+            rows = [dict({field: values.get(field)
+                          for field in WRITABLE_FIELDS}, user_id=user_id)
+                    for index, key, values in inserts]
+            db.session.execute(table.insert(), rows)
+            deltas.update(db_stats.store_deltas(rows))
+            # executemany doesn't return the new ids, the change log needs
+            # them: one more query for the chunk
+            created = fetch_stores([key for _, key, _ in inserts])
+            db_changes.record_inserts(
+                Store, [created[key] for _, key, _ in inserts])
+
+        if updates:
+            # executemany needs the same columns in every row
+            groups = OrderedDict()
+            for index, key, store, values in updates:
+                groups.setdefault(tuple(sorted(values)), []).append(
+                    dict(values, b_id=store.id))
+            for rows in groups.values():
+                db.session.execute(
+                    table.update().where(table.c.id == bindparam('b_id')),
+                    rows)
+            deltas.update(db_stats.store_deltas(
+                [store for _, _, store, _ in updates], -1))
+            updated = [dict(store.to_dict(), id=store.id, **values)
+                       for _, _, store, values in updates]
+            deltas.update(db_stats.store_deltas(updated))
+            db_changes.record_updates(Store, updated)
+
+        if deletes:
+            store_ids = [store.id for _, _, store in deletes]
+            deltas.update(
+                db_stats.store_component_deltas_of_stores(store_ids))
+            deltas.update(db_stats.store_deltas(
+                [store for _, _, store in deletes], -1))
+            db_changes.record_store_component_deletes(store_ids)
+            db_changes.record_deletes(
+                Store, [store for _, _, store in deletes])
+            db.session.execute(StoreComponent.__table__.delete().where(
+                StoreComponent.store_id.in_(store_ids)))
+            db.session.execute(table.delete().where(
+                table.c.id.in_(store_ids)))
+
+        db_stats.apply_deltas(deltas)
+        db.session.commit()
+    except (IntegrityError, DataError) as e:
+        db.session.rollback()
+        message = '{}, no store of this chunk was written: {{}}'.format(
+            'integrity error' if isinstance(e, IntegrityError)
+            else 'invalid data')
+        for item in inserts + updates + deletes:
+            results[item[0]] = result(
+                item[0], item[1], error=message.format(e.orig))
+        return
+
+    for index, key, values in inserts:
+        results[index] = result(index, key, result='created')
+    for index, key, store, values in updates:
+        results[index] = result(index, key, result='updated')
+    for index, key, store in deletes:
+        results[index] = result(index, key, result='deleted')
+
+
+def write_batch(items, action, user_id):
+    """
+    Validates and writes a batch of stores.
+
+    Args:
+        items: list of stores, as given in the request
+        action: create (POST), upsert (PATCH) or delete (DELETE)
+        user_id: id of the authenticated user, owner of new stores
+    Returns:
+        list of results, one per item in the same order
+    """
+    results = [None] * len(items)
+    parsed = []
+    seen = set()
+    for index, item in enumerate(items):
+        key = None
+        try:
+            if action == 'delete':
+                key = parse_store_key(item)
+                values = None
+            else:
+                key, values = parse_store(item)
+                if action == 'create':
+                    check_required(values)
+            if key in seen:
+                raise ValidationError('store is given more than once')
+            seen.add(key)
+            parsed.append((index, key, values))
+        except ValidationError as e:
+            results[index] = result(index, key, error=e.args[0])
+
+    chunk_size = current_app.config['API_BATCH_CHUNK_SIZE']
+    for i in range(0, len(parsed), chunk_size):
+        write_chunk(parsed[i:i + chunk_size], action, user_id, results)
+    return results
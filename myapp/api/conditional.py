@@ -0,0 +1,123 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request
+from sqlalchemy import func, select
+
+from myapp.models.db_orm import db
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_versions import ensure_table, version_of
+
+
+# Conditional GET (ETag / Last-Modified)
+# Sync clients poll the API every minute. Instead of serializing the full
+# collection each time we compute a cheap validator for the tables behind
+# a resource: one aggregate query returning the version of the tables
+# (db_versions.py, incremented by every committed write), the row count and
+# the most recent created_date / updated_date. When the client's
+# If-None-Match header still matches, we answer 304 Not Modified and the
+# view function is never called.
+# Last-Modified is sent, but If-Modified-Since alone never answers 304:
+# deletes and writes within the same second don't move the date, only the
+# version in the ETag catches them. The count and dates still catch writes
+# that bypass the session.
+# Tables without timestamps fall back to the row count and highest id.
+# Reference tables are served from the reference data cache, their validator
+# is the version of the cached data and costs no query at all.
+
+
+def table_aggregates(model):
+    """
+    Returns the scalar subqueries used to validate the table of model.
+    """
+    table = model.__table__
+    columns = [c for c in ('created_date', 'updated_date') if c in table.c]
+    if not columns:
+        columns = [c.name for c in table.primary_key.columns]
+    aggregates = [version_of(table),
+                  select([func.count()]).select_from(table).as_scalar()]
+    for column in columns:
+        aggregates.append(
+            select([func.max(table.c[column])]).as_scalar())
+    return aggregates
+
+
+def to_utc(date):
+    """ Returns date as naive UTC datetime, without microseconds """
+    if not isinstance(date, datetime):
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.replace(microsecond=0)
+
+
+def get_validators(*models):
+    """
+    Computes the validators of the tables behind a resource with a single
+    aggregate query.
+
+    Args:
+        models: model classes the resource is built from
+    Returns:
+        etag, last_modified (None if the tables have no timestamps)
+    """
+    state = []
+    aggregates = []
+    for model in models:
+        if reference_cache.covers(model):
+            reference = reference_cache.get()
+            state.extend((reference.version, reference.last_modified))
+        else:
+            aggregates.extend(table_aggregates(model))
+    if aggregates:
+        ensure_table(db.session.connection())
+        state.extend(db.session.execute(select(aggregates)).first())
+
+    dates = [to_utc(value) for value in state]
+    dates = [date for date in dates if date is not None]
+    last_modified = max(dates) if dates else None
+
+    # The representation also depends on the URL (filters, pages) and
+    # on the negotiated format (JSON / NDJSON).
+    seed = repr((request.full_path, request.headers.get('Accept'),
+                 tuple(state)))
+    etag = hashlib.sha1(seed.encode('utf-8')).hexdigest()
+    return etag, last_modified
+
+
+def is_not_modified(etag):
+    """
+    Evaluates If-None-Match (RFC 7232, section 3.2). If-Modified-Since is
+    ignored, the date can't tell deletes and updates within the same second.
+    """
+    return request.if_none_match.contains_weak(etag)
+
+
+def set_validators(response, etag, last_modified):
+    # Weak ETag, the same resource can be sent with a different encoding
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.vary.add('Accept')
+    return response
+
+
+def conditional(*models):
+    """
+    Decorator for GET views that honours If-None-Match, based on the tables
+    of models.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag, last_modified = get_validators(*models)
+            if is_not_modified(etag):
+                return set_validators(
+                    make_response('', 304), etag, last_modified)
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                set_validators(response, etag, last_modified)
+            return response
+        return decorated_function
+    return decorator
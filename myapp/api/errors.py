@@ -0,0 +1,35 @@
+from flask import jsonify
+
+from . import api
+
+from myapp.exceptions import ValidationError
+
+
+# Error responses for the api blueprint are always JSON, clients of the API
+# are not expected to render the HTML error pages.
+
+
+def bad_request(message):
+    """
+    Returns a JSON 400 Bad Request response with an explanatory message.
+    """
+    response = jsonify({'error': 'bad request', 'message': message})
+    response.status_code = 400
+    return response
+
+
+def unauthorized(message):
+    """
+    Returns a JSON 401 Unauthorized response, asking for HTTP Basic
+    authentication.
+    """
+    response = jsonify({'error': 'unauthorized', 'message': message})
+    response.status_code = 401
+    response.headers['WWW-Authenticate'] = 'Basic realm="myapp"'
+    return response
+
+
+# Using errorhandler, only requests handled by the api blueprint are affected.
+@api.errorhandler(ValidationError)
+def validation_error(e):
+    return bad_request(e.args[0])
@@ -0,0 +1,129 @@
+import csv
+import io
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import and_, select
+
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import DistributionCenter
+from myapp.models.db_models import StoreStatus
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+
+from .streaming import iter_select
+
+
+# CSV export of stores and store components
+# For spreadsheets: internal ids are replaced by the store keys and the
+# distribution center, status and component type names, joined in the export
+# query.
+# Rows are read from a server-side cursor and written through the csv module
+# in chunks of API_STREAM_BATCH_SIZE rows, so memory stays constant however
+# many rows are exported. Used by /api/stores.csv, /api/store_components.csv
+# and flask export-csv.
+
+STORE_COLUMNS = (
+    ('country_code', Store.country_code),
+    ('number', Store.number),
+    ('name', Store.name),
+    ('dc_number', DistributionCenter.number),
+    ('dc_name', DistributionCenter.name),
+    ('status', StoreStatus.name),
+    ('street_name', Store.street_name),
+    ('street_number', Store.street_number),
+    ('postal_code', Store.postal_code),
+    ('city', Store.city),
+    ('created_date', Store.created_date),
+    ('updated_date', Store.updated_date)
+    )
+
+STORE_COMPONENT_COLUMNS = (
+    ('country_code', Store.country_code),
+    ('store_number', Store.number),
+    ('store_name', Store.name),
+    ('component_type', ComponentType.name),
+    ('hostname', StoreComponent.hostname),
+    ('ip_address', StoreComponent.ip_address),
+    ('created_date', StoreComponent.created_date),
+    ('updated_date', StoreComponent.updated_date)
+    )
+
+
+def select_columns(columns):
+    return select([column.label(name) for name, column in columns])
+
+
+def select_stores(criteria=()):
+    """
+    Returns the export query of stores, ordered by country_code, number.
+
+    Args:
+        criteria: list of filters on stores, see filters.py
+    """
+    return select_columns(STORE_COLUMNS).select_from(
+        Store.__table__.join(
+            DistributionCenter.__table__,
+            Store.dc_id == DistributionCenter.id).join(
+            StoreStatus.__table__,
+            Store.status_id == StoreStatus.id)).where(
+        and_(*criteria)).order_by(Store.country_code, Store.number)
+
+
+def select_store_components(criteria=()):
+    """
+    Returns the export query of store components, ordered by id (the
+    primary key, no sort needed).
+
+    Args:
+        criteria: list of filters on store components, see filters.py
+    """
+    return select_columns(STORE_COMPONENT_COLUMNS).select_from(
+        StoreComponent.__table__.join(
+            Store.__table__, StoreComponent.store_id == Store.id).join(
+            ComponentType.__table__,
+            StoreComponent.type_id == ComponentType.id)).where(
+        and_(*criteria)).order_by(StoreComponent.id)
+
+
+EXPORTS = {
+    'stores': (STORE_COLUMNS, select_stores),
+    'store_components': (STORE_COMPONENT_COLUMNS, select_store_components)
+}
+
+
+def generate_csv(name, criteria=()):
+    """
+    Yields the CSV export of stores or store_components in chunks,
+    the first chunk is the header.
+    """
+    columns, select_rows = EXPORTS[name]
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column_name for column_name, column in columns])
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    count = 0
+    for row in iter_select(select_rows(criteria)):
+        writer.writerow(row)
+        count += 1
+        if count == batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if count:
+        yield buffer.getvalue()
+
+
+def csv_response(name, criteria=()):
+    """
+    Returns the streamed CSV download of stores or store_components.
+    """
+    return Response(
+        stream_with_context(generate_csv(name, criteria)),
+        mimetype='text/csv',
+        headers={'Content-Disposition':
+                 'attachment; filename={}.csv'.format(name)})
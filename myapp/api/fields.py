@@ -0,0 +1,33 @@
+from flask import request
+
+from myapp.exceptions import ValidationError
+
+
+# Sparse fieldsets (?fields=country_code,number,name)
+# Only the requested columns are selected (see select_fields in
+# myapp/models/db_rows.py) and serialized, which cuts database I/O and
+# JSON size together.
+# Field names are the keys of the model's to_dict (api_fields).
+
+
+def get_fields(model):
+    """
+    Returns the fields requested with ?fields=, all api_fields if the
+    argument is not given.
+
+    Args:
+        model: model class (or cached row class) with api_fields
+    Raises:
+        ValidationError for unknown fields.
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return model.api_fields
+    fields = tuple(field.strip() for field in value.split(',')
+                   if field.strip())
+    if not fields:
+        raise ValidationError('fields must not be empty')
+    unknown = [field for field in fields if field not in model.api_fields]
+    if unknown:
+        raise ValidationError('unknown fields: {}'.format(', '.join(unknown)))
+    return fields
@@ -0,0 +1,257 @@
+import ipaddress
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import false, or_, select
+
+from myapp.exceptions import ValidationError
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_types import ip_network_range, ip_range
+from myapp.models.db_types import parse_ip_address
+
+
+# Filtering and sorting of the collection resources
+# Query arguments are compiled into the WHERE clause of a single SQL query,
+# e.g.
+#   /api/stores?country_code=BE&status=Open&sort=-id
+#   /api/store_components?store=BE-101&component_type=backoffice
+#   /api/store_components?ip=10.12.0.0/16,10.14.0.0/16
+#   /api/store_components?ip_from=10.12.0.1&ip_to=10.12.3.255
+# Arguments accepting a list take comma separated values (country_code=BE,LU).
+# Distribution centers and store statuses are given by their natural keys
+# (dc=BE-1, status=Open) and component types by name, they are resolved to
+# ids with the reference data cache, so the filter runs on the indexed
+# dc_id / status_id / type_id columns.
+#
+# Only sort keys backed by an index are supported, a leading '-' sorts
+# descending. Every sort key is unique so it can be used for keyset pagination.
+# id follows the order of creation (-id lists the newest rows first), the
+# timestamps are no sort keys: they are not unique and on SQLite the
+# server_default values are stored without the microseconds SQLAlchemy binds,
+# so they can't be compared for equality in a cursor.
+
+STORE_SORTS = {
+    'country_code,number': (Store.country_code, Store.number),
+    'id': (Store.id,)
+}
+
+STORE_COMPONENT_SORTS = {
+    'id': (StoreComponent.id,)
+}
+
+DATE_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+# All addresses per IP version, bounds of the ranges with one open end
+ALL_ADDRESSES = {
+    4: ipaddress.ip_network('0.0.0.0/0'),
+    6: ipaddress.ip_network('::/0')
+}
+
+
+def get_list(name):
+    """ Returns the comma separated values of argument name, or None """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    values = [item.strip() for item in value.split(',') if item.strip()]
+    if not values:
+        raise ValidationError('{} must not be empty'.format(name))
+    return values
+
+
+def get_date(name):
+    """ Returns argument name as datetime (ISO 8601, UTC), or None """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValidationError(
+        '{} must be an ISO 8601 date, e.g. 2018-01-31T12:00:00'.format(name))
+
+
+def parse_key(name, value):
+    """
+    Parses a natural key like BE-101 into country_code, number.
+    """
+    country_code, _, number = value.partition('-')
+    try:
+        return country_code, int(number)
+    except ValueError:
+        raise ValidationError(
+            '{} must be given as <country_code>-<number>, e.g. BE-101'.format(
+                name))
+
+
+def get_sort(sorts, default):
+    """
+    Returns the sort key requested with ?sort=.
+
+    Args:
+        sorts: dict of supported sort keys
+        default: name of the default sort key
+    Returns:
+        keys (tuple of column attributes), descending (boolean)
+    Raises:
+        ValidationError for unsupported sort keys.
+    """
+    value = request.args.get('sort', default)
+    descending = value.startswith('-')
+    keys = sorts.get(value[1:] if descending else value)
+    if keys is None:
+        raise ValidationError('unsupported sort: {} (supported: {})'.format(
+            value, ', '.join(sorted(sorts))))
+    return keys, descending
+
+
+def get_networks(name):
+    """
+    Returns the comma separated networks of argument name as IPv4Network or
+    IPv6Network (CIDR notation, a single address is a network), or None.
+    """
+    values = get_list(name)
+    if values is None:
+        return None
+    try:
+        return [ipaddress.ip_network(value, strict=False) for value in values]
+    except ValueError:
+        raise ValidationError(
+            '{} must be given as networks in CIDR notation, '
+            'e.g. 10.12.0.0/16'.format(name))
+
+
+def get_ip_address(name):
+    """ Returns argument name as IPv4Address or IPv6Address, or None """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_ip_address(value)
+    except ValueError:
+        raise ValidationError(
+            '{} must be an IP address, e.g. 10.12.0.1'.format(name))
+
+
+def changed_since(model, since):
+    """
+    Rows created or updated since the given date. updated_date is only set
+    on updates, so both timestamps are checked (each has its own index).
+    """
+    return or_(model.updated_date >= since, model.created_date >= since)
+
+
+def store_filters():
+    """
+    Returns the criteria for the filters country_code, dc, status, city and
+    updated_since on stores.
+    """
+    criteria = []
+
+    country_codes = get_list('country_code')
+    if country_codes:
+        criteria.append(Store.country_code.in_(country_codes))
+
+    dcs = get_list('dc')
+    if dcs:
+        reference = reference_cache.get()
+        dc_ids = []
+        for dc in dcs:
+            key = parse_key('dc', dc)
+            if key not in reference.distribution_centers_by_key:
+                raise ValidationError('unknown dc: {}'.format(dc))
+            dc_ids.append(reference.distribution_centers_by_key[key].id)
+        criteria.append(Store.dc_id.in_(dc_ids))
+
+    statuses = get_list('status')
+    if statuses:
+        reference = reference_cache.get()
+        status_ids = []
+        for status in statuses:
+            if status not in reference.store_status_by_name:
+                raise ValidationError('unknown status: {}'.format(status))
+            status_ids.append(reference.store_status_by_name[status].id)
+        criteria.append(Store.status_id.in_(status_ids))
+
+    city = request.args.get('city')
+    if city:
+        criteria.append(Store.city == city)
+
+    updated_since = get_date('updated_since')
+    if updated_since:
+        criteria.append(changed_since(Store, updated_since))
+
+    return criteria
+
+
+def component_type_filter(names, column=StoreComponent.type_id):
+    """
+    Returns the criterion for the component types names on the indexed
+    type_id column, names are resolved with the reference data cache.
+    Unknown names match no components.
+    """
+    type_ids = ComponentType.get_ids(names)
+    if not type_ids:
+        return false()
+    return column.in_(type_ids)
+
+
+def store_component_filters():
+    """
+    Returns the criteria for the filters component_type, store,
+    country_code, ip, ip_from, ip_to and updated_since on store components.
+    """
+    criteria = []
+
+    component_types = get_list('component_type')
+    if component_types:
+        criteria.append(component_type_filter(component_types))
+
+    # Stores are resolved by a subquery on uq_stores_1, no join needed
+    stores = get_list('store')
+    if stores:
+        keys = [parse_key('store', store) for store in stores]
+        store_ids = select([Store.id]).where(or_(*[
+            (Store.country_code == country_code) & (Store.number == number)
+            for country_code, number in keys]))
+        criteria.append(StoreComponent.store_id.in_(store_ids))
+
+    country_codes = get_list('country_code')
+    if country_codes:
+        store_ids = select([Store.id]).where(
+            Store.country_code.in_(country_codes))
+        criteria.append(StoreComponent.store_id.in_(store_ids))
+
+    # Networks and ranges are range scans of ix_store_components_ip_address
+    networks = get_networks('ip')
+    if networks:
+        criteria.append(or_(*[
+            ip_network_range(StoreComponent.ip_address, network)
+            for network in networks]))
+
+    ip_from = get_ip_address('ip_from')
+    ip_to = get_ip_address('ip_to')
+    if ip_from is not None or ip_to is not None:
+        if (ip_from is not None and ip_to is not None and
+                ip_from.version != ip_to.version):
+            raise ValidationError(
+                'ip_from and ip_to must be of the same IP version')
+        # An open end is the first or last address of the IP version of
+        # the other one, not of the whole column
+        version = (ip_to if ip_from is None else ip_from).version
+        addresses = ALL_ADDRESSES[version]
+        criteria.append(ip_range(
+            StoreComponent.ip_address,
+            addresses.network_address if ip_from is None else ip_from,
+            addresses.broadcast_address if ip_to is None else ip_to))
+
+    updated_since = get_date('updated_since')
+    if updated_since:
+        criteria.append(changed_since(StoreComponent, updated_since))
+
+    return criteria
@@ -0,0 +1,175 @@
+import base64
+import binascii
+import json
+
+from flask import current_app, jsonify, request, url_for
+from sqlalchemy import and_, or_
+
+from myapp.exceptions import ValidationError
+from myapp.models.db_orm import db
+
+
+# Keyset (cursor) pagination
+# Instead of OFFSET, which makes the database walk and discard every row
+# before the requested page, we remember the sort key of the last row that
+# was returned and seek past it: WHERE (key) > (last key) ORDER BY key LIMIT n.
+# With an index on the sort key (e.g. uq_stores_1 on country_code, number)
+# page 1000 costs the same as page 1.
+# The cursor is handed out as an opaque token, clients should not parse it.
+# Sort keys can be ascending or descending (see filters.py for the supported
+# sort keys), all columns of a sort key share the same direction.
+
+
+def encode_cursor(values):
+    """
+    Encodes the sort key values of the last row of a page as an opaque token.
+
+    Args:
+        values: list of JSON serializable sort key values
+    Returns:
+        URL safe cursor string
+    """
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """
+    Decodes a cursor created by encode_cursor.
+
+    Args:
+        cursor: string, opaque cursor token
+        keys: tuple of the column attributes of the sort key, each value
+            must be of the Python type of its column
+    Returns:
+        list of sort key values
+    Raises:
+        ValidationError if the cursor is malformed.
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(
+            base64.urlsafe_b64decode(cursor + padding).decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError('invalid cursor')
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValidationError('invalid cursor')
+    for key, value in zip(keys, values):
+        # bool is an int in Python, null and objects can't be compared
+        if (not isinstance(value, key.type.python_type) or
+                isinstance(value, bool)):
+            raise ValidationError('invalid cursor')
+    return values
+
+
+def is_paginated():
+    """ Returns True if the client asked for a page (?limit= or ?after=) """
+    return 'limit' in request.args or 'after' in request.args
+
+
+def get_limit():
+    """
+    Returns the requested page size from ?limit=, capped by
+    API_MAX_PAGE_SIZE. Falls back to API_PAGE_SIZE.
+    """
+    limit = request.args.get('limit')
+    if limit is None:
+        return current_app.config['API_PAGE_SIZE']
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValidationError('limit must be an integer')
+    if limit < 1:
+        raise ValidationError('limit must be positive')
+    return min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+
+
+def order(keys, descending=False):
+    """ Returns the ORDER BY clauses for the sort key """
+    if descending:
+        return [key.desc() for key in keys]
+    return list(keys)
+
+
+def seek(keys, values, descending=False):
+    """
+    Builds the WHERE clause that seeks past the row with the given
+    sort key values.
+    The leading column gets a plain range condition so the database can use
+    a range scan on the index, the remaining columns break the ties:
+    c1 >= v1 AND (c1 > v1 OR (c1 = v1 AND c2 > v2) ...)
+    """
+    def past(key, value):
+        return key < value if descending else key > value
+
+    conditions = []
+    for i, key in enumerate(keys):
+        equal = [keys[j] == values[j] for j in range(i)]
+        conditions.append(and_(*(equal + [past(key, values[i])])))
+    if descending:
+        leading = keys[0] <= values[0]
+    else:
+        leading = keys[0] >= values[0]
+    return and_(leading, or_(*conditions))
+
+
+def paginate(statement, keys, descending=False):
+    """
+    Applies keyset pagination to a select statement when ?limit= or ?after=
+    is given. Without these arguments the full result is returned.
+
+    Args:
+        statement: Core select, it must include the columns of keys
+        keys: tuple of unique column attributes used as sort key
+        descending: boolean, sort direction
+    Returns:
+        rows, next_cursor (None if there is no next page)
+    """
+    statement = statement.order_by(*order(keys, descending))
+    if not is_paginated():
+        return db.session.execute(statement).fetchall(), None
+
+    limit = get_limit()
+    after = request.args.get('after')
+    if after:
+        statement = statement.where(
+            seek(keys, decode_cursor(after, keys), descending))
+
+    # Fetch one extra row to know if there is a next page
+    items = db.session.execute(statement.limit(limit + 1)).fetchall()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], key.key) for key in keys])
+
+
+def next_url(cursor):
+    """
+    Returns the absolute URL of the next page for the current request.
+    """
+    args = request.args.to_dict()
+    args.update(request.view_args or {})
+    args['after'] = cursor
+    args['limit'] = get_limit()
+    return url_for(request.endpoint, _external=True, **args)
+
+
+def add_link_header(response, cursor):
+    """
+    Adds the RFC 5988 Link header pointing to the next page, if any.
+    """
+    if cursor is not None:
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url(cursor))
+    return response
+
+
+def jsonify_page(name, data, cursor):
+    """
+    Returns the JSON response for a collection, e.g. {"stores": [...]}.
+    Paginated responses also carry the next cursor in the body (null on the
+    last page) and in the Link header.
+    """
+    payload = {name: data}
+    if is_paginated():
+        payload['next'] = cursor
+    return add_link_header(jsonify(payload), cursor)
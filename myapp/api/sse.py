@@ -0,0 +1,133 @@
+import json
+import queue
+
+from flask import Response, current_app, request
+
+from myapp.exceptions import ValidationError
+from myapp.events import Subscription, event_broker, select_changes
+from myapp.events import to_event
+from myapp.models.db_orm import db
+
+from .filters import get_list, parse_key
+
+
+# Server-Sent Events (text/event-stream) for /api/events
+# https://html.spec.whatwg.org/multipage/server-sent-events.html
+# Every event carries the id of its change, browsers send it back in the
+# Last-Event-ID header when they reconnect and the missed events are replayed
+# from the change log. Replays are bounded by EVENTS_REPLAY_LIMIT, beyond
+# that the client gets a reset event and should resync with /api/changes.
+#
+# The response is not wrapped in stream_with_context: the request context,
+# and with it the database session, ends before the first event is sent.
+
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+
+
+def format_event(data, event=None, id=None):
+    """ Returns an event in the text/event-stream format """
+    lines = []
+    if id is not None:
+        lines.append('id: {}'.format(id))
+    if event is not None:
+        lines.append('event: {}'.format(event))
+    lines.append('data: {}'.format(json.dumps(data, separators=(',', ':'))))
+    return '\n'.join(lines) + '\n\n'
+
+
+def get_subscription():
+    """
+    Returns the Subscription for the filters country_code, store and
+    component_type (comma separated lists).
+    """
+    stores = get_list('store')
+    if stores:
+        stores = ['{}-{}'.format(*parse_key('store', store))
+                  for store in stores]
+    return Subscription(
+        country_codes=get_list('country_code'),
+        stores=stores,
+        component_types=get_list('component_type'),
+        maxsize=current_app.config['EVENTS_QUEUE_SIZE'])
+
+
+def get_last_event_id():
+    """ Returns the Last-Event-ID header (or argument) as int, or None """
+    value = request.headers.get(
+        'Last-Event-ID', request.args.get('last_event_id'))
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError('invalid Last-Event-ID')
+
+
+def get_replay(subscription, last_event_id):
+    """
+    Returns the matching events after last_event_id, and True if there are
+    more than EVENTS_REPLAY_LIMIT changes to go through.
+    """
+    limit = current_app.config['EVENTS_REPLAY_LIMIT']
+    changes = db.session.execute(
+        select_changes(last_event_id).limit(limit + 1)).fetchall()
+    events = [to_event(change) for change in changes[:limit]]
+    return ([event for event in events if subscription.matches(event)],
+            len(changes) > limit)
+
+
+def generate_events(subscription, last_event_id, replay, app):
+    """
+    Yields the replayed events, then the published events until the client
+    disconnects. A comment is sent every EVENTS_KEEPALIVE seconds so proxies
+    keep the connection open. Waiting on the queue blocks a thread, or only
+    a greenlet under the gevent workers of gunicorn.conf.py.
+    """
+    keepalive = app.config['EVENTS_KEEPALIVE']
+    try:
+        yield ': connected\n\n'
+        for event in replay:
+            last_event_id = event['id']
+            yield format_event(event, event['resource'], event['id'])
+        while True:
+            # A subscriber that fell behind is disconnected once its queue
+            # is drained, it reconnects with its Last-Event-ID
+            if subscription.lost and subscription.queue.empty():
+                break
+            try:
+                event = subscription.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            # Events published while the replay was read
+            if last_event_id is not None and event['id'] <= last_event_id:
+                continue
+            last_event_id = event['id']
+            yield format_event(event, event['resource'], event['id'])
+    finally:
+        event_broker.unsubscribe(subscription, app)
+
+
+def stream_events():
+    """
+    Returns the text/event-stream response of the current request.
+    """
+    subscription = get_subscription()
+    last_event_id = get_last_event_id()
+    app = current_app._get_current_object()
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    # Subscribe before reading the replay, so no event falls in between
+    event_broker.subscribe(subscription)
+    replay = []
+    if last_event_id is not None:
+        replay, reset = get_replay(subscription, last_event_id)
+        if reset:
+            event_broker.unsubscribe(subscription, app)
+            return Response(
+                format_event({'message': 'too many changes, resync with '
+                              '/api/changes'}, 'reset'),
+                mimetype=EVENT_STREAM_MIMETYPE, headers=headers)
+    return Response(
+        generate_events(subscription, last_event_id, replay, app),
+        mimetype=EVENT_STREAM_MIMETYPE, headers=headers)
@@ -0,0 +1,121 @@
+from flask import Response, current_app, json, request, stream_with_context
+from sqlalchemy.sql import Select
+
+from myapp.models.db_orm import db
+
+from .pagination import is_paginated
+
+
+# Streaming responses for the collection resources
+# A regular response materializes every ORM object, every dict and the full
+# JSON document before the first byte is sent. In streaming mode rows are
+# fetched in batches from a server-side cursor (yield_per / stream_results)
+# and written out through a generator, so memory stays flat no matter how big
+# the table is and the first bytes are sent right away.
+#
+# Two formats are available:
+#   - Accept: application/x-ndjson, one JSON document per line.
+#   - ?stream=1, the regular {"stores": [...]} document, written incrementally
+#     for clients that can't switch to NDJSON.
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    """ Returns True if the client prefers NDJSON over JSON """
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def wants_stream():
+    """
+    Returns True if the collection should be streamed, either as NDJSON or
+    as incrementally written JSON (?stream=1). A paginated request returns
+    a bounded page and is never streamed.
+    """
+    if is_paginated():
+        return False
+    return request.args.get('stream') in ('1', 'true') or wants_ndjson()
+
+
+def iter_select(statement):
+    """
+    Iterates over the rows of a select statement using a server-side cursor
+    where the database driver supports it, fetching API_STREAM_BATCH_SIZE
+    rows at a time.
+    """
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+    result = db.session.execute(
+        statement.execution_options(stream_results=True))
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        result.close()
+
+
+def generate_ndjson(rows, serialize):
+    """ Yields chunks of NDJSON, one line per row """
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(serialize(row)))
+        if len(chunk) >= batch_size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def generate_json(name, rows, serialize):
+    """ Yields chunks of the JSON document {"<name>": [...]} """
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+    yield '{{{}:['.format(json.dumps(name))
+    chunk = []
+    separator = ''
+    for row in rows:
+        chunk.append(json.dumps(serialize(row)))
+        if len(chunk) >= batch_size:
+            yield separator + ','.join(chunk)
+            chunk = []
+            separator = ','
+    if chunk:
+        yield separator + ','.join(chunk)
+    yield ']}'
+
+
+def stream_collection(name, rows, fields, serialize=None):
+    """
+    Returns a streamed response for a collection.
+
+    Args:
+        name: string, top level key of the JSON document, e.g. 'stores'
+        rows: Core select of fields (see myapp/models/db_rows.py), ordered
+            as the client should receive it, or an iterable of objects with
+            to_dict (e.g. cached rows)
+        fields: tuple of the serialized fields, see fields.py
+        serialize: function returning a JSON serializable object for a row
+    Returns:
+        Response with a generator as body
+    """
+    if isinstance(rows, Select):
+        rows = iter_select(rows)
+        if serialize is None:
+            def serialize(row):
+                return dict(zip(fields, row))
+    elif serialize is None:
+        def serialize(row):
+            return row.to_dict(fields)
+    if wants_ndjson():
+        generator = generate_ndjson(rows, serialize)
+        mimetype = NDJSON_MIMETYPE
+    else:
+        generator = generate_json(name, rows, serialize)
+        mimetype = 'application/json'
+    # stream_with_context keeps the request (and database session) around
+    # while the generator is running.
+    return Response(stream_with_context(generator), mimetype=mimetype)
@@ -1,13 +1,56 @@
-from flask import jsonify, render_template
+from collections import OrderedDict
 
-from . import api
+from flask import abort, current_app, jsonify, render_template, request
+from flask import url_for
+from flask_login import current_user
+from sqlalchemy import and_, or_, select
 
+from . import api
+from .auth import auth_required
+from .batch import get_batch_items, parse_store_key, write_batch
+from .conditional import conditional
+from .export import csv_response
+from .fields import get_fields
+from .filters import STORE_SORTS, STORE_COMPONENT_SORTS
+from .filters import store_filters, store_component_filters, get_sort
+from .filters import component_type_filter
+from .filters import get_list
+from .pagination import decode_cursor, encode_cursor, get_limit
+from .pagination import jsonify_page, order, paginate
+from .sse import stream_events
+from .streaming import stream_collection, wants_stream
+
+from myapp.exceptions import ValidationError
+from myapp.extensions import csrf
+from myapp.models.db_orm import db
 from myapp.models.db_models import User
 from myapp.models.db_models import Country
 from myapp.models.db_models import DistributionCenter
 from myapp.models.db_models import StoreStatus
 from myapp.models.db_models import Store
+from myapp.models.db_models import ComponentType
 from myapp.models.db_models import StoreComponent
+from myapp.models.db_models import Statistic
+from myapp.models.db_models import Change
+from myapp.models.db_changes import get_changes
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_stats import get_statistics
+from myapp.models.db_rows import StoreRow, StoreComponentRow
+from myapp.models.db_rows import select_fields, to_dicts
+
+
+# GET resources answer 304 Not Modified when If-None-Match still matches
+# the tables behind them, see conditional.py
+
+# All resources accept ?fields= to only select and return the given fields,
+# e.g. /api/stores?fields=country_code,number,name,status_id, see fields.py
+
+# Rows are read with Core select statements and serialized without building
+# ORM instances, the output is the same as to_dict(), see db_rows.py
+
+# All collection resources can be streamed with Accept: application/x-ndjson
+# (one JSON document per line) or ?stream=1 (same JSON document as usual,
+# written incrementally), see streaming.py
 
 
 # http://localhost:5000/api
@@ -23,32 +66,42 @@ def overview():
 
 # Collection resource is /api/users
 @api.route('/users', methods=['GET'])
+@conditional(User)
 def get_users():
     """
     The endpoint is for now publicly available.
     Returns:
         JSON of all users
     """
-    users = User.query  # no need to order
-    users_data = [user.to_dict() for user in users.all()]
+    fields = get_fields(User)
+    users = select_fields(User, fields)  # no need to order
+    if wants_stream():
+        return stream_collection(
+            'users', users.order_by(User.id), fields)
+    users_data = to_dicts(db.session.execute(users), fields)
     return jsonify(users=users_data)
 
 
 # Collection resource is /api/countries
 @api.route('/countries', methods=['GET'])
+@conditional(Country)
 def get_countries():
     """
     The endpoint is for now publicly available.
     Returns:
         JSON of all countries.
     """
-    countries = Country.query  # no need to order
-    countries_data = [country.to_dict() for country in countries.all()]
+    countries = Country.get_all()  # cached
+    fields = get_fields(Country)
+    if wants_stream():
+        return stream_collection('countries', countries, fields)
+    countries_data = [country.to_dict(fields) for country in countries]
     return jsonify(countries=countries_data)
 
 
 # Instance resource is /api/countries/country_code
 @api.route('/countries/<country_code>', methods=['GET'])
+@conditional(Country)
 def get_country_by_country_code(country_code):
     """
     The endpoint is for now publicly available.
@@ -56,28 +109,35 @@ def get_country_by_country_code(country_code):
         JSON of all countries using using country_code.
     """
     # string is default converter for dynamic routes
-    # get_or_404() is like get() but aborts with 404 if not found
-    # instead of returning None.
-    return jsonify(Country.query.get_or_404(country_code).to_dict())
+    # Served from the reference data cache, aborts with 404 if not found.
+    country = Country.get(country_code)
+    if country is None:
+        abort(404)
+    return jsonify(country.to_dict(get_fields(Country)))
 
 
 # Distribution Centers
 
 # Collection resource is /api/distribution_centers
 @api.route('/distribution_centers', methods=['GET'])
+@conditional(DistributionCenter)
 def get_distribution_centers():
     """
     The endpoint is for now publicly available.
     Returns:
         JSON of all distribution centers.
     """
-    dcs = DistributionCenter.query  # no need to order
-    dcs_data = [dc.to_dict() for dc in dcs.all()]
+    dcs = DistributionCenter.get_all()  # cached
+    fields = get_fields(DistributionCenter)
+    if wants_stream():
+        return stream_collection('distribution_centers', dcs, fields)
+    dcs_data = [dc.to_dict(fields) for dc in dcs]
     return jsonify(distribution_centers=dcs_data)
 
 
 # Instance resource is /api/distribution_centers/country_code
 @api.route('/distribution_centers/<country_code>', methods=['GET'])
+@conditional(DistributionCenter)
 def get_distribution_center_by_country_code(country_code):
     """
 
@@ -85,21 +145,26 @@ def get_distribution_center_by_country_code(country_code):
     Returns:
         JSON of all distribution centers using country_code.
     """
-    return jsonify(DistributionCenter.query.get_or_404(country_code).to_dict())
+    return jsonify(DistributionCenter.query.get_or_404(country_code).to_dict(
+        get_fields(DistributionCenter)))
 
 
 # Store Statuses
 
 # Collection resource is /api/store_status
 @api.route('/store_status', methods=['GET'])
+@conditional(StoreStatus)
 def get_store_status():
     """
     The endpoint is for now publicly available.
     Returns:
         JSON of all store statuses.
     """
-    statuses = StoreStatus.query  # no need to order
-    status_data = [status.to_dict() for status in statuses.all()]
+    statuses = StoreStatus.get_all()  # cached
+    fields = get_fields(StoreStatus)
+    if wants_stream():
+        return stream_collection('store_status', statuses, fields)
+    status_data = [status.to_dict(fields) for status in statuses]
     return jsonify(store_status=status_data)
 
 
@@ -107,19 +172,158 @@ def get_store_status():
 
 # Collection resource is /api/stores
 @api.route('/stores', methods=['GET'])
+@conditional(Store)
 def get_stores():
     """
     The endpoint is for now publicly available.
+    Supports keyset pagination with ?limit= and ?after=<cursor>, seeking on
+    the sort key, by default the unique country_code, number (uq_stores_1).
+    Filters: country_code, dc, status, city, updated_since, see filters.py
+    Sort keys: country_code,number (default), id
     Returns:
         JSON of all stores.
     """
-    stores = Store.query  # no need to order
-    stores_data = [store.to_dict() for store in stores.all()]
-    return jsonify(stores=stores_data)
+    keys, descending = get_sort(STORE_SORTS, 'country_code,number')
+    fields = get_fields(Store)
+    stores = select_fields(Store, fields, keys).where(and_(*store_filters()))
+    if wants_stream():
+        return stream_collection(
+            'stores', stores.order_by(*order(keys, descending)), fields)
+    stores, cursor = paginate(stores, keys, descending)
+    stores_data = to_dicts(stores, fields)
+    return jsonify_page('stores', stores_data, cursor)
+
+
+# CSV export of the stores, accepts the filters of /api/stores
+@api.route('/stores.csv', methods=['GET'])
+@conditional(Store)
+def get_stores_csv():
+    """
+    The endpoint is for now publicly available.
+    Filters: country_code, dc, status, city, updated_since, see filters.py
+    Returns:
+        CSV of the stores with dc and status names, see export.py
+    """
+    return csv_response('stores', store_filters())
+
+
+def chunks(items, size):
+    """ Yields successive lists of at most size items """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_lookup_keys():
+    """
+    Returns the unique store keys (country_code, number) of a lookup request
+    body, in the requested order. Keys are given as 'BE-101' or as
+    {"country_code": "BE", "number": 101}.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('stores'), list):
+        raise ValidationError('expected a JSON object with a list of stores')
+    max_stores = current_app.config['API_LOOKUP_MAX_STORES']
+    if len(data['stores']) > max_stores:
+        raise ValidationError(
+            'at most {} stores can be looked up at once'.format(max_stores))
+    keys = OrderedDict()
+    for item in data['stores']:
+        keys[parse_store_key(item)] = None
+    return list(keys)
+
+
+# Stores can be looked up in batch, e.g. by the POS integration:
+# POST /api/stores/lookup
+# {"stores": ["BE-1", "LU-3", ...], "components": true}
+@api.route('/stores/lookup', methods=['POST'])
+@csrf.exempt
+def lookup_stores():
+    """
+    The endpoint is for now publicly available, it doesn't change any data
+    so CSRF protection is not needed.
+    The stores are retrieved with one query per chunk of
+    API_LOOKUP_CHUNK_SIZE keys (and one more for their components),
+    distribution center and status names come from the reference data cache.
+    Returns:
+        JSON of the stores found, in the requested order, with dc and status
+        names and optionally their components. Unknown keys are listed
+        in not_found.
+    """
+    keys = get_lookup_keys()
+    with_components = bool(request.get_json().get('components'))
+    chunk_size = current_app.config['API_LOOKUP_CHUNK_SIZE']
+
+    found = {}
+    for chunk in chunks(keys, chunk_size):
+        # (country_code = 'BE' AND number IN (...)) OR ..., one range of
+        # uq_stores_1 per country
+        numbers = OrderedDict()
+        for country_code, number in chunk:
+            numbers.setdefault(country_code, []).append(number)
+        stores = StoreRow.fetch(StoreRow.select().where(or_(*[
+            and_(Store.country_code == country_code, Store.number.in_(n))
+            for country_code, n in numbers.items()])))
+        for store in stores:
+            store_data = store.to_dict()
+            store_data['dc'] = DistributionCenter.get_name(store.dc_id)
+            store_data['status'] = StoreStatus.get_name(store.status_id)
+            found[(store.country_code, store.number)] = (store.id, store_data)
+
+        chunk_stores = dict(found[key] for key in chunk if key in found)
+        if with_components and chunk_stores:
+            for store_data in chunk_stores.values():
+                store_data['components'] = []
+            components = StoreComponentRow.fetch(
+                StoreComponentRow.select().where(
+                    StoreComponent.store_id.in_(list(chunk_stores))).order_by(
+                    StoreComponent.id))
+            for component in components:
+                chunk_stores[component.store_id]['components'].append(
+                    component.to_dict())
+
+    return jsonify(
+        stores=[found[key][1] for key in keys if key in found],
+        not_found=['{}-{}'.format(*key) for key in keys if key not in found])
+
+
+# Stores are written in batch, e.g. by the ERP integration:
+# POST /api/stores/batch creates stores
+# PATCH /api/stores/batch creates or updates stores (upsert), only the given
+# fields are updated
+# DELETE /api/stores/batch deletes stores and their components
+# {"stores": [{"country_code": "BE", "number": 101, "name": ...}, ...]}
+# DELETE also accepts the keys only: {"stores": ["BE-101", ...]}
+BATCH_ACTIONS = {'POST': 'create', 'PATCH': 'upsert', 'DELETE': 'delete'}
+
+
+@api.route('/stores/batch', methods=['POST', 'PATCH', 'DELETE'])
+@csrf.exempt
+@auth_required
+def write_stores():
+    """
+    The endpoint requires authentication, stores can only be changed or
+    deleted by the user who created them.
+    CSRF protection is not needed, the body must be sent as
+    application/json, which a cross-site form can't do.
+    Batches are written in chunks of API_BATCH_CHUNK_SIZE stores, see batch.py
+    Returns:
+        JSON of the counts per result and the result of every store, in the
+        requested order.
+    """
+    results = write_batch(
+        get_batch_items(), BATCH_ACTIONS[request.method],
+        int(current_user.get_id()))
+    counts = OrderedDict(
+        (name, 0) for name in ('created', 'updated', 'deleted', 'errors'))
+    for item in results:
+        counts[item.get('result', 'errors')] += 1
+    counts['results'] = results
+    return jsonify(counts)
 
 
 # Instance resource is /api/stores/number
 @api.route('/stores/<int:number>', methods=['GET'])
+@conditional(Store)
 def get_store_by_number(number):
     """
 
@@ -127,14 +331,19 @@ def get_store_by_number(number):
     Returns:
         JSON of store using number.
     """
-    result_store = Store.query.filter(Store.number == number)
-    store_data = [
-        store.to_dict() for store in result_store.all()]
+    fields = get_fields(Store)
+    result_store = select_fields(Store, fields).where(
+        Store.number == number)
+    if wants_stream():
+        return stream_collection('store', result_store.order_by(
+            Store.country_code), fields)
+    store_data = to_dicts(db.session.execute(result_store), fields)
     return jsonify(store=store_data)
 
 
 # Instance resource is /api/stores/country_code
 @api.route('/stores/<country_code>', methods=['GET'])
+@conditional(Store)
 def get_store_by_country(country_code):
     """
 
@@ -142,38 +351,215 @@ def get_store_by_country(country_code):
     Returns:
         JSON of all stores using country_code.
     """
-    result_stores = Store.query.filter(Store.country_code == country_code)
-    stores_data = [
-        store.to_dict() for store in result_stores.all()]
+    fields = get_fields(Store)
+    result_stores = select_fields(Store, fields).where(
+        Store.country_code == country_code)
+    if wants_stream():
+        return stream_collection('stores', result_stores.order_by(
+            Store.number), fields)
+    stores_data = to_dicts(db.session.execute(result_stores), fields)
     return jsonify(stores=stores_data)
 
 
+# Instance resource is /api/stores/country_code/number/components
+@api.route('/stores/<country_code>/<int:number>/components', methods=['GET'])
+@conditional(Store, StoreComponent)
+def get_store_components_by_store(country_code, number):
+    """
+    The endpoint is for now publicly available.
+    The store and its components are read with one query, an outer join on
+    store_components (uq_store_components_1 starts with store_id).
+    Filters: type, a comma separated list of component types
+    Returns:
+        JSON of the store using country_code and number, with its components
+        grouped by component_type.
+    """
+    fields = get_fields(Store)
+    stores = Store.__table__
+    components = StoreComponent.__table__
+    component_types = ComponentType.__table__
+    # Component columns are labelled, their names overlap with the store's
+    on_clause = components.c.store_id == stores.c.id
+    types = get_list('type')
+    if types:
+        # In the join condition, so a store without matches is still found
+        on_clause = and_(
+            on_clause, component_type_filter(types, components.c.type_id))
+    component_columns = dict(
+        components.c, component_type=component_types.c.name)
+    store_components = select(
+        [stores.c[field] for field in fields] +
+        [component_columns[field].label('component_' + field)
+         for field in StoreComponent.api_fields]).select_from(
+        stores.outerjoin(components.join(
+            component_types,
+            components.c.type_id == component_types.c.id), on_clause)).where(
+        and_(stores.c.country_code == country_code,
+             stores.c.number == number)).order_by(
+        components.c.type_id, components.c.id)
+
+    store_data = None
+    components_data = OrderedDict()
+    for row in db.session.execute(store_components):
+        if store_data is None:
+            store_data = dict(zip(fields, row))
+        component = dict(zip(StoreComponent.api_fields, row[len(fields):]))
+        if component['component_type'] is not None:
+            components_data.setdefault(
+                component['component_type'], []).append(component)
+    if store_data is None:
+        abort(404)
+    return jsonify(store=store_data, components=components_data)
+
+
 # Store Components
 
 # Collection resource is /api/store_components
 @api.route('/store_components', methods=['GET'])
+@conditional(StoreComponent)
 def get_store_components():
     """
     The endpoint is for now publicly available.
+    Supports keyset pagination with ?limit= and ?after=<cursor>, seeking on
+    the sort key, by default the primary key id.
+    Filters: component_type, store, country_code, ip (networks in CIDR
+    notation), ip_from, ip_to, updated_since, see filters.py
+    Sort keys: id (default)
     Returns:
         JSON of all store components.
     """
-    store_components = StoreComponent.query  # no need to order
-    store_components_data = [
-        component.to_dict() for component in store_components.all()]
-    return jsonify(store_components=store_components_data)
+    keys, descending = get_sort(STORE_COMPONENT_SORTS, 'id')
+    fields = get_fields(StoreComponent)
+    store_components = select_fields(StoreComponent, fields, keys).where(
+        and_(*store_component_filters()))
+    if wants_stream():
+        return stream_collection(
+            'store_components',
+            store_components.order_by(*order(keys, descending)), fields)
+    store_components, cursor = paginate(store_components, keys, descending)
+    store_components_data = to_dicts(store_components, fields)
+    return jsonify_page(
+        'store_components', store_components_data, cursor)
+
+
+# CSV export of the store components, accepts the filters of
+# /api/store_components
+@api.route('/store_components.csv', methods=['GET'])
+@conditional(StoreComponent)
+def get_store_components_csv():
+    """
+    The endpoint is for now publicly available.
+    Filters: component_type, store, country_code, ip (networks in CIDR
+    notation), ip_from, ip_to, updated_since, see filters.py
+    Returns:
+        CSV of the store components with the store keys, see export.py
+    """
+    return csv_response('store_components', store_component_filters())
 
 
 # Instance resource is /api/store_components/type
 @api.route('/store_components/<type>', methods=['GET'])
+@conditional(StoreComponent)
 def get_store_component(type):
     """
     The endpoint is for now publicly available.
     Returns:
         JSON of all store components using type.
     """
-    store_components = StoreComponent.query.filter(
-        StoreComponent.component_type == type)  # no need to order
-    store_components_data = [
-        component.to_dict() for component in store_components.all()]
+    fields = get_fields(StoreComponent)
+    store_components = select_fields(StoreComponent, fields).where(
+        component_type_filter([type]))  # no need to order
+    if wants_stream():
+        return stream_collection(
+            'store_components',
+            store_components.order_by(StoreComponent.id), fields)
+    store_components_data = to_dicts(
+        db.session.execute(store_components), fields)
     return jsonify(store_components=store_components_data)
+
+
+# Statistics
+
+# Resource is /api/stats
+@api.route('/stats', methods=['GET'])
+@conditional(Statistic)
+def get_stats():
+    """
+    The endpoint is for now publicly available.
+    Counts are read from the statistics summary table (see db_stats.py),
+    dcs, statuses, component types and stores are given by their natural
+    keys.
+    Returns:
+        JSON of the store counts per country, dc and status and the
+        component counts per type and store.
+    """
+    statistics = get_statistics(store_keys=True)
+    reference = reference_cache.get()
+
+    def natural_keys(counts, names):
+        return {names.get(key, key): count for key, count in counts.items()}
+
+    dcs = {str(dc.id): '{}-{}'.format(dc.country_code, dc.number)
+           for dc in reference.distribution_centers}
+    statuses = {str(status.id): status.name
+                for status in reference.store_status}
+    types = {str(component_type.id): component_type.name
+             for component_type in reference.component_types}
+    by_country = statistics['stores.country_code']
+    by_type = natural_keys(statistics['store_components.type_id'], types)
+    return jsonify(
+        stores={
+            'total': sum(by_country.values()),
+            'by_country': by_country,
+            'by_dc': natural_keys(statistics['stores.dc_id'], dcs),
+            'by_status': natural_keys(
+                statistics['stores.status_id'], statuses)},
+        store_components={
+            'total': sum(by_type.values()),
+            'by_type': by_type,
+            'by_store': statistics['store_components.store_id']})
+
+
+# Change feed
+
+# Resource is /api/changes
+@api.route('/changes', methods=['GET'])
+@conditional(Change)
+def get_change_feed():
+    """
+    The endpoint is for now publicly available.
+    Returns the inserts, updates and deletes of stores and store components
+    in the order they were written, at most ?limit= (API_PAGE_SIZE) per
+    request. Inserted and updated rows come with their current data,
+    deletes with their key only. Clients store the returned next cursor and
+    resume with ?since=<cursor>, without since the feed starts at the
+    beginning of the change log. See db_changes.py
+    Returns:
+        JSON of the changes, the next cursor and whether more changes follow.
+    """
+    since = request.args.get('since')
+    since = decode_cursor(since, (Change.id,))[0] if since else 0
+    limit = get_limit()
+    changes, last, has_more = get_changes(since, limit)
+    cursor = encode_cursor([last])
+    response = jsonify(changes=changes, next=cursor, more=has_more)
+    if has_more:
+        response.headers['Link'] = '<{}>; rel="next"'.format(url_for(
+            '.get_change_feed', since=cursor, limit=limit, _external=True))
+    return response
+
+
+# Change events
+
+# Resource is /api/events
+@api.route('/events', methods=['GET'])
+def get_events():
+    """
+    The endpoint is for now publicly available.
+    Server-Sent Events stream of the changes of stores and store components,
+    pushed as they are committed, see sse.py and myapp/events.py
+    Filters: country_code, store (e.g. BE-101), component_type
+    Returns:
+        text/event-stream, one event per change
+    """
+    return stream_events()
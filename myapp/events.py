@@ -0,0 +1,270 @@
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from werkzeug.utils import import_string
+
+from myapp.models.db_orm import db
+from myapp.models.db_models import Change
+
+
+# Change events (Server-Sent Events, /api/events)
+# Dashboards subscribe to the changes of stores and store components instead
+# of polling. Events are the rows of the change log (db_changes.py), pushed
+# once they are committed:
+#
+#   write path -> changes table -> backend -> Broker -> subscriptions -> SSE
+#
+# The Broker fans the events out to the subscriptions of this process. A
+# subscription is a filter and a bounded queue, an idle subscriber holds no
+# database connection: only the response generator waiting on its queue.
+# Served by the gevent workers of gunicorn.conf.py, the standard library is
+# monkey-patched and that generator is a parked greenlet, not a thread. The
+# development server (flask run) and sync workers hold a thread per stream,
+# they are not meant for many subscribers.
+#
+# A backend feeds the Broker. Both backends below read the new changes with
+# one query per burst of commits, shared by all subscribers:
+#   - local: reads after commits of this process, for a single process
+#   - polling: also reads every EVENTS_POLL_INTERVAL seconds, to pick up
+#     commits of other processes (multi-process / multi-node deployments)
+# EVENTS_BACKEND can also be the import path of another backend class
+# (e.g. one listening on Redis or PostgreSQL NOTIFY), see LocalBackend for
+# the interface.
+
+
+class Subscription(object):
+
+    """
+    Filter and queue of one subscriber. A filter given as None matches
+    every event, component types only match component events.
+    """
+
+    def __init__(self, country_codes=None, stores=None, component_types=None,
+                 maxsize=1000):
+        self.country_codes = set(country_codes) if country_codes else None
+        self.stores = set(stores) if stores else None
+        self.component_types = (
+            set(component_types) if component_types else None)
+        self.queue = queue.Queue(maxsize)
+        # Set when events were dropped because the subscriber is too slow,
+        # the subscriber has to resume from its last event id
+        self.lost = False
+
+    def matches(self, event):
+        if (self.country_codes is not None and
+                event['country_code'] not in self.country_codes):
+            return False
+        if self.stores is not None and event['store'] not in self.stores:
+            return False
+        if (self.component_types is not None and
+                event['component_type'] not in self.component_types):
+            return False
+        return True
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.lost = True
+
+
+class Broker(object):
+
+    """
+    In-process fan-out of events to the matching subscriptions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if not subscription.lost and subscription.matches(event):
+                subscription.put(event)
+
+
+def to_event(change):
+    """ Returns the event of a row of the changes table """
+    store = None
+    if change.country_code is not None:
+        store = '{}-{}'.format(change.country_code, change.number)
+    return OrderedDict([
+        ('id', change.id),
+        ('resource', change.table_name),
+        ('action', change.action),
+        ('key', json.loads(change.key, object_pairs_hook=OrderedDict)),
+        ('country_code', change.country_code),
+        ('store', store),
+        ('component_type', change.component_type)
+    ])
+
+
+def select_changes(since):
+    """ Returns the select of the changes after id since """
+    table = Change.__table__
+    return select([
+        table.c.id, table.c.table_name, table.c.action, table.c.key,
+        table.c.country_code, table.c.number, table.c.component_type]).where(
+        table.c.id > since).order_by(table.c.id)
+
+
+class LocalBackend(object):
+
+    """
+    Publishes the changes committed by this process.
+    A single reader thread per process sleeps until it is notified of a
+    commit, reads the new changes and publishes them.
+
+    Backend interface: __init__(app, broker), start(), notify()
+    """
+
+    # Seconds between reads without notification, None to wait for one
+    interval = None
+
+    def __init__(self, app, broker):
+        self.app = app
+        self.broker = broker
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_id = None
+
+    def start(self):
+        """ Starts the reader thread, once """
+        with self.lock:
+            if self.thread is not None:
+                return
+            with self.app.app_context():
+                self.last_id = db.session.execute(
+                    select([func.max(Change.id)])).scalar() or 0
+                db.session.remove()
+            self.thread = threading.Thread(
+                target=self.run, name='events-reader', daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        """ Called after a commit that recorded changes """
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.read()
+            except Exception:
+                self.app.logger.exception('Reading change events failed')
+
+    def read(self):
+        """ Reads the changes after last_id and publishes them """
+        batch_size = self.app.config['EVENTS_BATCH_SIZE']
+        with self.app.app_context():
+            try:
+                while True:
+                    changes = db.session.execute(select_changes(
+                        self.last_id).limit(batch_size)).fetchall()
+                    for change in changes:
+                        self.broker.publish(to_event(change))
+                        self.last_id = change.id
+                    if len(changes) < batch_size:
+                        break
+            finally:
+                # Don't keep the connection while idle
+                db.session.remove()
+
+
+class PollingBackend(LocalBackend):
+
+    """
+    Publishes the changes committed by any process sharing the database,
+    reading the change log every EVENTS_POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, app, broker):
+        super().__init__(app, broker)
+        self.interval = app.config['EVENTS_POLL_INTERVAL']
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'polling': PollingBackend
+}
+
+
+class EventBroker(object):
+
+    """
+    Flask extension holding the Broker and backend of an application.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENTS_BACKEND', 'local')
+        app.config.setdefault('EVENTS_POLL_INTERVAL', 2)
+        app.config.setdefault('EVENTS_BATCH_SIZE', 500)
+        app.config.setdefault('EVENTS_QUEUE_SIZE', 1000)
+        app.config.setdefault('EVENTS_KEEPALIVE', 15)
+        app.config.setdefault('EVENTS_REPLAY_LIMIT', 1000)
+        backend = app.config['EVENTS_BACKEND']
+        if isinstance(backend, str):
+            backend = BACKENDS.get(backend) or import_string(backend)
+        broker = Broker()
+        app.extensions['event_broker'] = {
+            'broker': broker,
+            'backend': backend(app, broker)
+        }
+
+    def subscribe(self, subscription):
+        """ Subscribes and starts the backend on the first subscription """
+        state = current_app.extensions['event_broker']
+        state['backend'].start()
+        return state['broker'].subscribe(subscription)
+
+    def unsubscribe(self, subscription, app):
+        app.extensions['event_broker']['broker'].unsubscribe(subscription)
+
+    def notify(self):
+        """ Wakes up the backend of the current application """
+        if has_app_context():
+            state = current_app.extensions.get('event_broker')
+            if state is not None:
+                state['backend'].notify()
+
+
+event_broker = EventBroker()
+
+
+# db_changes.record flags the session, the backend is notified once the
+# transaction is committed.
+
+def notify_on_commit(session):
+    if session.info.pop('changes_recorded', False):
+        event_broker.notify()
+
+
+def forget_on_rollback(session, previous_transaction):
+    session.info.pop('changes_recorded', None)
+
+
+event.listen(Session, 'after_commit', notify_on_commit)
+event.listen(Session, 'after_soft_rollback', forget_on_rollback)
@@ -0,0 +1,8 @@
+class ValidationError(ValueError):
+
+    """
+    Raised when a request carries invalid arguments, e.g. a malformed
+    pagination cursor. The api blueprint turns it into a 400 Bad Request.
+    """
+
+    pass
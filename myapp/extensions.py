@@ -4,6 +4,7 @@ from flask_login import LoginManager
 from flask_oauthlib.client import OAuth
 
 from myapp.models.db_models import User
+from myapp.utils.compression import Compress
 
 
 # Flask-DebugToolbar
@@ -48,6 +49,34 @@ def load_user(id):
     return User.query.get(int(id))
 
 
+@login_manager.request_loader
+def load_user_from_request(request):
+    """
+    Flask-Login request_loader callback is used when the request has no user
+    session, e.g. API clients. Users of myapp authenticate with HTTP Basic
+    authentication, email address and password (only over HTTPS!).
+
+    Args:
+        request: the current request
+
+    Returns:
+        User object if the credentials are valid or None otherwise.
+    """
+    auth = request.authorization
+    if auth is None or not auth.username or not auth.password:
+        return None
+    user = User.get_by_email(auth.username, provider='myapp')
+    if (user is not None and user.password_hash is not None and
+            user.verify_password(auth.password)):
+        return user
+    return None
+
+
 # Flask-OAuthlib
 # http://flask-oauthlib.readthedocs.io
 oauth = OAuth()
+
+
+# Response compression (gzip / deflate)
+# See myapp/utils/compression.py
+compress = Compress()
@@ -0,0 +1,219 @@
+import hashlib
+import time
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import Country
+from myapp.models.db_models import DistributionCenter
+from myapp.models.db_models import StoreStatus
+
+
+# Reference data cache
+# Countries, distribution centers, store statuses and component types only
+# have a handful of rows and rarely change, yet they are looked up on almost
+# every store page, form and import. We load them once per worker (per
+# application) into dictionaries keyed by id and by natural key, and serve
+# all lookups from there. The cache is invalidated when one of these rows
+# is written through the ORM in this process, REFERENCE_CACHE_TTL bounds how
+# long writes of other processes can go unnoticed. A lookup of an unknown
+# key reloads the cache first, see ReferenceCache.lookup.
+#
+# Cached rows are immutable namedtuples, not ORM instances: they are shared
+# between requests and can't be bound to a session. They expose the same
+# attributes and the same to_dict() as the models.
+
+
+class CountryRef(namedtuple(
+        'CountryRef', ['country_code', 'country_name'])):
+    __slots__ = ()
+    api_fields = Country.api_fields
+    to_dict = Country.to_dict
+
+
+class DistributionCenterRef(namedtuple(
+        'DistributionCenterRef', [
+            'id', 'country_code', 'number', 'name', 'tag', 'created_date',
+            'updated_date'])):
+    __slots__ = ()
+    api_fields = DistributionCenter.api_fields
+    to_dict = DistributionCenter.to_dict
+
+
+class StoreStatusRef(namedtuple(
+        'StoreStatusRef', ['id', 'sequence', 'name', 'description'])):
+    __slots__ = ()
+    api_fields = StoreStatus.api_fields
+    to_dict = StoreStatus.to_dict
+
+
+class ComponentTypeRef(namedtuple(
+        'ComponentTypeRef', ['id', 'name', 'description'])):
+    __slots__ = ()
+    api_fields = ComponentType.api_fields
+    to_dict = ComponentType.to_dict
+
+
+class ReferenceData(object):
+
+    """
+    Snapshot of the reference tables, ordered as the models' get_all().
+    """
+
+    def __init__(self, countries, distribution_centers, store_status,
+                 component_types):
+        self.loaded_at = time.monotonic()
+        self.countries = countries
+        self.countries_by_code = {c.country_code: c for c in countries}
+        self.distribution_centers = distribution_centers
+        self.distribution_centers_by_id = {
+            dc.id: dc for dc in distribution_centers}
+        self.distribution_centers_by_key = {
+            (dc.country_code, dc.number): dc for dc in distribution_centers}
+        self.store_status = store_status
+        self.store_status_by_id = {s.id: s for s in store_status}
+        self.store_status_by_name = {s.name: s for s in store_status}
+        self.component_types = component_types
+        self.component_types_by_id = {t.id: t for t in component_types}
+        self.component_types_by_name = {t.name: t for t in component_types}
+        # Validator for conditional GET on the reference resources
+        self.version = hashlib.sha1(repr((
+            countries, distribution_centers, store_status, component_types
+            )).encode('utf-8')).hexdigest()
+        dates = [d for dc in distribution_centers
+                 for d in (dc.created_date, dc.updated_date) if d is not None]
+        self.last_modified = max(dates) if dates else None
+
+    @classmethod
+    def load(cls):
+        """ Loads the reference tables, one query per table """
+        return cls(
+            countries=[CountryRef(
+                country_code=c.country_code,
+                country_name=c.country_name)
+                for c in Country.query.order_by('country_code')],
+            distribution_centers=[DistributionCenterRef(
+                id=dc.id,
+                country_code=dc.country_code,
+                number=dc.number,
+                name=dc.name,
+                tag=dc.tag,
+                created_date=dc.created_date,
+                updated_date=dc.updated_date)
+                for dc in DistributionCenter.query.order_by(
+                    'country_code', 'number')],
+            store_status=[StoreStatusRef(
+                id=s.id,
+                sequence=s.sequence,
+                name=s.name,
+                description=s.description)
+                for s in StoreStatus.query.order_by('sequence')],
+            component_types=[ComponentTypeRef(
+                id=t.id,
+                name=t.name,
+                description=t.description)
+                for t in ComponentType.query.order_by('id')])
+
+
+class ReferenceCache(object):
+
+    """
+    Flask extension holding the ReferenceData of an application.
+    """
+
+    models = (Country, DistributionCenter, StoreStatus, ComponentType)
+
+    # Seconds during which a miss doesn't reload the cache, a run of unknown
+    # keys (e.g. the invalid records of an import) costs one reload
+    MISS_RELOAD_INTERVAL = 1
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REFERENCE_CACHE_TTL', 300)
+        app.extensions['reference_cache'] = {'data': None}
+
+    def get(self):
+        """
+        Returns the ReferenceData of the current application, loading it
+        if it is missing or expired.
+        """
+        state = current_app.extensions['reference_cache']
+        data = state['data']
+        ttl = current_app.config['REFERENCE_CACHE_TTL']
+        if data is None or (ttl and time.monotonic() - data.loaded_at > ttl):
+            data = state['data'] = ReferenceData.load()
+        return data
+
+    def lookup(self, index, key):
+        """
+        Returns the cached row with key in index (e.g. store_status_by_id),
+        None if unknown. A miss reloads the cache once, the row may have
+        been added by another process since it was loaded, unless it was
+        loaded less than MISS_RELOAD_INTERVAL seconds ago.
+        """
+        data = self.get()
+        row = getattr(data, index).get(key)
+        if (row is None and
+                time.monotonic() - data.loaded_at > self.MISS_RELOAD_INTERVAL):
+            self.invalidate()
+            row = getattr(self.get(), index).get(key)
+        return row
+
+    def invalidate(self):
+        """ Drops the ReferenceData of the current application """
+        if has_app_context():
+            state = current_app.extensions.get('reference_cache')
+            if state is not None:
+                state['data'] = None
+
+    def covers(self, model):
+        """ Returns True if the rows of model are cached """
+        return model in self.models
+
+
+reference_cache = ReferenceCache()
+
+
+# Invalidation
+# Mapper events flag the session when a reference row is inserted, updated
+# or deleted, the cache is dropped once the transaction ends. Bulk
+# query.update() / query.delete() calls bypass the mapper events, so they are
+# handled separately.
+
+def flag_reference_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['reference_data_changed'] = True
+
+
+for model in ReferenceCache.models:
+    for identifier in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, identifier, flag_reference_change)
+
+
+def flag_reference_bulk_change(context):
+    if context.mapper.class_ in ReferenceCache.models:
+        context.session.info['reference_data_changed'] = True
+
+
+event.listen(Session, 'after_bulk_update', flag_reference_bulk_change)
+event.listen(Session, 'after_bulk_delete', flag_reference_bulk_change)
+
+
+def invalidate_on_transaction_end(session):
+    if session.info.pop('reference_data_changed', False):
+        reference_cache.invalidate()
+
+
+def invalidate_on_rollback(session, previous_transaction):
+    invalidate_on_transaction_end(session)
+
+
+event.listen(Session, 'after_commit', invalidate_on_transaction_end)
+event.listen(Session, 'after_soft_rollback', invalidate_on_rollback)
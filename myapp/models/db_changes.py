@@ -0,0 +1,256 @@
+import json
+from collections import OrderedDict
+
+from sqlalchemy import select, text
+
+from myapp.models.db_orm import db
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_models import Change
+from myapp.models.db_rows import get_value, select_fields
+
+
+# Change log
+# Every insert, update and delete of a store or store component is recorded
+# in the table changes, in the same transaction as the write itself. The
+# increasing id of a change is the position in the change feed
+# (/api/changes?since=), clients mirroring our data only fetch what changed
+# since their last position.
+# A change holds the natural key of the row, as exposed by the API, so
+# deletes remain visible after the row is gone (tombstones). The key of a
+# store component is the key of its store and its hostname. Changing the
+# natural key of a store is recorded as a delete of the old key and an insert
+# of the new key, for the store and each of its components.
+#
+# Ids are handed out in the order the changes are written, and the changes
+# must commit in this order: a client that read a higher id would skip a
+# lower one committed after it. SQLite serializes writing transactions. On
+# PostgreSQL record() takes a transaction-level advisory lock
+# (CHANGE_LOG_LOCK): writers recording changes wait for each other from
+# their first change until their commit.
+#
+# The write paths (myapp/stores/views.py, the batch API, the loaders in
+# db_data.py) call the record_ functions below, before the commit. Writes
+# bypassing them don't show up in the feed.
+
+KEYS = {
+    Store: ('country_code', 'number'),
+    StoreComponent: ('country_code', 'number', 'hostname')
+}
+
+# Rows are looked up in chunks, SQLite allows 999 parameters per statement
+CHUNK_SIZE = 500
+
+# Key of the PostgreSQL advisory lock serializing the writers of changes
+CHANGE_LOG_LOCK = 7011
+
+
+def key_of(model, row, store_key=None):
+    """
+    Returns the natural key of a row as ordered dict.
+
+    Args:
+        model: Store or StoreComponent
+        row: object or dict with the key columns
+        store_key: (country_code, number) of the store of a component
+    """
+    if model is StoreComponent:
+        country_code, number = store_key or (None, None)
+        return OrderedDict([('country_code', country_code),
+                            ('number', number),
+                            ('hostname', get_value(row, 'hostname'))])
+    return OrderedDict(
+        (column, get_value(row, column)) for column in KEYS[model])
+
+
+def store_keys(store_ids):
+    """
+    Returns {store id: (country_code, number)}, one query per chunk of ids.
+    """
+    store_ids = sorted(set(store_ids))
+    keys = {}
+    for i in range(0, len(store_ids), CHUNK_SIZE):
+        keys.update(
+            (store_id, (country_code, number))
+            for store_id, country_code, number in db.session.execute(
+                select([Store.id, Store.country_code, Store.number]).where(
+                    Store.id.in_(store_ids[i:i + CHUNK_SIZE]))))
+    return keys
+
+
+def change(model, action, row, key=None, store_key=None):
+    """
+    Returns a change (dict) of row.
+
+    Args:
+        model: Store or StoreComponent
+        action: insert, update or delete
+        row: object or dict with id and the key columns
+        key: natural key if it differs from the one of row
+        store_key: (country_code, number) of the store of a component
+    """
+    key = key or key_of(model, row, store_key)
+    if model is Store:
+        store_key = (key['country_code'], key['number'])
+        component_type = None
+    else:
+        component_type = get_value(row, 'component_type')
+    return {
+        'table_name': model.__tablename__,
+        'action': action,
+        'row_id': get_value(row, 'id'),
+        'key': json.dumps(key, separators=(',', ':')),
+        'country_code': store_key[0] if store_key else None,
+        'number': store_key[1] if store_key else None,
+        'component_type': component_type
+    }
+
+
+def changes(model, action, rows):
+    """ Returns the changes of rows, see change """
+    if model is StoreComponent:
+        stores = store_keys([get_value(row, 'store_id') for row in rows])
+        return [change(model, action, row,
+                       store_key=stores.get(get_value(row, 'store_id')))
+                for row in rows]
+    return [change(model, action, row) for row in rows]
+
+
+def record(changes):
+    """ Inserts the changes (dicts), one executemany statement """
+    if changes:
+        if db.engine.dialect.name == 'postgresql':
+            # Held until the end of the transaction (taking it again is a
+            # no-op), see CHANGE_LOG_LOCK
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                               {'key': CHANGE_LOG_LOCK})
+        db.session.execute(Change.__table__.insert(), changes)
+        # Tells the event broker to publish the changes after the commit
+        db.session.info['changes_recorded'] = True
+        # and the fragment cache of the stores pages which stores changed
+        db.session.info.setdefault('changed_stores', set()).update(
+            (change['country_code'], change['number'])
+            for change in changes if change['country_code'] is not None)
+
+
+def record_inserts(model, rows):
+    """
+    Records inserted rows. The rows need their id, flush the session
+    before recording new ORM instances.
+    """
+    record(changes(model, 'insert', rows))
+
+
+def record_updates(model, rows, previous_keys=None):
+    """
+    Records updated rows.
+
+    Args:
+        model: Store
+        rows: the updated rows (objects or dicts, with id)
+        previous_keys: natural keys of the rows before the update
+            (see key_of), a changed key is recorded as delete and insert
+    """
+    updates, moved = [], {}
+    for i, row in enumerate(rows):
+        key = key_of(model, row)
+        previous_key = previous_keys[i] if previous_keys else key
+        if previous_key != key:
+            updates.append(change(model, 'delete', row, previous_key))
+            updates.append(change(model, 'insert', row, key))
+            moved[get_value(row, 'id')] = (
+                tuple(previous_key.values()), tuple(key.values()))
+        else:
+            updates.append(change(model, 'update', row, key))
+    # The keys of the components of the stores with a new key
+    for component in store_components_of(sorted(moved)):
+        previous_store_key, store_key = moved[component['store_id']]
+        updates.append(change(StoreComponent, 'delete', component,
+                              store_key=previous_store_key))
+        updates.append(change(StoreComponent, 'insert', component,
+                              store_key=store_key))
+    record(updates)
+
+
+def record_deletes(model, rows):
+    """ Records deleted rows, they are read before the delete """
+    record(changes(model, 'delete', rows))
+
+
+def store_components_of(store_ids):
+    """
+    Yields the key columns of the components of the given stores as dicts,
+    with the country_code and number of their store, one query per chunk
+    of stores.
+    """
+    table = StoreComponent.__table__
+    for i in range(0, len(store_ids), CHUNK_SIZE):
+        for component in db.session.execute(select([
+                table.c.id, table.c.store_id, table.c.hostname,
+                ComponentType.name.label('component_type'),
+                Store.country_code, Store.number]).select_from(
+                StoreComponent.api_from().join(
+                    Store.__table__, table.c.store_id == Store.id)).where(
+                table.c.store_id.in_(store_ids[i:i + CHUNK_SIZE])).order_by(
+                table.c.id)):
+            yield dict(component)
+
+
+def record_store_component_deletes(store_ids):
+    """
+    Records the deletes of all components of the given stores, before
+    they are deleted. Only the key columns are read.
+    """
+    record([change(StoreComponent, 'delete', component,
+                   store_key=(component['country_code'], component['number']))
+            for component in store_components_of(store_ids)])
+
+
+def get_changes(since, limit):
+    """
+    Returns the changes after position since, in order, with the current
+    data of inserted and updated rows that still exist.
+    Costs one query for the changes and one per table (and chunk of rows)
+    for the data.
+
+    Args:
+        since: int, id of the last change the client has seen
+        limit: maximum number of changes
+    Returns:
+        list of dicts, id of the last change returned, has_more (boolean)
+    """
+    table = Change.__table__
+    rows = db.session.execute(select([
+        table.c.id, table.c.table_name, table.c.action, table.c.row_id,
+        table.c.key, table.c.created_date]).where(
+        table.c.id > since).order_by(table.c.id).limit(limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Current data of the rows, by table and id
+    data = {}
+    for model in KEYS:
+        row_ids = sorted({row.row_id for row in rows
+                          if row.table_name == model.__tablename__ and
+                          row.action != 'delete'})
+        fields = model.api_fields
+        current = data[model.__tablename__] = {}
+        for i in range(0, len(row_ids), CHUNK_SIZE):
+            statement = select_fields(model, fields, (model.id,)).where(
+                model.id.in_(row_ids[i:i + CHUNK_SIZE]))
+            current.update((values.id, dict(zip(fields, values)))
+                           for values in db.session.execute(statement))
+
+    changes = []
+    for row in rows:
+        changes.append({
+            'resource': row.table_name,
+            'action': row.action,
+            'key': json.loads(row.key, object_pairs_hook=OrderedDict),
+            'changed_date': row.created_date,
+            'data': (None if row.action == 'delete' else
+                     data[row.table_name].get(row.row_id))
+        })
+    last = rows[-1].id if rows else since
+    return changes, last, has_more
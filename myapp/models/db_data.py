@@ -1,14 +1,22 @@
 import json
 import random
+from collections import OrderedDict
 
-from myapp.models.db_orm import db
+from sqlalchemy import and_, or_, select
+
+from myapp.models.db_orm import db, reset_sequence
 
 from myapp.models.db_models import User
 from myapp.models.db_models import Country
 from myapp.models.db_models import DistributionCenter
 from myapp.models.db_models import StoreStatus
 from myapp.models.db_models import Store
+from myapp.models.db_models import ComponentType
 from myapp.models.db_models import StoreComponent
+from myapp.models import db_changes
+from myapp.models import db_stats
+from myapp.models.db_rows import get_value
+from myapp.utils.argon2 import generate_argon2_hashes
 
 
 # For demo purposes we are only generating about 10 stores:
@@ -16,10 +24,43 @@ from myapp.models.db_models import StoreComponent
 #       (range 1 to 3), 4 is for country LU.
 #   -   status will be randomly assigned (range 1 to 3)
 #   -   store numbers are simply increased and assigned.
-#   -   store components are randomly generated.
+#   -   store components are randomly generated, between 1 and the maximum
+#       of COMPONENTS per type and store.
+
+# (component type, hostname, maximum per store)
+COMPONENTS = (
+    ('backoffice', 'Backoffice {}', 2),
+    ('network_routers', 'Network Router {}', 3),
+    ('network_switches', 'Network Switch {}', 2),
+    ('network_access_points', 'Network Access Point {}', 5)
+    )
+
+# Rows per executemany statement of the bulk loaders, store ids are looked
+# up in chunks too: SQLite allows 999 parameters per statement
+CHUNK_SIZE = 500
+
+
+def insert_users(users, executor=None):
+    """
+    Inserts users (dicts with email_address, password and optionally
+    provider, username) with executemany statements of CHUNK_SIZE rows.
+    The passwords are hashed in the processes of executor if given, see
+    generate_argon2_hashes. Doesn't commit.
+    """
+    table = User.__table__
+    for i in range(0, len(users), CHUNK_SIZE):
+        chunk = users[i:i + CHUNK_SIZE]
+        hashes = generate_argon2_hashes(
+            [user.get('password') for user in chunk], executor)
+        db.session.execute(table.insert(), [{
+            'provider': user.get('provider') or 'myapp',
+            'social_id': User.generate_social_id(),
+            'email_address': user.get('email_address'),
+            'username': user.get('username'),
+            'password_hash': password_hash}
+            for user, password_hash in zip(chunk, hashes)])
 
 
-# randomly to a distribution center, status will also be
 def load_users_from_json():
     """
     Importing JSON data to table users
@@ -27,18 +68,7 @@ def load_users_from_json():
     json_filename = 'db/json/users.json'
     with open(json_filename, 'r', encoding='utf-8') as f:
         json_object = json.load(f)
-        users = []
-        for user in json_object['users']:
-            # Each user is a dict
-            users.append(User(
-                provider='myapp',
-                social_id=User.generate_social_id(),
-                email_address=user.get('email_address'),
-                password=user.get('password'))
-                )
-    # Add data to users
-    db.session.add_all(users)
-    # Flush the remaining changes and commit the transaction
+    insert_users(json_object['users'])
     db.session.commit()
     # Close the Session
     db.session.close()
@@ -101,6 +131,38 @@ def load_stores_status_from_json():
     db.session.close()
 
 
+def load_component_types_from_json():
+    """
+    Importing JSON data to table component_types
+    """
+    json_filename = 'db/json/component_types.json'
+    with open(json_filename, 'r', encoding='utf-8') as f:
+        json_object = json.load(f)
+        component_types = []
+        for component_type in json_object['component_types']:
+            component_types.append(ComponentType(
+                id=component_type.get('id'),
+                name=component_type.get('name'),
+                description=component_type.get('description'))
+                )
+    db.session.add_all(component_types)
+    db.session.flush()
+    # The ids are given, types added later get the next ones
+    reset_sequence('component_types')
+    db.session.commit()
+    db.session.close()
+
+
+def default_dc_number(country_code):
+    """
+    Returns the dc number of a new store: the master data has no dc yet,
+    LU stores go to dc 4, others to a random dc of 1 to 3.
+    """
+    if country_code == 'LU':
+        return 4
+    return random.randint(1, 3)
+
+
 def load_stores_from_json():
     """
     Importing JSON data to table stores.
@@ -126,10 +188,7 @@ def load_stores_from_json():
             # Retrieve dc_id using country_code and the exported dc number
             # dc_number = json_object.get(
             #     'stores').get(key).get('store').get('dc_number')
-            if country_code == 'LU':
-                dc_number = 4
-            else:
-                dc_number = random.randint(1, 3)
+            dc_number = default_dc_number(country_code)
 
             # Some countries can have no DC, so we change it to the
             # relevant parent country.
@@ -137,6 +196,8 @@ def load_stores_from_json():
             #     dc_id = DistributionCenter.get_id('BE', dc_number)
             # else:
             #     dc_id = DistributionCenter.get_id(country_code, dc_number)
+            # The lookup is served by the reference data cache, no query.
+            dc_id = DistributionCenter.get_id(country_code, dc_number)
 
             # Retrieve store number
             # number = json_object.get(
@@ -147,7 +208,7 @@ def load_stores_from_json():
             stores.append(Store(
                 user_id=user_id,
                 country_code=country_code,
-                dc_id=dc_number,
+                dc_id=dc_id,
                 number=int(key),
                 name=json_object.get(
                     'stores').get(key).get('store').get('name'),
@@ -163,90 +224,142 @@ def load_stores_from_json():
             ))
 
     db.session.add_all(stores)
+    # Count the stores in the statistics and record them in the change log,
+    # in the same transaction (flush first, the log needs the ids)
+    db.session.flush()
+    db_stats.add_stores(stores)
+    db_changes.record_inserts(Store, stores)
     db.session.commit()
     db.session.close()
 
 
-def load_store_components_from_json():
+def store_ids_by_key():
+    """
+    Returns {(country_code, number): id} of all stores, one query.
+    """
+    return {(country_code, number): store_id
+            for store_id, country_code, number in db.session.execute(
+                select([Store.id, Store.country_code, Store.number]))}
+
+
+def generate_store_components(stores, store_ids):
+    """
+    Yields the rows (dicts) of the randomly generated components of stores,
+    see COMPONENTS. Stores missing in store_ids are skipped.
+
+    Args:
+        stores: the 'stores' object of stores.json
+        store_ids: {(country_code, number): id}, see store_ids_by_key
+    """
+    type_ids = {component_type: ComponentType.get_id(component_type)
+                for component_type, _, _ in COMPONENTS}
+    for key, value in stores.items():
+        store_id = store_ids.get((value['store']['country_code'], int(key)))
+        if store_id is None:
+            continue
+        for component_type, hostname, maximum in COMPONENTS:
+            for i in range(1, random.randint(1, maximum) + 1):
+                yield {
+                    'store_id': store_id,
+                    'type_id': type_ids[component_type],
+                    'hostname': hostname.format(i),
+                    'ip_address': '127.0.0.1'
+                }
+
+
+def insert_stores(rows):
+    """
+    Inserts rows (dicts) of stores with executemany statements of
+    CHUNK_SIZE rows, counts them in the statistics and records them in the
+    change log. Doesn't commit.
+    """
+    table = Store.__table__
+    for i in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[i:i + CHUNK_SIZE]
+        db.session.execute(table.insert(), chunk)
+        db_stats.add_stores(chunk)
+
+        # executemany doesn't return the new ids, the change log needs
+        # them: one more query for the chunk
+        numbers = OrderedDict()
+        for row in chunk:
+            numbers.setdefault(row['country_code'], []).append(row['number'])
+        created = db.session.execute(
+            select([table.c.id, table.c.country_code, table.c.number]).where(
+                or_(*[and_(table.c.country_code == country_code,
+                           table.c.number.in_(country_numbers))
+                      for country_code, country_numbers in numbers.items()])))
+        db_changes.record_inserts(Store, [
+            {'id': row_id, 'country_code': country_code, 'number': number}
+            for row_id, country_code, number in created])
+
+
+def delete_stores(stores):
+    """
+    Deletes stores and their components in chunks of CHUNK_SIZE stores,
+    uncounts them in the statistics and records them in the change log.
+    Doesn't commit.
+
+    Args:
+        stores: objects or dicts with id, country_code, number, dc_id and
+            status_id
+    """
+    table = Store.__table__
+    for i in range(0, len(stores), CHUNK_SIZE):
+        chunk = stores[i:i + CHUNK_SIZE]
+        store_ids = [get_value(store, 'id') for store in chunk]
+        db_stats.remove_store_components(store_ids)
+        db_stats.remove_stores(chunk)
+        db_changes.record_store_component_deletes(store_ids)
+        db_changes.record_deletes(Store, chunk)
+        db.session.execute(StoreComponent.__table__.delete().where(
+            StoreComponent.store_id.in_(store_ids)))
+        db.session.execute(table.delete().where(table.c.id.in_(store_ids)))
+
+
+def insert_store_components(rows):
+    """
+    Inserts rows (dicts) of store components with executemany statements
+    of CHUNK_SIZE rows, counts them in the statistics and records them in
+    the change log. Doesn't commit.
+    """
+    table = StoreComponent.__table__
+    for i in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[i:i + CHUNK_SIZE]
+        db.session.execute(table.insert(), chunk)
+        db_stats.add_store_components(chunk)
+
+        # executemany doesn't return the new ids, the change log needs
+        # them: one more query for the chunk
+        keys = {(row['store_id'], row['hostname']) for row in chunk}
+        created = db.session.execute(
+            select([table.c.id, table.c.store_id, table.c.hostname,
+                    table.c.type_id]).where(table.c.store_id.in_(
+                        {store_id for store_id, _ in keys})))
+        db_changes.record_inserts(StoreComponent, [
+            {'id': row_id, 'store_id': store_id, 'hostname': hostname,
+             'component_type': ComponentType.get_name(type_id)}
+            for row_id, store_id, hostname, type_id in created
+            if (store_id, hostname) in keys])
+
+
+def load_store_components_from_json(json_filename='db/json/stores.json'):
     """
     Importing JSON data to table store_components.
     We only load components for stores with status Open (sequence 2).
+    The component types must be loaded first (db_load_component_types).
+    Store ids are resolved with one query and the components inserted as
+    plain rows in chunks, without ORM instances.
+
+    Returns:
+        number of inserted store components
     """
-    json_filename = 'db/json/stores.json'
     with open(json_filename, 'r', encoding='utf-8') as f:
         json_object = json.load(f)
 
-        backoffices = []
-        network_routers = []
-        network_switches = []
-        access_points = []
-
-        # Use default iterators/operators, no need for .keys()
-        for key in json_object.get('stores'):
-
-            # backoffice
-            i = 1
-            while i <= random.randint(1, 2):
-                country_code = json_object.get(
-                    'stores').get(key).get('store').get('country_code')
-                number = int(key)
-                bo_hostname = 'Backoffice {}'.format(i)
-                backoffices.append(StoreComponent(
-                    store_id=Store.get_id(country_code, number),
-                    component_type='backoffice',
-                    hostname=bo_hostname,
-                    ip_address='127.0.0.1')
-                    )
-                i += 1
-
-            # network_routers
-            i = 1
-            while i <= random.randint(1, 3):
-                country_code = json_object.get(
-                    'stores').get(key).get('store').get('country_code')
-                number = int(key)
-                nr_hostname = 'Network Router {}'.format(i)
-                network_routers.append(StoreComponent(
-                    store_id=Store.get_id(country_code, number),
-                    component_type='network_routers',
-                    hostname=nr_hostname,
-                    ip_address='127.0.0.1')
-                    )
-                i += 1
-
-            # network_switches
-            i = 1
-            while i <= random.randint(1, 2):
-                country_code = json_object.get(
-                    'stores').get(key).get('store').get('country_code')
-                number = int(key)
-                ns_hostname = 'Network Switch {}'.format(i)
-                network_switches.append(StoreComponent(
-                    store_id=Store.get_id(country_code, number),
-                    component_type='network_switches',
-                    hostname=ns_hostname,
-                    ip_address='127.0.0.1')
-                )
-                i += 1
-
-            # network_access_points
-            i = 1
-            while i <= random.randint(1, 5):
-                country_code = json_object.get(
-                    'stores').get(key).get('store').get('country_code')
-                number = int(key)
-                ap_hostname = 'Network Access Point {}'.format(i)
-                access_points.append(StoreComponent(
-                    store_id=Store.get_id(country_code, number),
-                    component_type='network_access_points',
-                    hostname=ap_hostname,
-                    ip_address='127.0.0.1')
-                )
-                i += 1
-
-        db.session.add_all(backoffices)
-        db.session.add_all(network_routers)
-        db.session.add_all(network_switches)
-        db.session.add_all(access_points)
-        db.session.commit()
-        db.session.close()
+    rows = list(generate_store_components(
+        json_object['stores'], store_ids_by_key()))
+    insert_store_components(rows)
+    db.session.commit()
+    db.session.close()
+    return len(rows)
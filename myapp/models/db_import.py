@@ -0,0 +1,475 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select
+
+from myapp.exceptions import ValidationError
+from myapp.models.db_orm import db
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_models import User
+from myapp.models.db_models import Store
+from myapp.models.db_models import ImportProgress
+from myapp.models.db_data import insert_stores, insert_store_components
+from myapp.models.db_data import insert_users
+from myapp.models.db_types import parse_ip_address
+from myapp.utils.argon2 import argon2_workers
+
+
+# Streaming import of stores and store components
+# The loaders of db_data.py read the whole file at once, this import reads
+# one record at a time from NDJSON, CSV or a JSON array (parsed
+# incrementally), validates it and inserts the records in batches of
+# IMPORT_BATCH_SIZE, one transaction per batch. Memory use is bounded by the
+# batch size, not by the size of the file.
+#
+# The fields of a record are the columns of the CSV export (api/export.py),
+# so an export can be imported again:
+#   stores: country_code, number, name, dc_number, status, street_name,
+#       street_number, postal_code, city
+#   store_components: country_code, store_number, component_type, hostname,
+#       ip_address
+# Other fields (dc_name, store_name, created_date...) are ignored.
+#
+# Resume: the number of imported records is kept in table import_progress,
+# in the transaction of each batch. When a batch fails (e.g. a store that
+# exists already) it is rolled back, the next run of the same file skips
+# the records of the committed batches and continues with the failed one.
+# A fingerprint (SHA-1) of the committed records is kept with it: a new file
+# at the same path whose first records differ is refused, import it with
+# --restart (reset_progress). Records after the committed ones may change,
+# e.g. to fix the record that failed.
+# Invalid records are reported and skipped, they don't stop the import.
+
+FORMATS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.json': 'json'
+}
+
+# Characters read at once from a JSON array
+READ_SIZE = 65536
+
+JSON_WHITESPACE = ' \t\n\r'
+
+
+def read_ndjson(f):
+    """ Yields the records of a file with one JSON object per line """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(f):
+    """ Yields the rows of a CSV file with header as dicts """
+    for row in csv.DictReader(f):
+        yield row
+
+
+def read_json_array(f, read_size=READ_SIZE):
+    """
+    Yields the records of a JSON array of objects, parsed incrementally:
+    only the current record and read_size characters are kept in memory.
+    Raises ValueError if the file is no JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    # Expected next: the opening bracket, the first value, a value (after a
+    # comma) or a separator (comma or closing bracket)
+    expected = '['
+    while True:
+        while (position < len(buffer) and
+               buffer[position] in JSON_WHITESPACE):
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError('unexpected end of the JSON array')
+            buffer, position = f.read(read_size), 0
+            eof = not buffer
+            continue
+
+        char = buffer[position]
+        if expected == '[':
+            if char != '[':
+                raise ValueError('expected a JSON array')
+            position += 1
+            expected = 'first'
+        elif expected == 'separator' or (expected == 'first' and
+                                         char == ']'):
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(
+                    "expected ',' or ']' at character {}".format(position))
+            position += 1
+            expected = 'value'
+        else:
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The record continues after the buffer, read more
+                if eof:
+                    raise
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield record
+            position = end
+            expected = 'separator'
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+    'json': read_json_array
+}
+
+
+def get_format(filename):
+    """ Returns the format of a file by its extension """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError('unknown file format {}, use one of {}'.format(
+            extension, ', '.join(sorted(FORMATS))))
+    return FORMATS[extension]
+
+
+# Validation
+# Records are converted to the rows (dicts) of the tables, a CSV gives
+# strings: empty values are NULL and numbers are parsed.
+
+def get_string(record, field, required=False):
+    value = record.get(field)
+    if value is None or value == '':
+        if required:
+            raise ValidationError('missing field {}'.format(field))
+        return None
+    return str(value)
+
+
+def get_integer(record, field):
+    value = get_string(record, field, required=True)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError('{} is no integer: {!r}'.format(field, value))
+
+
+def parse_store(record, reference):
+    """ Returns the row of a store record, see db_data.insert_stores """
+    country_code = get_string(record, 'country_code', required=True)
+    dc_key = (country_code, get_integer(record, 'dc_number'))
+    if dc_key not in reference.distribution_centers_by_key:
+        raise ValidationError(
+            'unknown distribution center {}-{}'.format(*dc_key))
+    status = get_string(record, 'status', required=True)
+    if status not in reference.store_status_by_name:
+        raise ValidationError('unknown status {}'.format(status))
+    return {
+        'country_code': country_code,
+        'dc_id': reference.distribution_centers_by_key[dc_key].id,
+        'number': get_integer(record, 'number'),
+        'name': get_string(record, 'name', required=True),
+        'status_id': reference.store_status_by_name[status].id,
+        'street_name': get_string(record, 'street_name'),
+        'street_number': get_string(record, 'street_number'),
+        'postal_code': get_string(record, 'postal_code'),
+        'city': get_string(record, 'city')
+    }
+
+
+def parse_store_component(record, reference):
+    """
+    Returns the row of a store component record, with the key of its store
+    instead of the store_id, see write_store_components.
+    """
+    component_type = get_string(record, 'component_type', required=True)
+    if component_type not in reference.component_types_by_name:
+        raise ValidationError(
+            'unknown component type {}'.format(component_type))
+    ip_address = get_string(record, 'ip_address')
+    if ip_address is not None:
+        try:
+            ip_address = str(parse_ip_address(ip_address))
+        except ValueError:
+            raise ValidationError(
+                'invalid ip address {!r}'.format(ip_address))
+    return {
+        'store_key': (get_string(record, 'country_code', required=True),
+                      get_integer(record, 'store_number')),
+        'type_id': reference.component_types_by_name[component_type].id,
+        'hostname': get_string(record, 'hostname', required=True),
+        'ip_address': ip_address
+    }
+
+
+def write_stores(rows, user_id):
+    """
+    Inserts a batch of stores owned by user_id.
+
+    Args:
+        rows: list of (record number, row)
+
+    Returns:
+        list of (record number, error message) of the rejected rows
+    """
+    insert_stores([dict(row, user_id=user_id) for _, row in rows])
+    return []
+
+
+def write_store_components(rows, user_id):
+    """
+    Inserts a batch of store components, their stores are looked up with
+    one query. Components of unknown stores are rejected.
+
+    Args:
+        rows: list of (record number, row)
+
+    Returns:
+        list of (record number, error message) of the rejected rows
+    """
+    numbers = OrderedDict()
+    for _, row in rows:
+        country_code, number = row['store_key']
+        numbers.setdefault(country_code, []).append(number)
+    store_ids = {
+        (country_code, number): store_id
+        for store_id, country_code, number in db.session.execute(
+            select([Store.id, Store.country_code, Store.number]).where(or_(*[
+                and_(Store.country_code == country_code,
+                     Store.number.in_(country_numbers))
+                for country_code, country_numbers in numbers.items()])))}
+
+    components, rejected = [], []
+    for record_number, row in rows:
+        store_id = store_ids.get(row['store_key'])
+        if store_id is None:
+            rejected.append((record_number, 'unknown store {}-{}'.format(
+                *row['store_key'])))
+            continue
+        components.append({
+            'store_id': store_id,
+            'type_id': row['type_id'],
+            'hostname': row['hostname'],
+            'ip_address': row['ip_address']})
+    insert_store_components(components)
+    return rejected
+
+
+RESOURCES = {
+    'stores': (parse_store, write_stores),
+    'store_components': (parse_store_component, write_store_components)
+}
+
+
+def record_fingerprint(record):
+    """ Returns the bytes of a record for the fingerprint of an import """
+    return json.dumps(record, sort_keys=True, separators=(',', ':')).encode(
+        'utf-8') + b'\n'
+
+
+def get_progress(filename):
+    """
+    Returns the ImportProgress of an unfinished import of filename, None if
+    there is none.
+    """
+    # The table is new, create it in databases made before
+    ImportProgress.__table__.create(bind=db.engine, checkfirst=True)
+    return ImportProgress.query.get(os.path.abspath(filename))
+
+
+def reset_progress(filename):
+    """ Forgets an unfinished import of filename, the next one starts over """
+    progress = get_progress(filename)
+    if progress is not None:
+        db.session.delete(progress)
+        db.session.commit()
+
+
+def import_file(resource, filename, file_format=None, batch_size=None,
+                user_id=1, on_invalid=None):
+    """
+    Imports the records of a file into stores or store_components in
+    batches, one transaction per batch. An unfinished import of the same
+    file resumes after its last committed batch, if the committed records
+    are unchanged.
+    Raises IntegrityError (e.g. a store that exists already) after rolling
+    back the failed batch, ValueError if the file can't be parsed or differs
+    from the unfinished import.
+
+    Args:
+        resource: stores or store_components
+        filename: NDJSON, CSV or JSON array file
+        file_format: ndjson, csv or json, by default by the file extension
+        batch_size: records per batch, default IMPORT_BATCH_SIZE
+        user_id: owner of the imported stores, by default the default user
+        on_invalid: function called with the record number (from 1) and
+            the error message of each invalid record
+
+    Returns:
+        number of imported records, number of invalid records
+    """
+    parse, write = RESOURCES[resource]
+    read = READERS[file_format or get_format(filename)]
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    fingerprint = hashlib.sha1()
+
+    progress = get_progress(filename)
+    if progress is None:
+        progress = ImportProgress(
+            source=os.path.abspath(filename), resource=resource, records=0)
+    elif progress.resource != resource:
+        raise ValueError('{} was partly imported into {}'.format(
+            filename, progress.resource))
+
+    imported, invalid = 0, 0
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        records = enumerate(read(f), start=1)
+        # Skip the records of the committed batches, if they are the ones
+        # of this file
+        for _, record in itertools.islice(records, progress.records):
+            fingerprint.update(record_fingerprint(record))
+        if (progress.records and
+                fingerprint.hexdigest() != progress.fingerprint):
+            raise ValueError(
+                'the first {} records of {} differ from the ones imported '
+                'before, use --restart to import it from the start'.format(
+                    progress.records, filename))
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            reference = reference_cache.get()
+            rows, rejected = [], []
+            for record_number, record in batch:
+                fingerprint.update(record_fingerprint(record))
+                try:
+                    if not isinstance(record, dict):
+                        raise ValidationError('expected a JSON object')
+                    rows.append((record_number, parse(record, reference)))
+                except ValidationError as e:
+                    rejected.append((record_number, e.args[0]))
+            try:
+                rejected.extend(write(rows, user_id))
+                progress.records = batch[-1][0]
+                progress.fingerprint = fingerprint.hexdigest()
+                db.session.add(progress)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            imported += len(batch) - len(rejected)
+            invalid += len(rejected)
+            if on_invalid is not None:
+                for record_number, message in sorted(rejected):
+                    on_invalid(record_number, message)
+
+    # Completed, a new import of the file starts over
+    if progress.records:
+        db.session.delete(progress)
+        db.session.commit()
+    return imported, invalid
+
+
+# Bulk user provisioning
+# Users are read like the records above (fields email_address, password
+# and optionally provider, username) and inserted in batches. Their
+# passwords are hashed in a pool of processes, see myapp/utils/argon2.py.
+# Users whose email address exists already (for their provider) are
+# skipped, the file can be provisioned again after a failure.
+
+def parse_user(record):
+    """ Returns the user (dict) of a record """
+    return {
+        'provider': get_string(record, 'provider') or 'myapp',
+        'email_address': get_string(record, 'email_address', required=True),
+        'username': get_string(record, 'username'),
+        'password': get_string(record, 'password', required=True)
+    }
+
+
+def existing_email_addresses(users):
+    """
+    Returns the (provider, lower case email address) of users that exist,
+    one query.
+    """
+    providers = OrderedDict()
+    for user in users:
+        providers.setdefault(user['provider'], []).append(
+            user['email_address'].lower())
+    email_address = func.lower(User.email_address)
+    return {(provider, address) for provider, address in db.session.execute(
+        select([User.provider, email_address]).where(or_(*[
+            and_(User.provider == provider, email_address.in_(addresses))
+            for provider, addresses in providers.items()])))}
+
+
+def provision_users(filename, file_format=None, batch_size=None,
+                    workers=None, on_invalid=None):
+    """
+    Creates the users of a file in batches, one transaction per batch,
+    hashing their passwords in workers processes.
+
+    Args:
+        filename: NDJSON, CSV or JSON array file
+        file_format: ndjson, csv or json, by default by the file extension
+        batch_size: users per batch, default IMPORT_BATCH_SIZE
+        workers: number of processes, by default argon2_workers() with
+            ARGON2_MAX_WORKERS and ARGON2_MEMORY_FRACTION
+        on_invalid: function called with the record number (from 1) and
+            the error message of each invalid record
+
+    Returns:
+        number of created, skipped (existing) and invalid users
+    """
+    read = READERS[file_format or get_format(filename)]
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    if workers is None:
+        workers = argon2_workers(
+            current_app.config['ARGON2_MAX_WORKERS'],
+            current_app.config['ARGON2_MEMORY_FRACTION'])
+
+    created, skipped, invalid = 0, 0, 0
+    # One process does without a pool
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            records = enumerate(read(f), start=1)
+            while True:
+                batch = list(itertools.islice(records, batch_size))
+                if not batch:
+                    break
+                users = []
+                for record_number, record in batch:
+                    try:
+                        if not isinstance(record, dict):
+                            raise ValidationError('expected a JSON object')
+                        users.append(parse_user(record))
+                    except ValidationError as e:
+                        invalid += 1
+                        if on_invalid is not None:
+                            on_invalid(record_number, e.args[0])
+
+                # Skip existing users and repeated email addresses
+                seen = existing_email_addresses(users) if users else set()
+                new_users = []
+                for user in users:
+                    key = (user['provider'], user['email_address'].lower())
+                    if key not in seen:
+                        seen.add(key)
+                        new_users.append(user)
+                insert_users(new_users, executor)
+                db.session.commit()
+                created += len(new_users)
+                skipped += len(users) - len(new_users)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return created, skipped, invalid
@@ -0,0 +1,147 @@
+from sqlalchemy import text
+
+from myapp.models.db_orm import db, create_missing_indexes, reset_sequence
+from myapp.models.db_models import ComponentType
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_stats import rebuild_statistics
+from myapp.models.db_types import pack_ip_address, parse_ip_address
+
+
+# Data migrations of existing databases
+# db_create drops and recreates all tables, the functions below convert the
+# data of an existing database in place, in chunks of CHUNK_SIZE rows with a
+# commit per chunk, so they can be interrupted and run again.
+# Run them with the flask db-migrate-* commands (autoapp.py).
+
+CHUNK_SIZE = 1000
+
+
+def migrate_ip_addresses():
+    """
+    Converts store_components.ip_address from strings to the IPAddress
+    column type (db_types.py): inet on PostgreSQL, 16 bytes on SQLite.
+    Addresses that are no valid IP address are set to NULL.
+    Creates the index ix_store_components_ip_address.
+
+    Returns:
+        number of converted addresses, list of (id, value) of the invalid
+        addresses
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        raise NotImplementedError(
+            'migrate_ip_addresses supports SQLite and PostgreSQL')
+    if dialect == 'sqlite':
+        # SQLite keeps the declared column type, only the values change
+        pending = text(
+            "SELECT id, ip_address FROM store_components "
+            "WHERE typeof(ip_address) = 'text' AND id > :last "
+            "ORDER BY id LIMIT :limit")
+    else:
+        pending = text(
+            "SELECT id, ip_address FROM store_components "
+            "WHERE ip_address IS NOT NULL AND id > :last "
+            "ORDER BY id LIMIT :limit")
+    update = text(
+        'UPDATE store_components SET ip_address = :ip_address '
+        'WHERE id = :b_id')
+
+    converted, invalid = 0, []
+    last = 0
+    while True:
+        rows = db.session.execute(
+            pending, {'last': last, 'limit': CHUNK_SIZE}).fetchall()
+        if not rows:
+            break
+        values = []
+        for row_id, value in rows:
+            try:
+                address = parse_ip_address(value.strip())
+            except ValueError:
+                invalid.append((row_id, value))
+                values.append({'b_id': row_id, 'ip_address': None})
+                continue
+            values.append({
+                'b_id': row_id,
+                'ip_address': (pack_ip_address(address) if dialect == 'sqlite'
+                               else str(address))})
+            converted += 1
+        db.session.execute(update, values)
+        db.session.commit()
+        last = rows[-1][0]
+
+    if dialect == 'postgresql':
+        db.session.execute(
+            'ALTER TABLE store_components ALTER COLUMN ip_address '
+            'TYPE inet USING ip_address::inet')
+        db.session.commit()
+    create_missing_indexes()
+    return converted, invalid
+
+
+def migrate_component_types():
+    """
+    Moves store_components.component_type (a string per row) to the
+    component_types table, store_components refers to it by type_id:
+    -   creates component_types and inserts the distinct names,
+    -   adds and fills store_components.type_id,
+    -   drops the component_type column and its indexes (SQLite 3.35+),
+    -   creates the indexes on type_id and recounts the statistics, which
+        are grouped by type_id now.
+
+    Returns:
+        number of store components converted
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        raise NotImplementedError(
+            'migrate_component_types supports SQLite and PostgreSQL')
+    ComponentType.__table__.create(bind=db.engine, checkfirst=True)
+    columns = [column['name'] for column in
+               db.inspect(db.engine).get_columns('store_components')]
+    if 'component_type' not in columns:
+        return 0
+
+    # Keep the ids of the types that exist (db_load_component_types), which
+    # were inserted with their ids
+    reset_sequence('component_types')
+    db.session.execute(
+        'INSERT INTO component_types (name) '
+        'SELECT DISTINCT component_type FROM store_components '
+        'WHERE component_type NOT IN (SELECT name FROM component_types) '
+        'ORDER BY component_type')
+    if 'type_id' not in columns:
+        db.session.execute(
+            'ALTER TABLE store_components ADD COLUMN type_id SMALLINT '
+            'REFERENCES component_types (id)')
+    db.session.commit()
+
+    update = text(
+        'UPDATE store_components SET type_id = ('
+        'SELECT id FROM component_types '
+        'WHERE name = store_components.component_type) '
+        'WHERE type_id IS NULL AND id > :first AND id <= :last')
+    last_id = db.session.execute(
+        'SELECT max(id) FROM store_components').scalar() or 0
+    converted = 0
+    for first in range(0, last_id, CHUNK_SIZE):
+        converted += db.session.execute(
+            update, {'first': first, 'last': first + CHUNK_SIZE}).rowcount
+        db.session.commit()
+
+    # Both indexes contain component_type, which can't be dropped with them
+    db.session.execute(
+        'DROP INDEX IF EXISTS ix_store_components_component_type')
+    db.session.execute('DROP INDEX IF EXISTS ix_store_components_store_id')
+    db.session.execute(
+        'ALTER TABLE store_components DROP COLUMN component_type')
+    if dialect == 'postgresql':
+        # SQLite can't add NOT NULL to an existing column, new databases
+        # (db_create) have it
+        db.session.execute(
+            'ALTER TABLE store_components ALTER COLUMN type_id SET NOT NULL')
+    db.session.commit()
+    reference_cache.invalidate()
+    create_missing_indexes()
+    rebuild_statistics()
+    return converted
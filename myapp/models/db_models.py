@@ -1,31 +1,49 @@
 import random
 import string
+from collections import defaultdict
 
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
 from flask_login import UserMixin
 
-from myapp.models.db_orm import db
+from myapp.models.db_orm import ApiMixin, db
+from myapp.models.db_types import IPAddress, parse_ip_address
 
 from myapp.utils.argon2 import generate_argon2_hash, check_argon2_hash
 
 
-# TODO: review if indexes are created with PK, add others if needed as well
-# TODO: add naming conventions using metadata
-# http://docs.sqlalchemy.org/en/latest/core/constraints.html#configuring-constraint-naming-conventions  # noqa
+# Indexes
+# Primary keys and unique constraints come with an index, which also serves
+# lookups on their leading columns (e.g. stores.country_code). Other indexes
+# support the foreign keys, the API filters and sort keys
+# (myapp/api/filters.py) and the lookups of the views, they are named
+# ix_<table>_<first column>, see the naming conventions in db_orm.py.
+# On an existing database flask db-create-indexes creates missing indexes.
 
 # Relationships
 # One to One (1:1) - For example, one employee is assigned one employee id
 # One to Many (1:M) - one department contains many employees
 # Many to Many (M:M) - many employees take many training courses
 # We are using SQLAlchemy lazy='dynamic' with returns a query object
-# instead of firing the query.
+# instead of firing the query, for the stores of a user, dc or status: they
+# are never loaded into memory as a whole.
+# The other relationships are loaded lazily (lazy='select'): accessing one
+# fires a query per object, which becomes N+1 when a list of stores is
+# walked. Queries of stores that walk relationships eager-load them, see
+# Store.query_with: dc, status and user are joined into the same statement,
+# components are loaded with one more statement (SELECT ... IN) for all
+# stores.
+
+# Reference data (countries, distribution centers, store statuses) is read
+# through the process-local cache in db_cache.py. It is imported inside the
+# methods because db_cache itself depends on these models.
 
 # We are using SQLAlchemy's server_default / onupdate / server_onupdate
 # for our timestamps. On the frontend it needs some handling.
 # Another common way is using datetime.utcnow
 
 
-class User(UserMixin, db.Model):
+class User(UserMixin, ApiMixin, db.Model):
 
     """
     Maps subclass of declarative_base() to a Python class
@@ -54,7 +72,24 @@ class User(UserMixin, db.Model):
         db.PrimaryKeyConstraint('id', name='pk_users'),
         db.UniqueConstraint(
             'provider', 'social_id',
-            name='uq_users_1'))
+            name='uq_users_1'),
+        # Case-insensitive sign-in lookup, see get_by_email
+        db.Index('ix_users_email_address', func.lower(email_address)))
+
+    def get_by_email(email_address, provider=None):
+        """
+        Returns the user with email_address (case-insensitive), None if
+        unknown.
+
+        Args:
+            email_address: email address
+            provider: only users of this provider (e.g. myapp), if given
+        """
+        query = User.query.filter(
+            func.lower(User.email_address) == email_address.lower())
+        if provider is not None:
+            query = query.filter(User.provider == provider)
+        return query.order_by(User.id).first()
 
     def generate_social_id(size=20, chars=string.digits):
         """
@@ -87,20 +122,18 @@ class User(UserMixin, db.Model):
         """
         return check_argon2_hash(password, self.password_hash)
 
-    def to_dict(self):
-        """ Convert the model to a dictionary that can go into a JSON """
-        return {
-            # id is unnecessary
-            'provider': self.provider,
-            'social_id': self.social_id,
-            'email_address': self.email_address,
-            'username': self.username,
-            'created_date': self.created_date,
-            'updated_date': self.updated_date
-        }
+    # Fields returned by to_dict, id is unnecessary
+    api_fields = (
+        'provider',
+        'social_id',
+        'email_address',
+        'username',
+        'created_date',
+        'updated_date'
+        )
 
 
-class Country(db.Model):
+class Country(ApiMixin, db.Model):
 
     """
     Maps subclass of declarative_base() to a Python class
@@ -121,19 +154,24 @@ class Country(db.Model):
         db.UniqueConstraint(
             'country_code', name='uq_countries_1'))
 
+    def get(country_code):
+        """ Returns a (cached) country by country_code, None if unknown """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.lookup('countries_by_code', country_code)
+
     def get_all():
-        """ Returns all countries ordered by country_code """
-        return Country.query.order_by('country_code').all()
-
-    def to_dict(self):
-        """ Convert the model to a dictionary that can go into a JSON """
-        return {
-            'country_code': self.country_code,
-            'country_name': self.country_name
-        }
+        """ Returns all (cached) countries ordered by country_code """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.get().countries
+
+    # Fields returned by to_dict
+    api_fields = (
+        'country_code',
+        'country_name'
+        )
 
 
-class DistributionCenter(db.Model):
+class DistributionCenter(ApiMixin, db.Model):
 
     """
     Maps subclass of declarative_base() to a Python class
@@ -164,45 +202,56 @@ class DistributionCenter(db.Model):
 
     def get_id(country_code, number):
         """
-        Returns id (pk) based on country_code and number.
+        Returns id (pk) based on country_code and number, raises LookupError
+        if unknown.
         Some countries (like LU) have no DC, it needs to be handled in imports.
         """
         # In table distribution_centers we can use the unique
         # country_code, number
-        dc = DistributionCenter.query.filter_by(
-            country_code=country_code,
-            number=number
-            ).first()
+        from myapp.models.db_cache import reference_cache
+        dc = reference_cache.lookup(
+            'distribution_centers_by_key', (country_code, number))
+        if dc is None:
+            raise LookupError('unknown distribution center {}-{}'.format(
+                country_code, number))
         return dc.id
 
+    def get(id):
+        """
+        Returns a (cached) distribution center by id (pk), None if unknown.
+        """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.lookup('distribution_centers_by_id', id)
+
     def get_name(id):
         """
-        Returns name based on id (pk).
+        Returns name based on id (pk), raises LookupError if unknown.
         """
-        dc = DistributionCenter.query.filter_by(id=id).first()
+        dc = DistributionCenter.get(id)
+        if dc is None:
+            raise LookupError('unknown distribution center id {}'.format(id))
         return dc.name
 
     def get_all():
         """
-        Returns all distribution centers ordered by country_code, number
-        """
-        return DistributionCenter.query.order_by(
-            'country_code', 'number').all()
-
-    def to_dict(self):
-        """ Convert the model to a dictionary that can go into a JSON """
-        return {
-            # id is unnecessary
-            'country_code': self.country_code,
-            'number': self.number,
-            'name': self.name,
-            'tag': self.tag,
-            'created_date': self.created_date,
-            'updated_date': self.updated_date
-        }
+        Returns all (cached) distribution centers ordered by
+        country_code, number
+        """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.get().distribution_centers
+
+    # Fields returned by to_dict, id is unnecessary
+    api_fields = (
+        'country_code',
+        'number',
+        'name',
+        'tag',
+        'created_date',
+        'updated_date'
+        )
 
 
-class StoreStatus(db.Model):
+class StoreStatus(ApiMixin, db.Model):
 
     """
     Maps subclass of declarative_base() to a Python class
@@ -225,27 +274,36 @@ class StoreStatus(db.Model):
             'name',
             name='uq_store_status_1'))
 
+    def get(id):
+        """
+        Returns a (cached) store status by id (pk), None if unknown.
+        """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.lookup('store_status_by_id', id)
+
     def get_name(id):
         """
-        Returns name based on id (pk).
+        Returns name based on id (pk), raises LookupError if unknown.
         """
-        status = StoreStatus.query.filter_by(id=id).first()
+        status = StoreStatus.get(id)
+        if status is None:
+            raise LookupError('unknown store status id {}'.format(id))
         return status.name
 
     def get_all():
-        """ Returns all store statuses ordered by sequence """
-        return StoreStatus.query.order_by('sequence').all()
-
-    def to_dict(self):
-        """ Convert the model to a dictionary that can go into a JSON """
-        return {
-            'sequence': self.sequence,
-            'name': self.name,
-            'description': self.description
-        }
+        """ Returns all (cached) store statuses ordered by sequence """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.get().store_status
 
+    # Fields returned by to_dict
+    api_fields = (
+        'sequence',
+        'name',
+        'description'
+        )
 
-class Store(db.Model):
+
+class Store(ApiMixin, db.Model):
 
     """
     Maps subclass of declarative_base() to a Python class
@@ -270,6 +328,11 @@ class Store(db.Model):
         timezone=True), server_default=func.now())
     updated_date = db.Column(db.DateTime(
         timezone=True), onupdate=func.now())
+    # 1:M - components don't exist without their store, deleting a store
+    # through the session deletes its components
+    components = db.relationship(
+        'StoreComponent', backref='store', lazy='select',
+        order_by='StoreComponent.id', cascade='all, delete-orphan')
 
     # __table_args__ value must be a tuple, dict, or None
     __table_args__ = (
@@ -282,77 +345,183 @@ class Store(db.Model):
         db.UniqueConstraint(
             'country_code',
             'number',
-            name='uq_stores_1'))
+            name='uq_stores_1'),
+        # Stores of a user (1:M)
+        db.Index('ix_stores_user_id', 'user_id'),
+        # Filters on dc / status, sorted by the default country_code, number
+        db.Index('ix_stores_dc_id', 'dc_id', 'country_code', 'number'),
+        db.Index('ix_stores_status_id', 'status_id', 'country_code', 'number'),
+        db.Index('ix_stores_city', 'city'),
+        # updated_since filter
+        db.Index('ix_stores_created_date', 'created_date'),
+        db.Index('ix_stores_updated_date', 'updated_date'))
+
+    # Lookups by natural key are served by the request-scoped resolver,
+    # see db_resolver.py: one query per store and request
 
     def get_id(country_code, number):
         """ Returns id (pk) based on country_code and number """
 
         # We need to find the store_id first to link the components
         # In table stores we can use the unique country_code, number
-        store = Store.query.filter_by(
-            country_code=country_code,
-            number=number
-            ).first()
-        return store.id
+        return Store.get(country_code, number).id
 
     def get(country_code, number):
         """ Returns a store by country_code, number """
-        return Store.query.filter_by(
-            country_code=country_code, number=number).first()
+        from myapp.models.db_resolver import store_resolver
+        return store_resolver.get(country_code, number)
 
     def get_user_id(country_code, number):
         """ Returns Store.user_id by country_code, number """
-        store = Store.query.filter_by(
-            country_code=country_code,
-            number=number
-            ).first()
-        return store.user_id
+        return Store.get(country_code, number).user_id
 
     def get_dc_id(country_code, number):
         """ Returns Store.dc_id by country_code, number """
-        store = Store.query.filter_by(
-            country_code=country_code,
-            number=number
-            ).first()
-        return store.dc_id
+        return Store.get(country_code, number).dc_id
 
     def get_status_id(country_code, number):
         """ Returns Store.status_id by country_code, number """
-        store = Store.query.filter_by(
-            country_code=country_code,
-            number=number
-            ).first()
-        return store.status_id
+        return Store.get(country_code, number).status_id
 
-    def get_all():
+    def get_with_names(country_code, number):
         """
-        Returns all stores ordered by country_code, number.
-        """
-        return Store.query.order_by('country_code', 'number').all()
-
-    def to_dict(self):
-        """
-        Convert the model to a dictionary that can go into a JSON.
-        TODO: it should return a non pk for dc, status
-        """
-        return {
-            # id is unnecessary
-            'country_code': self.country_code,
-            #
-            'dc_id': self.dc_id,
-            'number': self.number,
-            'name': self.name,
-            'status_id': self.status_id,
-            'street_name': self.street_name,
-            'street_number': self.street_number,
-            'postal_code': self.postal_code,
-            'city': self.city,
-            'created_date': self.created_date,
-            'updated_date': self.updated_date
+        Returns a store by country_code, number as row with the names of its
+        distribution center (dc_name) and status (status_name), one query.
+        None if unknown.
+        """
+        return db.session.query(
+            Store.id,
+            Store.country_code,
+            Store.number,
+            Store.name,
+            DistributionCenter.name.label('dc_name'),
+            StoreStatus.name.label('status_name'),
+            Store.street_number,
+            Store.street_name,
+            Store.postal_code,
+            Store.city,
+            Store.updated_date).join(
+            DistributionCenter, Store.dc_id == DistributionCenter.id).join(
+            StoreStatus, Store.status_id == StoreStatus.id).filter(
+            Store.country_code == country_code,
+            Store.number == number).first()
+
+    def load_options(*relationships):
+        """
+        Returns the loader options eager-loading the given relationships of
+        stores: dc, status and user are joined (many-to-one), components
+        are loaded with one SELECT ... IN statement per query.
+        """
+        loaders = {
+            'dc': db.joinedload(Store.dc),
+            'status': db.joinedload(Store.status),
+            'user': db.joinedload(Store.user),
+            'components': db.selectinload(Store.components)
         }
+        return [loaders[relationship] for relationship in relationships]
 
+    def query_with(*relationships):
+        """
+        Returns the query of stores eager-loading the given relationships,
+        e.g. Store.query_with('dc', 'status').
+        """
+        return Store.query.options(*Store.load_options(*relationships))
 
-class StoreComponent(db.Model):
+    def get_all(*relationships):
+        """
+        Returns all stores ordered by country_code, number, eager-loading
+        the given relationships, see load_options.
+        """
+        return Store.query_with(*relationships).order_by(
+            Store.country_code, Store.number).all()
+
+    # Fields returned by to_dict, id is unnecessary
+    # TODO: it should return a non pk for dc, status
+    api_fields = (
+        'country_code',
+        'dc_id',
+        'number',
+        'name',
+        'status_id',
+        'street_name',
+        'street_number',
+        'postal_code',
+        'city',
+        'created_date',
+        'updated_date'
+        )
+
+
+class ComponentType(ApiMixin, db.Model):
+
+    """
+    Maps subclass of declarative_base() to a Python class
+    to table component_types.
+    Store components refer to their type by its small integer id, the API
+    exposes the name (e.g. network_access_points).
+    """
+
+    __tablename__ = 'component_types'
+
+    id = db.Column(db.Integer)
+    name = db.Column(db.String, nullable=False)  # unique
+    description = db.Column(db.String)
+
+    # __table_args__ value must be a tuple, dict, or None
+    __table_args__ = (
+        db.PrimaryKeyConstraint('id', name='pk_component_types'),
+        db.UniqueConstraint(
+            'name',
+            name='uq_component_types_1'))
+
+    def get(id):
+        """
+        Returns a (cached) component type by id (pk), None if unknown.
+        """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.lookup('component_types_by_id', id)
+
+    def get_name(id):
+        """
+        Returns name based on id (pk), raises LookupError if unknown.
+        """
+        component_type = ComponentType.get(id)
+        if component_type is None:
+            raise LookupError('unknown component type id {}'.format(id))
+        return component_type.name
+
+    def get_id(name):
+        """
+        Returns id (pk) based on name, raises ValueError if unknown.
+        """
+        from myapp.models.db_cache import reference_cache
+        component_type = reference_cache.lookup(
+            'component_types_by_name', name)
+        if component_type is None:
+            raise ValueError('unknown component type: {}'.format(name))
+        return component_type.id
+
+    def get_ids(names):
+        """
+        Returns the ids (pk) of the known component types in names.
+        """
+        from myapp.models.db_cache import reference_cache
+        by_name = reference_cache.get().component_types_by_name
+        return [by_name[name].id for name in names if name in by_name]
+
+    def get_all():
+        """ Returns all (cached) component types ordered by id """
+        from myapp.models.db_cache import reference_cache
+        return reference_cache.get().component_types
+
+    # Fields returned by to_dict
+    api_fields = (
+        'name',
+        'description'
+        )
+
+
+class StoreComponent(ApiMixin, db.Model):
 
     """
     Maps subclass of declarative_base() to a Python class
@@ -364,11 +533,12 @@ class StoreComponent(db.Model):
     id = db.Column(db.Integer)
     # MAJOR TODO: need to retrieve correct store_id
     store_id = db.Column(db.Integer, nullable=False)
-    # TODO: move component_type data to its own tables
-    component_type = db.Column(db.String, nullable=False)
+    # Id of the ComponentType, the component_type property gives its name
+    type_id = db.Column(db.SmallInteger, nullable=False)
     hostname = db.Column(db.String, nullable=False)  # unique
-    # MAJOR TODO: use conversion functions or the postgresql datatype for ip
-    ip_address = db.Column(db.String)  # unique
+    # Validated and normalized on write, inet on PostgreSQL and 16 bytes
+    # elsewhere, see db_types.py
+    ip_address = db.Column(IPAddress)  # unique
     created_date = db.Column(db.DateTime(
         timezone=True), server_default=func.now())
     updated_date = db.Column(db.DateTime(
@@ -379,28 +549,191 @@ class StoreComponent(db.Model):
         db.PrimaryKeyConstraint('id', name='pk_store_components'),
         # 1:M - one store can have many components
         db.ForeignKeyConstraint(['store_id'], ['stores.id']),
+        db.ForeignKeyConstraint(['type_id'], ['component_types.id']),
         db.UniqueConstraint(
             'store_id',
             'hostname',
-            name='uq_store_components_1'))
+            name='uq_store_components_1'),
+        # Components of a store by type, see get_all_by_type
+        db.Index('ix_store_components_store_id', 'store_id', 'type_id'),
+        # Filter on component_type, sorted by the default id
+        db.Index('ix_store_components_type_id', 'type_id', 'id'),
+        # Filters on ip network / range
+        db.Index('ix_store_components_ip_address', 'ip_address'),
+        # updated_since filter
+        db.Index('ix_store_components_created_date', 'created_date'),
+        db.Index('ix_store_components_updated_date', 'updated_date'))
+
+    @property
+    def component_type(self):
+        """ Name of the component type """
+        if self.type_id is None:
+            return None
+        return ComponentType.get_name(self.type_id)
+
+    @component_type.setter
+    def component_type(self, name):
+        """ Sets the type by name, raises ValueError if it is unknown """
+        self.type_id = ComponentType.get_id(name)
+
+    @validates('ip_address')
+    def validate_ip_address(self, key, ip_address):
+        """ Normalizes ip_address, raises ValueError if it is invalid """
+        if ip_address is None:
+            return None
+        return str(parse_ip_address(ip_address))
 
     def get_all_by_type(store_id, component_type):
         """ Returns store components based on store_id and component_type """
+        type_ids = ComponentType.get_ids([component_type])
+        if not type_ids:
+            return []
         components = StoreComponent.query.filter_by(
             store_id=store_id,
-            component_type=component_type
+            type_id=type_ids[0]
             ).all()
         return components
 
-    def to_dict(self):
-        """ Convert the model to a dictionary that can go into a JSON """
-        return {
-            # id is unnecessary
-            # MAJOR TODO: rewrite store_id to something readable
-            'store_id': self.store_id,
-            'component_type': self.component_type,
-            'hostname': self.hostname,
-            'ip_address': self.ip_address,
-            'created_date': self.created_date,
-            'updated_date': self.updated_date
-        }
+    def get_all_by_store(store_id):
+        """
+        Returns the components of a store by component_type, one query:
+        {component_type: [(type_id, hostname, ip_address), ...]}
+        """
+        components = defaultdict(list)
+        for component in db.session.query(
+                StoreComponent.type_id,
+                StoreComponent.hostname,
+                StoreComponent.ip_address).filter(
+                StoreComponent.store_id == store_id).order_by(
+                StoreComponent.type_id, StoreComponent.id):
+            components[ComponentType.get_name(component.type_id)].append(
+                component)
+        return components
+
+    # Fields of api_fields that are no column of the table, Core selects
+    # read them with a join (see db_rows.select_fields)
+    api_columns = {'component_type': ComponentType.name}
+
+    def api_from():
+        """ Returns the join of store_components on component_types """
+        return StoreComponent.__table__.join(
+            ComponentType.__table__,
+            StoreComponent.type_id == ComponentType.id)
+
+    # Fields returned by to_dict, id is unnecessary
+    # MAJOR TODO: rewrite store_id to something readable
+    api_fields = (
+        'store_id',
+        'component_type',
+        'hostname',
+        'ip_address',
+        'created_date',
+        'updated_date'
+        )
+
+
+class Statistic(db.Model):
+
+    """
+    Maps subclass of declarative_base() to a Python class
+    to table statistics.
+    Summary table with the row counts per group, e.g. the number of stores
+    per country (name stores.country_code, key BE). It is kept up to date
+    by the write paths, see db_stats.py
+    """
+
+    __tablename__ = 'statistics'
+
+    name = db.Column(db.String, nullable=False)
+    key = db.Column(db.String, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    created_date = db.Column(db.DateTime(
+        timezone=True), server_default=func.now())
+    updated_date = db.Column(db.DateTime(
+        timezone=True), onupdate=func.now())
+
+    # __table_args__ value must be a tuple, dict, or None
+    __table_args__ = (
+        db.PrimaryKeyConstraint('name', 'key', name='pk_statistics'),)
+
+
+class Change(db.Model):
+
+    """
+    Maps subclass of declarative_base() to a Python class
+    to table changes.
+    Change log of stores and store components, one row per insert, update
+    or delete. Deleted rows leave their key behind as tombstone.
+    See db_changes.py
+    """
+
+    __tablename__ = 'changes'
+
+    # Increasing id, the position in the change feed
+    id = db.Column(db.Integer)
+    table_name = db.Column(db.String, nullable=False)
+    action = db.Column(db.String, nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    # Natural key of the row as JSON, e.g. {"country_code":"BE","number":1}
+    key = db.Column(db.String, nullable=False)
+    # Store (of the component) and component type, to filter the changes
+    country_code = db.Column(db.String(2))
+    number = db.Column(db.Integer)
+    component_type = db.Column(db.String)
+    created_date = db.Column(db.DateTime(
+        timezone=True), server_default=func.now())
+
+    # __table_args__ value must be a tuple, dict, or None
+    # AUTOINCREMENT on SQLite, ids of deleted changes are never reused
+    __table_args__ = (
+        db.PrimaryKeyConstraint('id', name='pk_changes'),
+        {'sqlite_autoincrement': True})
+
+
+class ImportProgress(db.Model):
+
+    """
+    Maps subclass of declarative_base() to a Python class
+    to table import_progress.
+    Position of an unfinished streaming import, one row per source file:
+    the number of records of the committed batches. It is written in the
+    transaction of each batch and deleted when the import completes, see
+    db_import.py
+    """
+
+    __tablename__ = 'import_progress'
+
+    # Absolute path of the imported file
+    source = db.Column(db.String, nullable=False)
+    # stores or store_components
+    resource = db.Column(db.String, nullable=False)
+    records = db.Column(db.Integer, nullable=False, default=0)
+    # SHA-1 of the imported records, see db_import.record_fingerprint
+    fingerprint = db.Column(db.String)
+    created_date = db.Column(db.DateTime(
+        timezone=True), server_default=func.now())
+    updated_date = db.Column(db.DateTime(
+        timezone=True), onupdate=func.now())
+
+    # __table_args__ value must be a tuple, dict, or None
+    __table_args__ = (
+        db.PrimaryKeyConstraint('source', name='pk_import_progress'),)
+
+
+class TableVersion(db.Model):
+
+    """
+    Maps subclass of declarative_base() to a Python class
+    to table table_versions.
+    Counter per table, incremented by every transaction that writes to the
+    table, see db_versions.py
+    """
+
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    # __table_args__ value must be a tuple, dict, or None
+    __table_args__ = (
+        db.PrimaryKeyConstraint('name', name='pk_table_versions'),)
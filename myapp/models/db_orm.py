@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import MetaData
 
 
 # Flask-SQLAlchemy
@@ -6,6 +7,95 @@ from flask_sqlalchemy import SQLAlchemy
 # and sqlalchemy.orm. Furthermore it provides a class called Model
 # that is a declarative base which can be used to declare models.
 
+# Naming conventions for constraints and indexes without explicit name
+# http://docs.sqlalchemy.org/en/latest/core/constraints.html#configuring-constraint-naming-conventions  # noqa
+# Explicit names in db_models.py follow the same scheme, except the unique
+# constraints uq_<table>_1 that predate the conventions.
+NAMING_CONVENTION = {
+    'ix': 'ix_%(table_name)s_%(column_0_name)s',
+    'uq': 'uq_%(table_name)s_%(column_0_name)s',
+    'ck': 'ck_%(table_name)s_%(constraint_name)s',
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+    'pk': 'pk_%(table_name)s'
+}
+
 # Set autoflush to False, required for PostgreSQL (not on SQLite)
 # http://docs.sqlalchemy.org/en/latest/orm/session_api.html#sqlalchemy.orm.session.Session.params.autoflush
-db = SQLAlchemy(session_options={'autoflush': False})
+db = SQLAlchemy(
+    metadata=MetaData(naming_convention=NAMING_CONVENTION),
+    session_options={'autoflush': False})
+
+
+class ApiMixin(object):
+
+    """
+    Conversion of a model to the dictionary of its API representation,
+    the model lists its fields in api_fields.
+    """
+
+    api_fields = ()
+
+    def to_dict(self, fields=None):
+        """
+        Convert the model to a dictionary that can go into a JSON.
+        Only attributes in fields (a subset of api_fields) are read, if given.
+        """
+        return {field: getattr(self, field)
+                for field in fields or self.api_fields}
+
+
+# SQLAlchemy doesn't reflect expression-based indexes (e.g. on lower(...)),
+# their names are read from the catalog on SQLite and PostgreSQL
+INDEX_NAMES_SQL = {
+    'sqlite': "SELECT name FROM sqlite_master "
+              "WHERE type = 'index' AND tbl_name = :table_name",
+    'postgresql': "SELECT indexname FROM pg_indexes "
+                  "WHERE tablename = :table_name"
+}
+
+
+def get_index_names(inspector, table_name):
+    """ Returns the names of the indexes of a table in the database """
+    sql = INDEX_NAMES_SQL.get(db.engine.dialect.name)
+    if sql is None:
+        return {index['name'] for index in inspector.get_indexes(table_name)}
+    return {name for name, in db.engine.execute(
+        db.text(sql), table_name=table_name)}
+
+
+def create_missing_indexes():
+    """
+    Creates the indexes declared on the models that don't exist in the
+    database yet, e.g. after an upgrade. Tables and data are left alone,
+    unlike db_create. Missing tables are not created either, see db_create.
+
+    Returns:
+        list of the names of the created indexes
+    """
+    inspector = db.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = get_index_names(inspector, table.name)
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+    return created
+
+
+def reset_sequence(table_name, column='id'):
+    """
+    Moves the sequence of a serial column past the largest value on
+    PostgreSQL, rows inserted with explicit ids don't advance it and the
+    next insert without id would collide. Other databases use max(id) + 1.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    db.session.execute(db.text(
+        'SELECT setval(pg_get_serial_sequence(:table_name, :column), '
+        'coalesce(max({column}), 0) + 1, false) FROM {table_name}'.format(
+            column=column, table_name=table_name)),
+        {'table_name': table_name, 'column': column})
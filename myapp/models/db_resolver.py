@@ -0,0 +1,57 @@
+from flask import current_app, g, has_request_context
+
+from myapp.models.db_models import Store
+
+
+# Request-scoped store resolver
+# The store views look a store up by its natural key (country_code, number)
+# several times per request: ownership check, form defaults, template.
+# Store.get and its accessors (get_id, get_user_id, get_dc_id, get_status_id)
+# go through the resolver, which loads the store once per request and keeps
+# it in flask.g. Outside a request every call queries the database.
+#
+# The cached stores are ORM instances of the request's session: after a
+# commit they are expired and reloaded on first access. Call forget() after
+# changing the key of a store or deleting it.
+
+
+class StoreResolver(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['store_resolver'] = self
+        # g lives in the application context, which tests (and CLI
+        # commands) share between requests: clear it with the request
+        app.teardown_request(self.teardown)
+
+    def enabled(self):
+        return (has_request_context() and
+                'store_resolver' in current_app.extensions)
+
+    def get(self, country_code, number):
+        """ Returns a store by country_code, number, None if unknown """
+        if not self.enabled():
+            return self.query(country_code, number)
+        stores = g.setdefault('_stores', {})
+        key = (country_code, number)
+        if key not in stores:
+            stores[key] = self.query(country_code, number)
+        return stores[key]
+
+    def query(self, country_code, number):
+        return Store.query.filter_by(
+            country_code=country_code, number=number).first()
+
+    def forget(self):
+        """ Forgets the stores resolved in the current request """
+        if has_request_context():
+            g.pop('_stores', None)
+
+    def teardown(self, exception=None):
+        g.pop('_stores', None)
+
+
+store_resolver = StoreResolver()
@@ -0,0 +1,112 @@
+from sqlalchemy import select
+
+from myapp.models.db_orm import db
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+
+
+# Read-only rows
+# Serializing a collection through the ORM builds a model instance per row,
+# registers it in the session's identity map and then copies it into a dict
+# with to_dict(). For read-only API responses we skip all of that: Core
+# select() statements return plain result rows that are turned straight into
+# JSON-ready dicts, with the same keys and values as to_dict().
+# Where code needs an object per row, the rows are wrapped in the small
+# __slots__ classes below, which share api_fields and to_dict() with their
+# models.
+
+
+def field_columns(model, fields):
+    """
+    Returns the columns of the given fields of model. Fields that are no
+    column of the table (model.api_columns, e.g. the component_type name
+    of store components) are labelled with their field name.
+    """
+    api_columns = getattr(model, 'api_columns', {})
+    table = model.__table__
+    return [api_columns[field].label(field) if field in api_columns
+            else table.c[field] for field in fields]
+
+
+def select_columns(model, columns, fields):
+    """
+    Returns a Core select of columns, joining the tables of model.api_from()
+    if one of fields needs them.
+    """
+    statement = select(columns)
+    if any(field in getattr(model, 'api_columns', {}) for field in fields):
+        statement = statement.select_from(model.api_from())
+    return statement
+
+
+def select_fields(model, fields=None, extra=()):
+    """
+    Returns a Core select of the given fields of model.
+
+    Args:
+        model: model class with api_fields
+        fields: tuple of fields (default api_fields), selected first and in
+            this order, so rows can be zipped with fields
+        extra: column attributes that are also needed, e.g. sort keys
+    Returns:
+        sqlalchemy.sql.Select
+    """
+    fields = fields or model.api_fields
+    table = model.__table__
+    columns = field_columns(model, fields)
+    columns.extend(table.c[key.key] for key in extra if key.key not in fields)
+    return select_columns(model, columns, fields)
+
+
+def get_value(row, column):
+    """ Returns column of an object or of a dict of column values """
+    if isinstance(row, dict):
+        return row[column]
+    return getattr(row, column)
+
+
+def to_dicts(rows, fields):
+    """
+    Converts result rows of select_fields(model, fields) to the dicts
+    to_dict(fields) would return.
+    """
+    return [dict(zip(fields, row)) for row in rows]
+
+
+class ReadOnlyRow(object):
+
+    """
+    Base class of the read-only rows, attributes are the selected columns.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, row[name])
+
+    @classmethod
+    def select(cls):
+        """ Returns a Core select of the columns of this row class """
+        return select_columns(
+            cls.model, field_columns(cls.model, cls.__slots__),
+            cls.__slots__)
+
+    @classmethod
+    def fetch(cls, statement):
+        """ Executes statement and returns a list of row objects """
+        return [cls(row) for row in db.session.execute(statement)]
+
+
+class StoreRow(ReadOnlyRow):
+    model = Store
+    __slots__ = ('id', 'user_id') + Store.api_fields
+    api_fields = Store.api_fields
+    to_dict = Store.to_dict
+
+
+class StoreComponentRow(ReadOnlyRow):
+    model = StoreComponent
+    __slots__ = ('id',) + StoreComponent.api_fields
+    api_fields = StoreComponent.api_fields
+    to_dict = StoreComponent.to_dict
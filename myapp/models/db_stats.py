@@ -0,0 +1,200 @@
+from collections import Counter
+
+from sqlalchemy import Integer, and_, case, cast, func, select, text
+
+from myapp.models.db_orm import db
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_models import Statistic
+from myapp.models.db_rows import get_value
+from myapp.models.db_versions import mark_written
+
+
+# Statistics
+# Store counts per country, dc and status and component counts per type and
+# store are kept in the summary table statistics, one row per group:
+#   name                            key         count
+#   stores.country_code             BE          120
+#   store_components.type_id        1           240
+# Reading them costs one query over the groups, not a scan of the stores.
+#
+# The counts are maintained by the write paths (myapp/stores/views.py, the
+# loaders in db_data.py), in the same transaction as the rows they count:
+# call add_stores() / remove_stores() etc. before the commit. The deltas are
+# summed per group first and applied with one upsert (executemany) for all
+# touched groups, whatever the size of the batch. Groups whose count drops
+# to zero keep their row, get_statistics() leaves them out, except the
+# groups per store which are deleted with their store. Writes bypassing
+# these functions (SQL scripts, other tools) leave the counts stale,
+# rebuild_statistics() (flask db-rebuild-stats) recounts everything.
+
+STORE_GROUPS = ('country_code', 'dc_id', 'status_id')
+STORE_COMPONENT_GROUPS = ('type_id', 'store_id')
+STORE_ID_GROUP = 'store_components.store_id'
+
+# Keys are looked up in chunks, SQLite allows 999 parameters per statement
+CHUNK_SIZE = 500
+
+# Adds a delta to a count, inserting the group if it is new. One statement
+# per group, concurrent writers of the same group can't both insert it.
+# ON CONFLICT DO UPDATE needs SQLite 3.24 or PostgreSQL 9.5.
+UPSERT_SQL = text(
+    'INSERT INTO statistics (name, key, count) VALUES (:name, :key, :delta) '
+    'ON CONFLICT (name, key) DO UPDATE '
+    'SET count = statistics.count + excluded.count, '
+    'updated_date = CURRENT_TIMESTAMP')
+
+
+def group_name(model, column):
+    return '{}.{}'.format(model.__tablename__, column)
+
+
+def store_deltas(stores, sign=1):
+    """
+    Returns the count deltas of adding (sign 1) or removing (sign -1) stores.
+
+    Args:
+        stores: objects with the attributes country_code, dc_id, status_id
+            (Store instances, StoreRow...) or dicts with these keys
+    """
+    deltas = Counter()
+    for store in stores:
+        for column in STORE_GROUPS:
+            deltas[(group_name(Store, column),
+                    str(get_value(store, column)))] += sign
+    return deltas
+
+
+def store_component_deltas(components, sign=1):
+    """
+    Returns the count deltas of adding (sign 1) or removing (sign -1)
+    components.
+
+    Args:
+        components: objects with the attributes type_id, store_id
+            or dicts with these keys
+    """
+    deltas = Counter()
+    for component in components:
+        for column in STORE_COMPONENT_GROUPS:
+            deltas[(group_name(StoreComponent, column),
+                    str(get_value(component, column)))] += sign
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Adds deltas {(name, key): delta} to the counts, in the current
+    transaction. Groups dropping to zero keep their row, with count 0,
+    except the groups per store: stores come and go, their ids are not
+    reused.
+    """
+    deltas = [{'name': name, 'key': key, 'delta': delta}
+              for (name, key), delta in deltas.items() if delta]
+    if not deltas:
+        return
+    db.session.execute(UPSERT_SQL, deltas)
+    mark_written(Statistic.__tablename__)
+    removed = [delta['key'] for delta in deltas
+               if delta['name'] == STORE_ID_GROUP and delta['delta'] < 0]
+    table = Statistic.__table__
+    for i in range(0, len(removed), CHUNK_SIZE):
+        db.session.execute(table.delete().where(and_(
+            table.c.name == STORE_ID_GROUP,
+            table.c.key.in_(removed[i:i + CHUNK_SIZE]),
+            table.c.count == 0)))
+
+
+def add_stores(stores):
+    """ Counts new stores """
+    apply_deltas(store_deltas(stores))
+
+
+def remove_stores(stores):
+    """ Uncounts deleted stores, before they are deleted """
+    apply_deltas(store_deltas(stores, -1))
+
+
+def add_store_components(components):
+    """ Counts new components """
+    apply_deltas(store_component_deltas(components))
+
+
+def store_component_deltas_of_stores(store_ids):
+    """
+    Returns the count deltas of removing the components of the given stores.
+    They are counted per group in the database, not loaded.
+    """
+    deltas = Counter()
+    for i in range(0, len(store_ids), CHUNK_SIZE):
+        rows = db.session.execute(select([
+            StoreComponent.type_id, StoreComponent.store_id,
+            func.count()]).where(
+            StoreComponent.store_id.in_(store_ids[i:i + CHUNK_SIZE])).group_by(
+            StoreComponent.type_id, StoreComponent.store_id))
+        for type_id, store_id, count in rows:
+            deltas[(group_name(StoreComponent, 'type_id'),
+                    str(type_id))] -= count
+            deltas[(group_name(StoreComponent, 'store_id'),
+                    str(store_id))] -= count
+    return deltas
+
+
+def remove_store_components(store_ids):
+    """ Uncounts the components of the given stores, before deletion """
+    apply_deltas(store_component_deltas_of_stores(store_ids))
+
+
+def rebuild_statistics():
+    """
+    Recounts all groups from the stores and store_components tables and
+    commits. Use it after writes that bypassed the functions above.
+    """
+    table = Statistic.__table__
+    db.session.execute(table.delete())
+    for model, groups in ((Store, STORE_GROUPS),
+                          (StoreComponent, STORE_COMPONENT_GROUPS)):
+        for column in groups:
+            key = model.__table__.c[column]
+            rows = db.session.execute(
+                select([key, func.count()]).group_by(key))
+            inserts = [{'name': group_name(model, column), 'key': str(value),
+                        'count': count} for value, count in rows]
+            if inserts:
+                db.session.execute(table.insert(), inserts)
+    db.session.commit()
+
+
+def get_statistics(store_keys=False):
+    """
+    Returns all counts as {name: {key: count}}, with one query. Groups
+    with count 0 are left out.
+
+    Args:
+        store_keys: key the component counts per store by
+            <country_code>-<number> instead of the store id, joining the
+            stores in the same query
+    """
+    table = Statistic.__table__
+    statistics = {}
+    for model, groups in ((Store, STORE_GROUPS),
+                          (StoreComponent, STORE_COMPONENT_GROUPS)):
+        for column in groups:
+            statistics[group_name(model, column)] = {}
+    columns = [table.c.name, table.c.key, table.c.count]
+    from_clause = table
+    if store_keys:
+        stores = Store.__table__
+        columns += [stores.c.country_code, stores.c.number]
+        # The key is cast, not the id: each group is one lookup of the
+        # primary key. Only keys of the store_id group are cast, the others
+        # aren't numbers.
+        from_clause = table.outerjoin(stores, stores.c.id == case([(
+            table.c.name == STORE_ID_GROUP, cast(table.c.key, Integer))]))
+    for row in db.session.execute(select(columns).select_from(
+            from_clause).where(table.c.count != 0)):
+        key = row.key
+        if store_keys and row.country_code is not None:
+            key = '{}-{}'.format(row.country_code, row.number)
+        statistics.setdefault(row.name, {})[key] = row.count
+    return statistics
@@ -0,0 +1,207 @@
+import hashlib
+import json
+
+from sqlalchemy import bindparam, select
+
+from myapp.exceptions import ValidationError
+from myapp.models.db_orm import db
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_models import Store
+from myapp.models.db_data import CHUNK_SIZE, default_dc_number
+from myapp.models.db_data import delete_stores, insert_stores
+from myapp.models import db_changes
+
+
+# Resync of stores from the store master (db/json/stores.json)
+# load_stores_from_json can only insert into an empty table. sync_stores
+# compares the master with the current stores by (country_code, number) and
+# only writes the differences:
+#   -   stores missing in the database are inserted (dc by
+#       default_dc_number unless the record has a dc_number, first status),
+#   -   stores whose master fields (SYNC_FIELDS) differ are updated,
+#   -   stores missing in the master are deleted, if asked.
+# Rows are compared by a content hash of their SYNC_FIELDS, computed the
+# same way for the master records and the current rows: only the keys,
+# ids and hashes of the stores are kept in memory. Unchanged stores cost
+# nothing but their share of one select, a nightly master with a few
+# changed stores is a few statements.
+# The writes go through db_data (executemany in chunks of CHUNK_SIZE),
+# with statistics and change log, in one transaction: the sync is applied
+# completely or not at all, and running it again changes nothing.
+
+# Fields of the master, dc and status are managed in the application
+SYNC_FIELDS = ('name', 'street_name', 'street_number', 'postal_code', 'city')
+
+
+def content_hash(row):
+    """ Returns the hash of the SYNC_FIELDS of a row (dict or object) """
+    values = [getattr(row, field) if not isinstance(row, dict)
+              else row.get(field) for field in SYNC_FIELDS]
+    return hashlib.sha1(json.dumps(
+        values, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def parse_master_store(key, value):
+    """
+    Returns the row of a store of the master,
+    {"<number>": {"store": {"country_code": ..., "name": ...}}}.
+    Empty fields are NULL, as in the database.
+    """
+    store = value.get('store') if isinstance(value, dict) else None
+    if not isinstance(store, dict):
+        raise ValidationError('expected a store object')
+    try:
+        number = int(key)
+    except ValueError:
+        raise ValidationError('number is no integer: {!r}'.format(key))
+    row = {field: str(store[field]) if store.get(field) not in (None, '')
+           else None for field in SYNC_FIELDS}
+    row.update(country_code=store.get('country_code'), number=number)
+    if not row['country_code']:
+        raise ValidationError('missing field country_code')
+    if not row['name']:
+        raise ValidationError('missing field name')
+    if store.get('dc_number') not in (None, ''):
+        row['dc_number'] = int(store['dc_number'])
+    return row
+
+
+def read_master(filename):
+    """
+    Returns the stores of the master file {(country_code, number): row}
+    and the list of (number, error message) of its invalid records.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        json_object = json.load(f)
+    stores, invalid = {}, []
+    for key, value in json_object['stores'].items():
+        try:
+            row = parse_master_store(key, value)
+        except (ValidationError, ValueError) as e:
+            invalid.append((key, e.args[0]))
+            continue
+        stores[(row['country_code'], row['number'])] = row
+    return stores, invalid
+
+
+def current_stores():
+    """
+    Returns {(country_code, number): (id, content hash)} of all stores,
+    one query.
+    """
+    table = Store.__table__
+    rows = db.session.execute(select(
+        [table.c.id, table.c.country_code, table.c.number] +
+        [table.c[field] for field in SYNC_FIELDS]))
+    return {(row.country_code, row.number): (row.id, content_hash(dict(row)))
+            for row in rows}
+
+
+def diff_stores(master, current):
+    """
+    Returns the keys to insert, update and delete to go from the current
+    stores to the master, each sorted.
+
+    Args:
+        master: {key: row}, see read_master
+        current: {key: (id, content hash)}, see current_stores
+    """
+    inserts = sorted(set(master) - set(current))
+    deletes = sorted(set(current) - set(master))
+    updates = sorted(key for key in set(master) & set(current)
+                     if content_hash(master[key]) != current[key][1])
+    return inserts, updates, deletes
+
+
+def new_store_rows(master, inserts, user_id, invalid):
+    """
+    Returns the rows to insert for the keys inserts of master, with their
+    dc and the first status. Stores of an unknown dc are added to invalid.
+    """
+    if not inserts:
+        return []
+    reference = reference_cache.get()
+    status_id = reference.store_status[0].id
+    rows = []
+    for key in inserts:
+        row = master[key]
+        dc_key = (key[0], row.get('dc_number') or default_dc_number(key[0]))
+        dc = reference.distribution_centers_by_key.get(dc_key)
+        if dc is None:
+            message = 'unknown distribution center {}-{}'.format(*dc_key)
+            invalid.append((str(key[1]), message))
+            continue
+        rows.append(dict(
+            {field: row[field] for field in SYNC_FIELDS},
+            user_id=user_id, country_code=key[0], number=key[1],
+            dc_id=dc.id, status_id=status_id))
+    return rows
+
+
+def sync_stores(filename='db/json/stores.json', delete=False, dry_run=False,
+                user_id=1):
+    """
+    Applies the differences between the store master and the stores table,
+    in one transaction. Deletes are skipped if the master has invalid
+    records: their stores would be deleted by mistake.
+
+    Args:
+        filename: store master, in the format of db/json/stores.json
+        delete: delete the stores (and their components) missing in the
+            master
+        dry_run: only count the differences, write nothing
+        user_id: owner of the inserted stores, the default user by default
+
+    Returns:
+        dict with the number of inserted, updated, deleted, unchanged
+        stores, the number of deletes skipped and the list of
+        (number, error message) of the invalid records
+    """
+    master, invalid = read_master(filename)
+    current = current_stores()
+    inserts, updates, deletes = diff_stores(master, current)
+    rows = new_store_rows(master, inserts, user_id, invalid)
+    skipped = 0
+    if not delete:
+        deletes = []
+    elif invalid:
+        skipped, deletes = len(deletes), []
+    result = {
+        'inserted': len(rows),
+        'updated': len(updates),
+        'deleted': len(deletes),
+        'unchanged': len(set(master) & set(current)) - len(updates),
+        'deletes_skipped': skipped,
+        'invalid': invalid
+    }
+    if dry_run or not (rows or updates or deletes):
+        return result
+
+    table = Store.__table__
+    if rows:
+        insert_stores(rows)
+
+    if updates:
+        values = [dict({field: master[key][field] for field in SYNC_FIELDS},
+                       b_id=current[key][0]) for key in updates]
+        for i in range(0, len(values), CHUNK_SIZE):
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('b_id')),
+                values[i:i + CHUNK_SIZE])
+        db_changes.record_updates(Store, [
+            {'id': current[key][0], 'country_code': key[0], 'number': key[1]}
+            for key in updates])
+
+    if deletes:
+        # The statistics need the dc and status of the deleted stores
+        ids = [current[key][0] for key in deletes]
+        stores = []
+        for i in range(0, len(ids), CHUNK_SIZE):
+            stores.extend(dict(row) for row in db.session.execute(select([
+                table.c.id, table.c.country_code, table.c.number,
+                table.c.dc_id, table.c.status_id]).where(
+                table.c.id.in_(ids[i:i + CHUNK_SIZE]))))
+        delete_stores(stores)
+
+    db.session.commit()
+    return result
@@ -0,0 +1,102 @@
+import ipaddress
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+
+# Custom column types
+
+# IPv4 addresses are stored as IPv4-mapped IPv6 addresses (::ffff:a.b.c.d),
+# every address is 16 bytes
+IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff' * 2
+IPV4_MAPPED_NETWORK = ipaddress.ip_network('::ffff:0:0/96')
+
+
+def parse_ip_address(value):
+    """
+    Returns value as IPv4Address or IPv6Address, an IPv4-mapped IPv6
+    address is returned as IPv4Address.
+    Raises ValueError if value is not a valid IP address.
+    """
+    address = ipaddress.ip_address(value)
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+def pack_ip_address(address):
+    """ Returns the 16 bytes of an IPv4Address or IPv6Address """
+    if address.version == 4:
+        return IPV4_MAPPED_PREFIX + address.packed
+    return address.packed
+
+
+def unpack_ip_address(packed):
+    """ Returns the IPv4Address or IPv6Address of 16 bytes """
+    return parse_ip_address(ipaddress.IPv6Address(bytes(packed)))
+
+
+class IPAddress(TypeDecorator):
+
+    """
+    IP address (IPv4 or IPv6), given and returned as string.
+    PostgreSQL stores it as inet. Other databases store it as 16 bytes,
+    which sort in numerical order, so the addresses of a network are a
+    range of values that an index can scan (see ip_range). Invalid
+    addresses raise ValueError.
+    """
+
+    impl = LargeBinary(16)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.INET())
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        address = parse_ip_address(value)
+        if dialect.name == 'postgresql':
+            return str(address)
+        return pack_ip_address(address)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            # inet on PostgreSQL, a string not converted yet otherwise
+            # (see db_migrations.migrate_ip_addresses)
+            return value
+        return str(unpack_ip_address(value))
+
+
+def ip_range(column, first, last):
+    """
+    Returns the criterion first <= column <= last on an IPAddress column.
+    An IPv6 range never matches IPv4 addresses, which are stored in the
+    IPv4-mapped block of IPv6 on databases other than PostgreSQL.
+
+    Args:
+        column: IPAddress column
+        first, last: IPv4Address or IPv6Address, or strings
+    """
+    first, last = parse_ip_address(first), parse_ip_address(last)
+    criterion = column.between(str(first), str(last))
+    if (first.version == 6 and
+            first <= IPV4_MAPPED_NETWORK.broadcast_address and
+            last >= IPV4_MAPPED_NETWORK.network_address):
+        criterion = criterion & ~column.between(
+            '0.0.0.0', '255.255.255.255')
+    return criterion
+
+
+def ip_network_range(column, network):
+    """
+    Returns the criterion for the addresses of network in an IPAddress
+    column, a range scan of its index.
+
+    Args:
+        column: IPAddress column
+        network: IPv4Network or IPv6Network
+    """
+    return ip_range(
+        column, network.network_address, network.broadcast_address)
@@ -0,0 +1,94 @@
+import weakref
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+from myapp.models.db_orm import db
+from myapp.models.db_models import TableVersion
+
+
+# Table versions
+# The validators of the API resources (api/conditional.py) need a value that
+# changes with every committed write of a table. Timestamps don't: SQLite
+# stores them by the second and PostgreSQL's now() is the start of the
+# transaction, not its commit. Table table_versions holds a counter per
+# table, incremented in the transaction of every write, just before the
+# commit:
+#   - insert, update and delete statements (ORM flushes and Core statements
+#     run through the session) are noticed on their connection,
+#   - text statements are not, call mark_written() (see db_stats.py).
+# The increment locks the row of the counter until the commit, so the
+# versions of a table follow the order of the commits. Writes outside the
+# session (other tools, db.engine.execute) don't change the version.
+# The table is created on first use in databases made before it existed.
+
+WRITTEN_TABLES = 'written_tables'
+
+# Engines whose database has table_versions, see ensure_table
+checked_engines = weakref.WeakSet()
+
+BUMP_SQL = text(
+    'INSERT INTO table_versions (name, version) VALUES (:name, 1) '
+    'ON CONFLICT (name) DO UPDATE '
+    'SET version = table_versions.version + 1')
+
+
+def mark_written(table_name):
+    """
+    Bumps the version of table_name when the current transaction commits,
+    for writes the statement can't tell (text statements).
+    """
+    db.session.connection().info.setdefault(
+        WRITTEN_TABLES, set()).add(table_name)
+
+
+def ensure_table(connection):
+    """ Creates table_versions if it doesn't exist, once per engine """
+    if connection.engine not in checked_engines:
+        TableVersion.__table__.create(bind=connection, checkfirst=True)
+        checked_engines.add(connection.engine)
+
+
+def version_of(table):
+    """ Returns the scalar subquery of the version of table, 0 if unknown """
+    versions = TableVersion.__table__
+    return select([func.coalesce(func.max(versions.c.version), 0)]).where(
+        versions.c.name == table.name).as_scalar()
+
+
+def note_write(conn, clauseelement, multiparams, params):
+    if (isinstance(clauseelement, UpdateBase) and
+            clauseelement.table.name != TableVersion.__tablename__):
+        conn.info.setdefault(WRITTEN_TABLES, set()).add(
+            clauseelement.table.name)
+
+
+def remember_connection(session, transaction, connection):
+    session.info['versioned_connection'] = connection
+
+
+def bump_versions(session):
+    # Pending ORM changes are flushed after before_commit
+    session.flush()
+    connection = session.info.get('versioned_connection')
+    if connection is None:
+        return
+    tables = connection.info.pop(WRITTEN_TABLES, None)
+    if tables:
+        ensure_table(connection)
+        session.execute(BUMP_SQL, [{'name': name} for name in sorted(tables)])
+
+
+def forget_connection(session, *args):
+    connection = session.info.pop('versioned_connection', None)
+    if connection is not None:
+        connection.info.pop(WRITTEN_TABLES, None)
+
+
+event.listen(Engine, 'before_execute', note_write)
+event.listen(Session, 'after_begin', remember_connection)
+event.listen(Session, 'before_commit', bump_versions)
+event.listen(Session, 'after_commit', forget_connection)
+event.listen(Session, 'after_rollback', forget_connection)
@@ -20,9 +20,11 @@ def signin():
     # HTTP POST
     if form.validate_on_submit():
         # # Validate and sign in the user.
-        user = User.query.filter_by(
-            email_address=form.email_address.data).first()
-        if (user is not None and user.verify_password(form.password.data)):
+        # Only local users have a password, OAuth 2 users of other providers
+        # can share the email address
+        user = User.get_by_email(form.email_address.data, provider='myapp')
+        if (user is not None and user.password_hash is not None and
+                user.verify_password(form.password.data)):
             # Flask-Login login_user() function to record the user is logged in
             # for the user session.
             login_user(user)
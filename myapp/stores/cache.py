@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+# Rendered-fragment cache of the store pages
+# The components page of a store is the most viewed page. The part that
+# only depends on the store and its components (store details and component
+# tabs) is rendered once and kept per store key (country_code, number), a
+# repeat view renders the page around it without touching the database.
+#
+# Fragments are dropped once a transaction that changed the store or one of
+# its components commits in this process: every write path records its
+# changes in the change log (db_changes.py), which also collects the keys of
+# the changed stores. STORES_FRAGMENT_CACHE_TTL bounds how long writes of
+# other processes (and of the reference data shown in the page) can go
+# unnoticed. At most STORES_FRAGMENT_CACHE_SIZE fragments are kept, the
+# least recently used go first.
+#
+# Fragments must not contain anything specific to a user or session, such as
+# CSRF tokens or flashed messages.
+
+
+class FragmentCache(object):
+
+    """
+    Flask extension holding the rendered fragments of an application.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STORES_FRAGMENT_CACHE', True)
+        app.config.setdefault('STORES_FRAGMENT_CACHE_SIZE', 1000)
+        app.config.setdefault('STORES_FRAGMENT_CACHE_TTL', 60)
+        app.extensions['fragment_cache'] = {
+            'fragments': OrderedDict(),
+            'lock': threading.Lock()
+        }
+
+    def get(self, key):
+        """ Returns the fragment of a store key, None if not cached """
+        if not current_app.config['STORES_FRAGMENT_CACHE']:
+            return None
+        state = current_app.extensions['fragment_cache']
+        ttl = current_app.config['STORES_FRAGMENT_CACHE_TTL']
+        with state['lock']:
+            entry = state['fragments'].get(key)
+            if entry is None:
+                return None
+            rendered_at, fragment = entry
+            if ttl and time.monotonic() - rendered_at > ttl:
+                del state['fragments'][key]
+                return None
+            state['fragments'].move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment):
+        """ Keeps the fragment of a store key """
+        if not current_app.config['STORES_FRAGMENT_CACHE']:
+            return
+        state = current_app.extensions['fragment_cache']
+        size = current_app.config['STORES_FRAGMENT_CACHE_SIZE']
+        with state['lock']:
+            state['fragments'][key] = (time.monotonic(), fragment)
+            state['fragments'].move_to_end(key)
+            while len(state['fragments']) > size:
+                state['fragments'].popitem(last=False)
+
+    def invalidate(self, keys):
+        """ Drops the fragments of the given store keys """
+        if has_app_context():
+            state = current_app.extensions.get('fragment_cache')
+            if state is not None:
+                with state['lock']:
+                    for key in keys:
+                        state['fragments'].pop(key, None)
+
+
+fragment_cache = FragmentCache()
+
+
+# Invalidation
+# db_changes.record collects the keys of the changed stores in the session,
+# their fragments are dropped once the transaction is committed.
+
+def invalidate_on_commit(session):
+    keys = session.info.pop('changed_stores', None)
+    if keys:
+        fragment_cache.invalidate(keys)
+
+
+def forget_on_rollback(session, previous_transaction):
+    session.info.pop('changed_stores', None)
+
+
+event.listen(Session, 'after_commit', invalidate_on_commit)
+event.listen(Session, 'after_soft_rollback', forget_on_rollback)
@@ -8,17 +8,27 @@ from myapp.models.db_models import DistributionCenter
 from myapp.models.db_models import StoreStatus
 
 
-# Query Factories - they need to return queries, not results
+# Query Factories - QuerySelectField accepts any iterable, we return the
+# cached reference rows (myapp/models/db_cache.py) instead of queries.
+# These rows are no ORM instances, so the primary key is given with get_pk.
 def callback_countries():
-    return Country.query.order_by('country_code')
+    return Country.get_all()
 
 
 def callback_distribution_centers():
-    return DistributionCenter.query.order_by('country_code', 'number')
+    return DistributionCenter.get_all()
 
 
 def callback_store_status():
-    return StoreStatus.query.order_by('sequence')
+    return StoreStatus.get_all()
+
+
+def get_pk_country(country):
+    return country.country_code
+
+
+def get_pk_id(row):
+    return row.id
 
 
 class StoreForm(FlaskForm):
@@ -42,16 +52,19 @@ class AddStoreForm(FlaskForm):
     country_code = QuerySelectField(
         'Country',
         query_factory=callback_countries,
+        get_pk=get_pk_country,
         get_label='country_name'
         )
     dc = QuerySelectField(
         'DC',
         query_factory=callback_distribution_centers,
+        get_pk=get_pk_id,
         get_label='name'
         )
     status = QuerySelectField(
         'Status',
         query_factory=callback_store_status,
+        get_pk=get_pk_id,
         get_label='name'
         )
     number = IntegerField('Store Number')
@@ -81,16 +94,19 @@ class EditStoreForm(FlaskForm):
     country_code = QuerySelectField(
         'Country',
         query_factory=callback_countries,
+        get_pk=get_pk_country,
         get_label='country_name'
         )
     dc = QuerySelectField(
         'DC',
         query_factory=callback_distribution_centers,
+        get_pk=get_pk_id,
         get_label='name',
         )
     status = QuerySelectField(
         'Status',
         query_factory=callback_store_status,
+        get_pk=get_pk_id,
         get_label='name'
         )
     number = IntegerField('Store Number')
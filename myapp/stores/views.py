@@ -1,10 +1,12 @@
-from flask import flash, redirect, render_template, request, url_for
+from flask import abort, flash, redirect, render_template, request, url_for
+from flask import Markup
 from flask_login import current_user, login_required
 from sqlalchemy.exc import IntegrityError
 
 from myapp.models.db_orm import db
 
 from . import stores
+from .cache import fragment_cache
 from .forms import StoreForm
 from .forms import AddStoreForm
 from .forms import EditStoreForm
@@ -15,6 +17,9 @@ from myapp.models.db_models import DistributionCenter
 from myapp.models.db_models import StoreStatus
 from myapp.models.db_models import Store
 from myapp.models.db_models import StoreComponent
+from myapp.models import db_changes
+from myapp.models import db_stats
+from myapp.models.db_resolver import store_resolver
 
 
 # http://localhost:5000/stores
@@ -51,36 +56,30 @@ def index():
     methods=['GET'])
 def components(country_code, number):
 
-    # Retrieve store details
-    store_id = Store.get_id(country_code, number)
-    store = Store.get(country_code, number)
-
-    # Retrieve and set name values for the store FKs
-    current_dc = DistributionCenter.get_name(store.dc_id)
-    current_status = StoreStatus.get_name(store.status_id)
-    store.dc_id = current_dc
-    store.status_id = current_status
-
-    form = StoreForm()
-
-    # Retrieve components
-    backoffice = StoreComponent.get_all_by_type(
-        store_id=store_id, component_type='backoffice')
-    network_routers = StoreComponent.get_all_by_type(
-        store_id=store_id, component_type='network_routers')
-    network_switches = StoreComponent.get_all_by_type(
-        store_id=store_id, component_type='network_switches')
-    network_access_points = StoreComponent.get_all_by_type(
-        store_id=store_id, component_type='network_access_points')
+    # Store details and components don't depend on the user, they are
+    # rendered once and cached until the store changes, see cache.py
+    fragment = fragment_cache.get((country_code, number))
+    if fragment is None:
+        # One query for the store with its dc and status names and one for
+        # all components, partitioned by type
+        store = Store.get_with_names(country_code, number)
+        if store is None:
+            abort(404)
+        components = StoreComponent.get_all_by_store(store.id)
+        fragment = Markup(render_template(
+            'stores/components-fragment.html',
+            store=store,
+            backoffice=components['backoffice'],
+            network_routers=components['network_routers'],
+            network_switches=components['network_switches'],
+            network_access_points=components['network_access_points'],
+            form=StoreForm(meta={'csrf': False})
+            ))
+        fragment_cache.set((country_code, number), fragment)
 
     return render_template(
         'stores/components.html',
-        store=store,
-        backoffice=backoffice,
-        network_routers=network_routers,
-        network_switches=network_switches,
-        network_access_points=network_access_points,
-        form=form
+        fragment=fragment
         )
 
 
@@ -124,6 +123,11 @@ def add_store():
             )
         try:
             db.session.add(new_store)
+            # Statistics and the change log are written in the same
+            # transaction, the change needs the id of the new store
+            db.session.flush()
+            db_stats.add_stores([new_store])
+            db_changes.record_inserts(Store, [new_store])
             db.session.commit()
             print('Created store {}'.format(store_name))
             flash('Thank you for adding store {}'.format(store_name), 'info')
@@ -165,14 +169,12 @@ def edit_store(country_code, number):
 
     # We need to provide query result objects to EditStoreForm
     # for default choices in QuerySelectField
-    store_id = Store.get_id(country_code, number)
-    current_store = Store.query.filter_by(id=store_id).first()
-    current_country_code = Country.query.filter_by(
-        country_code=current_store.country_code).first()
-    current_dc = DistributionCenter.query.filter_by(
-        id=current_store.dc_id).first()
-    current_status = StoreStatus.query.filter_by(
-        id=current_store.status_id).first()
+    # Resolved once for the whole request, see db_resolver.py
+    current_store = Store.get(country_code, number)
+    store_id = current_store.id
+    current_country_code = Country.get(current_store.country_code)
+    current_dc = DistributionCenter.get(current_store.dc_id)
+    current_status = StoreStatus.get(current_store.status_id)
 
     form = EditStoreForm(
         country_code=current_country_code,
@@ -190,6 +192,11 @@ def edit_store(country_code, number):
             form.name.data)
             )
         try:
+            # The store is uncounted with its current values and counted
+            # again with the new values, which the update below
+            # synchronizes into current_store
+            db_stats.remove_stores([current_store])
+            previous_key = db_changes.key_of(Store, current_store)
             db.session.query(Store).filter(Store.id == store_id).update(dict(
                 country_code=form.country_code.data.country_code,
                 dc_id=form.dc.data.id,
@@ -200,7 +207,11 @@ def edit_store(country_code, number):
                 street_name=form.street_name.data,
                 postal_code=form.postal_code.data,
                 city=form.city.data))
+            db_stats.add_stores([current_store])
+            db_changes.record_updates(Store, [current_store], [previous_key])
             db.session.commit()
+            # The key of the store may have changed
+            store_resolver.forget()
             print('Store {} has been edited'.format(store_name))
             flash('Store {} has been edited'.format(store_name), 'info')
         except IntegrityError:
@@ -249,7 +260,14 @@ def delete_store(country_code, number):
     # HTTP POST
     if form.validate_on_submit():
         # Retrieve store primary key
-        store_id = Store.get_id(country_code, number)
+        store = Store.get(country_code, number)
+        store_id = store.id
+        # Uncount the store and its components in the statistics and
+        # leave their keys in the change log
+        db_stats.remove_store_components([store_id])
+        db_stats.remove_stores([store])
+        db_changes.record_store_component_deletes([store_id])
+        db_changes.record_deletes(Store, [store])
         # Delete store components
         db.session.query(StoreComponent).filter(
             StoreComponent.store_id == store_id).delete()
@@ -258,6 +276,7 @@ def delete_store(country_code, number):
             Store.id == store_id).delete()
         # Commit the changes
         db.session.commit()
+        store_resolver.forget()
         # Give some feedback
         print('Deleted store {} {}'.format(country_code, str(number)))
         flash('You deleted store {} {}'.format(
@@ -1,3 +1,5 @@
+import os
+
 from passlib.hash import argon2
 
 
@@ -48,3 +50,70 @@ def check_argon2_hash(password, hash):
     """
     # Verify the password
     return argon2.verify(password, hash)
+
+
+# Bulk hashing
+# Argon2 is CPU- and memory-hard by design: hashing thousands of passwords
+# one by one takes minutes. generate_argon2_hashes spreads them over a pool
+# of processes (threads would be serialized by the GIL around passlib).
+# Each hash needs memory_cost KiB (64 MiB by default), argon2_workers caps
+# the number of processes so they fit in the available memory.
+
+
+def argon2_memory(rounds=4):
+    """ Returns the memory one Argon2 hash needs, in bytes """
+    return argon2.using(rounds=rounds).memory_cost * 1024
+
+
+def available_memory():
+    """
+    Returns the available physical memory in bytes, None if unknown
+    (the sysconf names are not available on every platform).
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def argon2_workers(max_workers=None, memory_fraction=0.5, rounds=4):
+    """
+    Returns the number of processes for generate_argon2_hashes: one per
+    core, at most max_workers, and no more than fit in memory_fraction of
+    the available memory. At least 1.
+    """
+    workers = os.cpu_count() or 1
+    if max_workers:
+        workers = min(workers, max_workers)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, int(memory * memory_fraction //
+                                   argon2_memory(rounds)))
+    return max(workers, 1)
+
+
+def generate_argon2_hashes(passwords, executor=None, rounds=4):
+    """
+    Calculates the Argon2 password hashes of a list of passwords, in the
+    processes of executor if given. None passwords get a None hash.
+
+    Args:
+        param1: list of passwords
+        param2: concurrent.futures.ProcessPoolExecutor or None
+        param3: number of rounds
+
+    Returns:
+        list of Argon2 password hashes, in the order of passwords.
+    """
+    indexes = [i for i, password in enumerate(passwords)
+               if password is not None]
+    todo = [passwords[i] for i in indexes]
+    rounds = [rounds] * len(todo)
+    if executor is None:
+        hashes = map(generate_argon2_hash, todo, rounds)
+    else:
+        hashes = executor.map(generate_argon2_hash, todo, rounds)
+    result = [None] * len(passwords)
+    for i, hash in zip(indexes, hashes):
+        result[i] = hash
+    return result
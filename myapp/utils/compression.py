@@ -0,0 +1,111 @@
+import zlib
+
+from flask import current_app, request
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+
+# Response compression
+# The JSON of the API collections and the rendered store tables are very
+# repetitive text, gzip typically shrinks them to a tenth of their size.
+# Responses are compressed in an after_request handler when the client accepts
+# gzip or deflate (Accept-Encoding) and the mimetype is one of
+# COMPRESS_MIMETYPES. Buffered responses are only compressed from
+# COMPRESS_MIN_SIZE bytes on, below that the gzip header costs more than
+# it saves.
+# Streamed responses (see myapp/api/streaming.py) are compressed chunk by
+# chunk: every chunk is flushed with Z_SYNC_FLUSH, so the client can decode
+# what it received so far and the response is never buffered.
+#
+# Content-Encoding (not Transfer-Encoding) is used, so the compressed body is
+# a different representation: Vary: Accept-Encoding tells caches to keep one
+# copy per encoding. The ETags of the API are weak, which allows both
+# representations to share them.
+
+ENCODINGS = ('gzip', 'deflate')
+
+# zlib wbits per encoding: a gzip header and trailer, or the zlib format for
+# HTTP deflate (RFC 7230, section 4.2.2)
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+
+def get_encoding():
+    """ Returns the preferred encoding of the client, or None """
+    accept = parse_accept_header(
+        request.headers.get('Accept-Encoding'), Accept)
+    return accept.best_match(ENCODINGS)
+
+
+def compress_chunks(chunks, compressor):
+    """
+    Yields the compressed chunks, each flushed so it can be decoded on its own.
+    """
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class Compress(object):
+
+    """
+    Flask extension compressing responses with gzip or deflate.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_MIMETYPES', (
+            'text/html', 'text/css', 'text/csv', 'text/plain',
+            'application/javascript', 'application/json',
+            'application/x-ndjson'))
+        if app.config['COMPRESS_ENABLED']:
+            app.after_request(self.after_request)
+
+    def after_request(self, response):
+        config = current_app.config
+
+        # Files sent with send_file (static) are passed through as they are,
+        # responses without a body or already encoded are left alone
+        if (response.direct_passthrough or
+                response.status_code < 200 or
+                response.status_code in (204, 206, 304) or
+                'Content-Encoding' in response.headers or
+                response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+
+        # The representation depends on Accept-Encoding, even when the
+        # response below is sent uncompressed
+        response.vary.add('Accept-Encoding')
+
+        encoding = get_encoding()
+        if encoding is None:
+            return response
+
+        compressor = zlib.compressobj(
+            config['COMPRESS_LEVEL'], zlib.DEFLATED, WBITS[encoding])
+        if response.is_streamed:
+            # Closing the response must still close the wrapped iterable,
+            # e.g. to end the request context kept by stream_with_context
+            iterable = response.response
+            if hasattr(iterable, 'close'):
+                response.call_on_close(iterable.close)
+            response.response = compress_chunks(
+                response.iter_encoded(), compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compressor.compress(data) + compressor.flush())
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -22,6 +22,7 @@ pipenv run flask db_load_users
 pipenv run flask db_load_countries
 pipenv run flask db_load_distribution_centers
 pipenv run flask db_load_store_status
+pipenv run flask db_load_component_types
 pipenv run flask db_load_stores
 pipenv run flask db_load_store_components
 echo 'Starting web server'
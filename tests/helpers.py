@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from myapp.models.db_orm import db
+from myapp.models.db_models import User
+from myapp.models.db_models import Country
+from myapp.models.db_models import DistributionCenter
+from myapp.models.db_models import StoreStatus
+from myapp.models.db_models import Store
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import StoreComponent
+
+
+def load_test_data():
+    """
+    Adds a small data set: two countries, one DC and status each,
+    five stores per country and two backoffices per store, the component
+    types backoffice (id 1) and pos (id 2).
+    """
+    db.session.add(User(
+        provider='myapp', social_id='1', email_address='admin@myapp.com'))
+    db.session.add_all([
+        Country(country_code='BE', country_name='Belgium'),
+        Country(country_code='LU', country_name='Luxembourg')])
+    db.session.add_all([
+        DistributionCenter(
+            country_code='BE', number=1, name='Distribution Center 1',
+            tag='DC1'),
+        DistributionCenter(
+            country_code='LU', number=4, name='Distribution Center 4',
+            tag='DC4')])
+    db.session.add(StoreStatus(sequence=2, name='Open'))
+    db.session.add_all([
+        ComponentType(id=1, name='backoffice'),
+        ComponentType(id=2, name='pos')])
+    db.session.commit()
+    for country_code, dc_id in (('LU', 2), ('BE', 1)):
+        for number in range(1, 6):
+            db.session.add(Store(
+                user_id=1, country_code=country_code, dc_id=dc_id,
+                number=number, name='Store {}'.format(number), status_id=1,
+                city='City {}'.format(number)))
+    db.session.commit()
+    for store in Store.query.all():
+        for i in (1, 2):
+            db.session.add(StoreComponent(
+                store_id=store.id, component_type='backoffice',
+                hostname='Backoffice {}'.format(i), ip_address='127.0.0.1'))
+    db.session.commit()
+
+
+@contextmanager
+def count_queries():
+    """
+    Counts the SQL statements executed on the database engine.
+    Usage:
+        with count_queries() as queries:
+            ...
+        len(queries)
+    """
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(
+            db.engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,384 @@
+import csv
+import io
+import json
+import unittest
+from datetime import datetime
+from flask import jsonify, url_for
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_cache import reference_cache
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models import db_stats
+from myapp.api.pagination import encode_cursor
+
+from tests.helpers import count_queries, load_test_data
+
+
+class TestApiBlueprint(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_json(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_stores_without_pagination(self):
+        response, data = self.get_json(url_for('api.get_stores'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['stores']), 10)
+        self.assertNotIn('next', data)
+        self.assertNotIn('Link', response.headers)
+
+    def test_stores_keyset_pagination(self):
+        # Walk all pages following the Link header
+        url = url_for('api.get_stores', limit=3)
+        keys = []
+        while url:
+            response, data = self.get_json(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(data['stores']), 3)
+            keys.extend(
+                (s['country_code'], s['number']) for s in data['stores'])
+            url = None
+            if data['next'] is not None:
+                link = response.headers['Link']
+                self.assertIn('rel="next"', link)
+                url = link[link.index('<') + 1:link.index('>')]
+        self.assertEqual(len(keys), 10)
+        self.assertEqual(keys, sorted(keys))
+
+    def test_store_components_keyset_pagination(self):
+        response, data = self.get_json(
+            url_for('api.get_store_components', limit=15))
+        self.assertEqual(len(data['store_components']), 15)
+        response, data = self.get_json(url_for(
+            'api.get_store_components', limit=15, after=data['next']))
+        self.assertEqual(len(data['store_components']), 5)
+        self.assertIsNone(data['next'])
+
+    def test_invalid_cursor(self):
+        response, data = self.get_json(
+            url_for('api.get_stores', after='not-a-cursor'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['error'], 'bad request')
+        # Values that don't match the types of the sort key columns
+        for values, sort in (([{'a': 1}, 2], None), ([None, None], None),
+                             (['BE', True], None), ([1.5], 'id')):
+            response, data = self.get_json(url_for(
+                'api.get_stores', after=encode_cursor(values), sort=sort))
+            self.assertEqual(response.status_code, 400)
+
+    def test_stores_stream_ndjson(self):
+        response = self.client.get(
+            url_for('api.get_stores'),
+            headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        lines = response.data.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(json.loads(lines[0])['country_code'], 'BE')
+
+    def test_store_components_stream_json(self):
+        self.app.config['API_STREAM_BATCH_SIZE'] = 3
+        response = self.client.get(
+            url_for('api.get_store_components', stream=1))
+        self.assertTrue(response.is_streamed)
+        data = json.loads(response.data.decode('utf-8'))
+        response, expected = self.get_json(
+            url_for('api.get_store_components'))
+        self.assertEqual(data, expected)
+
+    def test_stores_csv(self):
+        self.app.config['API_STREAM_BATCH_SIZE'] = 3
+        response = self.client.get(
+            url_for('api.get_stores_csv', country_code='BE'), buffered=False)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        # Header, then chunks of 3 rows
+        chunks = [chunk.decode('utf-8') for chunk in response.response]
+        response.close()
+        self.assertTrue(chunks[0].startswith('country_code,number,name,'))
+        rows = list(csv.DictReader(io.StringIO(''.join(chunks))))
+        self.assertEqual(len(chunks), 1 + (len(rows) + 2) // 3)
+        store = Store.query.filter_by(country_code='BE').order_by(
+            Store.number).first()
+        self.assertEqual(rows[0]['number'], str(store.number))
+        self.assertEqual(rows[0]['dc_name'], store.dc.name)
+        self.assertEqual(rows[0]['status'], store.status.name)
+        self.assertNotIn('dc_id', rows[0])
+
+    def test_store_components_csv(self):
+        response = self.client.get(url_for('api.get_store_components_csv'))
+        rows = list(csv.DictReader(io.StringIO(
+            response.data.decode('utf-8'))))
+        self.assertEqual(len(rows), StoreComponent.query.count())
+        component = StoreComponent.query.order_by(StoreComponent.id).first()
+        store = Store.query.get(component.store_id)
+        self.assertEqual(
+            (rows[0]['country_code'], rows[0]['store_number'],
+             rows[0]['hostname']),
+            (store.country_code, str(store.number), component.hostname))
+
+    def test_stores_conditional_get(self):
+        response = self.client.get(url_for('api.get_stores'))
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        # Unchanged collection
+        response = self.client.get(
+            url_for('api.get_stores'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        # A deleted store changes the ETag, not the Last-Modified date
+        db.session.delete(Store.query.filter_by(number=5).first())
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.get_stores'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.headers['Last-Modified'], last_modified)
+        response = self.client.get(
+            url_for('api.get_stores'),
+            headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 200)
+
+    def test_stores_conditional_get_same_second(self):
+        # Two updates in the same second leave count and dates unchanged
+        updated_date = datetime(2020, 1, 1, 12, 0, 0)
+        store = Store.query.filter_by(country_code='BE', number=1).one()
+        store.name, store.updated_date = 'First', updated_date
+        db.session.commit()
+        etag = self.client.get(url_for('api.get_stores')).headers['ETag']
+        db.session.execute(Store.__table__.update().where(
+            (Store.country_code == 'BE') & (Store.number == 2)).values(
+            name='Second', updated_date=updated_date))
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.get_stores'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Second', response.data)
+
+    def test_stores_sparse_fieldset(self):
+        with count_queries() as queries:
+            response, data = self.get_json(url_for(
+                'api.get_stores', fields='country_code,number,name'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(data['stores'][0]), {'country_code', 'number', 'name'})
+        select = [q for q in queries if 'FROM stores' in q][-1]
+        self.assertNotIn('created_date', select.split('FROM')[0])
+
+    def test_unknown_field(self):
+        response, data = self.get_json(
+            url_for('api.get_store_components', fields='hostname,secret'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', data['message'])
+
+    def test_stores_filters(self):
+        response, data = self.get_json(url_for(
+            'api.get_stores', country_code='LU', dc='LU-4', status='Open',
+            city='City 2'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(s['country_code'], s['number']) for s in data['stores']],
+            [('LU', 2)])
+        response, data = self.get_json(url_for('api.get_stores', dc='XX-9'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_store_components_filters(self):
+        response, data = self.get_json(url_for(
+            'api.get_store_components', store='BE-3,LU-1',
+            component_type='backoffice', updated_since='2000-01-01'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['store_components']), 4)
+        self.assertEqual(data['store_components'][0]['component_type'],
+                         'backoffice')
+        # Unknown component types match nothing
+        response, data = self.get_json(url_for(
+            'api.get_store_components', component_type='other'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['store_components'], [])
+
+    def test_store_components_ip_filters(self):
+        store = Store.query.first()
+        for hostname, ip_address in (
+                ('pos 1', '10.12.0.1'), ('pos 2', '10.12.255.255'),
+                ('pos 3', '10.13.0.1'), ('pos 4', '2001:db8::1')):
+            db.session.add(StoreComponent(
+                store_id=store.id, component_type='pos', hostname=hostname,
+                ip_address=ip_address))
+        db.session.commit()
+
+        def hostnames(**kwargs):
+            response, data = self.get_json(
+                url_for('api.get_store_components', **kwargs))
+            self.assertEqual(response.status_code, 200)
+            return sorted(component['hostname']
+                          for component in data['store_components'])
+
+        self.assertEqual(hostnames(ip='10.12.0.0/16'), ['pos 1', 'pos 2'])
+        self.assertEqual(hostnames(ip='10.13.0.1,2001:db8::/32'),
+                         ['pos 3', 'pos 4'])
+        self.assertEqual(hostnames(ip_from='10.12.0.2', ip_to='10.13.0.1'),
+                         ['pos 2', 'pos 3'])
+        # An open range stays within the IP version of its end
+        self.assertEqual(hostnames(ip_from='10.13.0.0', component_type='pos'),
+                         ['pos 3'])
+        self.assertEqual(hostnames(ip_to='10.12.0.1'), ['pos 1'])
+        self.assertEqual(hostnames(ip_from='::'), ['pos 4'])
+        self.assertEqual(hostnames(ip='::/0'), ['pos 4'])
+        response, data = self.get_json(
+            url_for('api.get_store_components', ip='10.12.0.0/16'))
+        self.assertEqual(data['store_components'][0]['ip_address'],
+                         '10.12.0.1')
+        for kwargs in ({'ip': '10.12.0.0/33'}, {'ip_from': 'localhost'},
+                       {'ip_from': '10.0.0.1', 'ip_to': '::1'}):
+            response, data = self.get_json(
+                url_for('api.get_store_components', **kwargs))
+            self.assertEqual(response.status_code, 400)
+
+        # The network is a range scan of the index
+        plan = db.session.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM store_components '
+            'WHERE ip_address BETWEEN :first AND :last',
+            {'first': b'0', 'last': b'1'}).fetchall()
+        self.assertIn('ix_store_components_ip_address', str(plan))
+
+    def test_stores_sort_descending_pagination(self):
+        url = url_for('api.get_stores', sort='-country_code,number', limit=4)
+        keys = []
+        while url:
+            response, data = self.get_json(url)
+            keys.extend(
+                (s['country_code'], s['number']) for s in data['stores'])
+            url = data['next'] and url_for(
+                'api.get_stores', sort='-country_code,number', limit=4,
+                after=data['next'])
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        self.assertEqual(len(keys), 10)
+
+    def test_stores_sort_newest_first(self):
+        response, data = self.get_json(url_for('api.get_stores', sort='-id'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (data['stores'][0]['country_code'], data['stores'][0]['number']),
+            ('BE', 5))
+
+    def test_unsupported_sort(self):
+        response, data = self.get_json(url_for('api.get_stores', sort='name'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_lookup_stores(self):
+        keys = ['LU-{}'.format(n) for n in range(1, 6)] + [
+            {'country_code': 'BE', 'number': 2}, 'BE-99']
+        self.app.config['API_LOOKUP_CHUNK_SIZE'] = 4
+        with count_queries() as queries:
+            response = self.client.post(
+                url_for('api.lookup_stores'),
+                data=json.dumps({'stores': keys, 'components': True}),
+                content_type='application/json')
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(s['country_code'], s['number']) for s in data['stores']],
+            [('LU', n) for n in range(1, 6)] + [('BE', 2)])
+        self.assertEqual(data['stores'][0]['dc'], 'Distribution Center 4')
+        self.assertEqual(data['stores'][0]['status'], 'Open')
+        self.assertEqual(len(data['stores'][0]['components']), 2)
+        self.assertEqual(data['not_found'], ['BE-99'])
+        # Two chunks, two queries each and the reference data
+        self.assertLessEqual(len(queries), 4 + 3)
+
+    def test_lookup_stores_invalid(self):
+        response = self.client.post(
+            url_for('api.lookup_stores'),
+            data=json.dumps({'stores': ['BE']}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_store_with_components(self):
+        db.session.add(StoreComponent(
+            store_id=Store.query.filter_by(
+                country_code='BE', number=1).one().id,
+            component_type='pos', hostname='POS 1'))
+        db.session.commit()
+        url = url_for('api.get_store_components_by_store',
+                      country_code='BE', number=1)
+        with count_queries() as queries:
+            response, data = self.get_json(url)
+        self.assertEqual(response.status_code, 200)
+        # One aggregate query for the validators, one joined query
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(data['store']['number'], 1)
+        self.assertEqual(sorted(data['components']), ['backoffice', 'pos'])
+        self.assertEqual(len(data['components']['backoffice']), 2)
+
+        response, data = self.get_json(url + '?type=pos,other')
+        self.assertEqual(list(data['components']), ['pos'])
+        response, data = self.get_json(url + '?type=other')
+        self.assertEqual(data['store']['number'], 1)
+        self.assertEqual(data['components'], {})
+
+        response = self.client.get(url_for(
+            'api.get_store_components_by_store',
+            country_code='BE', number=99))
+        self.assertEqual(response.status_code, 404)
+
+    def test_stats(self):
+        db_stats.rebuild_statistics()
+        response, data = self.get_json(url_for('api.get_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['stores']['by_dc'], {'BE-1': 5, 'LU-4': 5})
+        self.assertEqual(data['store_components']['by_type'],
+                         {'backoffice': 20})
+        self.assertEqual(data['store_components']['by_store']['BE-1'], 2)
+
+    def test_statement_count_per_endpoint(self):
+        # Reference data is served from the cache once it is loaded
+        reference_cache.get()
+        caps = (
+            # Validators (count, max dates) and the select
+            (url_for('api.get_users'), 2),
+            (url_for('api.get_countries'), 0),
+            (url_for('api.get_distribution_centers'), 0),
+            (url_for('api.get_store_status'), 0),
+            (url_for('api.get_stores'), 2),
+            (url_for('api.get_store_by_country', country_code='BE'), 2),
+            (url_for('api.get_store_by_number', number=1), 2),
+            (url_for('api.get_store_components'), 2),
+            (url_for('api.get_store_component', type='backoffice'), 2),
+            (url_for('api.get_store_components_by_store',
+                     country_code='BE', number=1), 2),
+            (url_for('api.get_stats'), 2),
+            (url_for('api.get_change_feed'), 2))
+        for url, cap in caps:
+            with count_queries() as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertLessEqual(len(queries), cap, url)
+
+    def test_serialization_matches_to_dict(self):
+        # The Core read path must return exactly what to_dict() returned
+        expected = jsonify(stores=[
+            s.to_dict() for s in Store.query.order_by(
+                Store.country_code, Store.number)]).data
+        response = self.client.get(url_for('api.get_stores'))
+        self.assertEqual(response.data, expected)
+        expected = jsonify(store_components=[
+            c.to_dict() for c in StoreComponent.query.order_by(
+                StoreComponent.id)]).data
+        response = self.client.get(url_for('api.get_store_components'))
+        self.assertEqual(response.data, expected)
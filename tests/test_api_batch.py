@@ -0,0 +1,146 @@
+import base64
+import json
+import unittest
+from unittest import mock
+from flask import url_for
+from sqlalchemy.exc import DataError
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import User
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models import db_stats
+
+from tests.helpers import count_queries, load_test_data
+
+
+class TestApiBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        db.session.add(User(
+            provider='myapp', social_id='2', email_address='other@myapp.com',
+            password='other'))
+        User.query.get(1).password = 'admin'
+        db.session.commit()
+        db_stats.rebuild_statistics()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def batch(self, method, stores, user='admin'):
+        credentials = base64.b64encode(
+            '{0}@myapp.com:{0}'.format(user).encode('utf-8')).decode('ascii')
+        response = self.client.open(
+            url_for('api.write_stores'), method=method,
+            data=json.dumps({'stores': stores}),
+            content_type='application/json',
+            headers={'Authorization': 'Basic ' + credentials})
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def assertStatisticsRebuilt(self):
+        statistics = db_stats.get_statistics()
+        db_stats.rebuild_statistics()
+        self.assertEqual(statistics, db_stats.get_statistics())
+
+    def test_authentication_required(self):
+        response = self.client.post(
+            url_for('api.write_stores'), data=json.dumps({'stores': []}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response.headers)
+
+    def test_create(self):
+        stores = [{'country_code': 'BE', 'number': n, 'dc_id': 1,
+                   'name': 'New {}'.format(n), 'status_id': 1}
+                  for n in range(10, 20)]
+        stores.append({'country_code': 'BE', 'number': 1, 'dc_id': 1,
+                       'name': 'Exists', 'status_id': 1})
+        stores.append({'country_code': 'BE', 'number': 30, 'dc_id': 9,
+                       'name': 'Unknown DC', 'status_id': 1})
+        self.app.config['API_BATCH_CHUNK_SIZE'] = 5
+        response, data = self.batch('POST', stores)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['created'], 10)
+        self.assertEqual(data['errors'], 2)
+        self.assertEqual(data['results'][0]['store'], 'BE-10')
+        self.assertEqual(data['results'][10]['error'], 'store already exists')
+        self.assertIn('dc_id', data['results'][11]['error'])
+        self.assertEqual(Store.query.filter_by(country_code='BE').count(), 15)
+        self.assertEqual(Store.query.filter_by(number=10).one().user_id, 1)
+        self.assertStatisticsRebuilt()
+
+    def test_upsert_queries(self):
+        stores = [{'country_code': 'BE', 'number': n, 'city': 'Brussels'}
+                  for n in range(1, 6)]
+        stores.append({'country_code': 'LU', 'number': 6, 'dc_id': 2,
+                       'name': 'Store 6', 'status_id': 1})
+        with count_queries() as queries:
+            response, data = self.batch('PATCH', stores)
+        self.assertEqual((data['updated'], data['created']), (5, 1))
+        # Authentication, one read of the chunk and one statement per
+        # write, not per store
+        self.assertLessEqual(len(queries), 12)
+        self.assertEqual(
+            Store.query.filter_by(city='Brussels').count(), 5)
+        self.assertEqual(
+            Store.query.filter_by(country_code='BE', number=1).one().name,
+            'Store 1')
+        self.assertStatisticsRebuilt()
+
+    def test_invalid_ids(self):
+        response, data = self.batch('PATCH', [
+            {'country_code': 'BE', 'number': 1, 'dc_id': [1]},
+            {'country_code': 'BE', 'number': 2, 'dc_id': True},
+            {'country_code': 'BE', 'number': 3, 'status_id': True}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['updated'], data['errors']), (0, 3))
+        self.assertEqual(data['results'][0]['error'], 'unknown dc_id: [1]')
+        self.assertEqual(data['results'][1]['error'], 'unknown dc_id: True')
+        self.assertIn('status_id', data['results'][2]['error'])
+        self.assertNotIn('True', db_stats.get_statistics()['stores.dc_id'])
+
+    def test_data_error(self):
+        # e.g. PostgreSQL: value too long for type character varying
+        error = DataError('UPDATE stores', {}, Exception('value too long'))
+        with mock.patch.object(db_stats, 'apply_deltas', side_effect=error):
+            response, data = self.batch('PATCH', [
+                {'country_code': 'BE', 'number': 1, 'city': 'x' * 300}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['errors'], 1)
+        self.assertIn('invalid data', data['results'][0]['error'])
+        self.assertEqual(Store.get('BE', 1).city, 'City 1')
+
+    def test_ownership(self):
+        response, data = self.batch(
+            'PATCH', [{'country_code': 'BE', 'number': 1, 'name': 'Mine'}],
+            user='other')
+        self.assertEqual(data['errors'], 1)
+        self.assertIn('you can only change', data['results'][0]['error'])
+        response, data = self.batch('DELETE', ['BE-1'], user='other')
+        self.assertEqual(data['errors'], 1)
+        self.assertEqual(Store.query.count(), 10)
+
+    def test_delete(self):
+        response, data = self.batch(
+            'DELETE', ['LU-1', {'country_code': 'LU', 'number': 2}, 'LU-99'])
+        self.assertEqual(data['deleted'], 2)
+        self.assertEqual(data['results'][2]['error'], 'store not found')
+        self.assertEqual(Store.query.count(), 8)
+        self.assertEqual(StoreComponent.query.count(), 16)
+        self.assertStatisticsRebuilt()
+
+    def test_invalid_batch(self):
+        response, data = self.batch('POST', {'country_code': 'BE'})
+        self.assertEqual(response.status_code, 400)
+        response, data = self.batch(
+            'POST', [{'country_code': 'BE', 'number': 10, 'colour': 'red'}])
+        self.assertIn('unknown fields', data['results'][0]['error'])
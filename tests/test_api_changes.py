@@ -0,0 +1,111 @@
+import base64
+import json
+import unittest
+from flask import url_for
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import Store
+from myapp.models.db_models import User
+from myapp.models import db_changes
+
+from tests.helpers import count_queries, load_test_data
+
+
+class TestApiChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        User.query.get(1).password = 'admin'
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def batch(self, method, stores):
+        credentials = base64.b64encode(b'admin@myapp.com:admin').decode()
+        response = self.client.open(
+            url_for('api.write_stores'), method=method,
+            data=json.dumps({'stores': stores}),
+            content_type='application/json',
+            headers={'Authorization': 'Basic ' + credentials})
+        self.assertEqual(response.status_code, 200)
+
+    def get_changes(self, **kwargs):
+        response = self.client.get(url_for('api.get_change_feed', **kwargs))
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_change_feed(self):
+        response, data = self.get_changes()
+        self.assertEqual(data['changes'], [])
+        self.assertFalse(data['more'])
+        start = data['next']
+
+        self.batch('PATCH', [
+            {'country_code': 'BE', 'number': 6, 'dc_id': 1, 'name': 'Store 6',
+             'status_id': 1},
+            {'country_code': 'BE', 'number': 1, 'city': 'Brussels'}])
+        self.batch('DELETE', ['LU-1'])
+
+        # Walk the feed two changes at a time
+        changes, cursor, more = [], start, True
+        while more:
+            with count_queries() as queries:
+                response, data = self.get_changes(since=cursor, limit=2)
+            # Validators, changes and the current stores (no components)
+            self.assertLessEqual(len(queries), 3)
+            changes.extend(data['changes'])
+            cursor, more = data['next'], data['more']
+            self.assertEqual('Link' in response.headers, more)
+
+        self.assertEqual(
+            [(c['resource'], c['action']) for c in changes],
+            [('stores', 'insert'), ('stores', 'update'),
+             ('store_components', 'delete'), ('store_components', 'delete'),
+             ('stores', 'delete')])
+        self.assertEqual(changes[0]['data']['name'], 'Store 6')
+        self.assertEqual(changes[1]['data']['city'], 'Brussels')
+        self.assertEqual(
+            changes[2]['key'],
+            {'country_code': 'LU', 'number': 1, 'hostname': 'Backoffice 1'})
+        self.assertEqual(
+            changes[4]['key'], {'country_code': 'LU', 'number': 1})
+        self.assertIsNone(changes[4]['data'])
+
+        # Nothing new since the last cursor
+        response, data = self.get_changes(since=cursor)
+        self.assertEqual(data['changes'], [])
+        self.assertEqual(data['next'], cursor)
+
+    def test_store_key_change(self):
+        start = self.get_changes()[1]['next']
+        store = Store.get('BE', 2)
+        previous_key = db_changes.key_of(Store, store)
+        store.number = 12
+        db_changes.record_updates(Store, [store], [previous_key])
+        db.session.commit()
+
+        changes = self.get_changes(since=start)[1]['changes']
+        # The components move with their store
+        self.assertEqual(
+            [(c['resource'], c['action'], c['key']['number'])
+             for c in changes],
+            [('stores', 'delete', 2), ('stores', 'insert', 12),
+             ('store_components', 'delete', 2),
+             ('store_components', 'insert', 12),
+             ('store_components', 'delete', 2),
+             ('store_components', 'insert', 12)])
+        self.assertEqual(changes[3]['data']['hostname'], 'Backoffice 1')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            url_for('api.get_change_feed', since='abc'))
+        self.assertEqual(response.status_code, 400)
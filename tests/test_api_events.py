@@ -0,0 +1,124 @@
+import json
+import unittest
+from flask import url_for
+
+from myapp import create_app
+from myapp.events import LocalBackend, Subscription
+from myapp.models.db_orm import db
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models import db_changes
+
+from tests.helpers import load_test_data
+
+
+class ManualBackend(LocalBackend):
+
+    """ Backend without reader thread, the test calls read() """
+
+    def start(self):
+        if self.last_id is None:
+            self.last_id = 0
+
+    def notify(self):
+        self.notified = True
+
+
+def parse_event(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines())
+    return fields['event'], int(fields['id']), json.loads(fields['data'])
+
+
+class TestApiEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['EVENTS_KEEPALIVE'] = 0.01
+        state = self.app.extensions['event_broker']
+        self.backend = state['backend'] = ManualBackend(
+            self.app, state['broker'])
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def delete_store(self, country_code, number):
+        store = Store.get(country_code, number)
+        db_changes.record_store_component_deletes([store.id])
+        db_changes.record_deletes(Store, [store])
+        StoreComponent.query.filter_by(store_id=store.id).delete()
+        db.session.delete(store)
+        db.session.commit()
+
+    def test_subscription_filters(self):
+        event = {'country_code': 'BE', 'store': 'BE-1',
+                 'component_type': 'backoffice'}
+        self.assertTrue(Subscription().matches(event))
+        self.assertTrue(Subscription(country_codes=['BE', 'LU']).matches(
+            event))
+        self.assertFalse(Subscription(stores=['BE-2']).matches(event))
+        self.assertFalse(Subscription(component_types=['pos']).matches(
+            dict(event, component_type=None)))
+
+    def test_stream(self):
+        response = self.client.get(
+            url_for('api.get_events', country_code='BE',
+                    component_type='backoffice'),
+            buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = iter(response.response)
+        self.assertEqual(next(events), b': connected\n\n')
+        self.assertEqual(next(events), b': keepalive\n\n')
+
+        self.delete_store('LU', 1)
+        self.delete_store('BE', 1)
+        self.assertTrue(self.backend.notified)
+        self.backend.read()
+
+        # Only the components of BE-1 match
+        received = [parse_event(next(events).decode()) for _ in range(2)]
+        self.assertEqual(
+            [(name, data['action'], data['store'])
+             for name, _, data in received],
+            [('store_components', 'delete', 'BE-1')] * 2)
+        self.assertEqual(received[0][2]['key']['hostname'], 'Backoffice 1')
+        self.assertEqual(next(events), b': keepalive\n\n')
+        response.close()
+        broker = self.app.extensions['event_broker']['broker']
+        self.assertEqual(broker.subscriptions, set())
+
+    def test_replay(self):
+        self.delete_store('LU', 1)
+        response = self.client.get(
+            url_for('api.get_events', store='LU-2'), buffered=False)
+        events = iter(response.response)
+        next(events)
+        self.delete_store('LU', 2)
+        self.backend.read()
+        name, last_event_id, data = parse_event(next(events).decode())
+        response.close()
+
+        # Reconnect after the first of the three events of LU-2
+        self.delete_store('LU', 3)
+        self.backend.read()
+        response = self.client.get(
+            url_for('api.get_events', store='LU-2,LU-3'), buffered=False,
+            headers={'Last-Event-ID': str(last_event_id)})
+        events = iter(response.response)
+        next(events)
+        replayed = [parse_event(next(events).decode()) for _ in range(5)]
+        self.assertEqual([data['store'] for _, _, data in replayed],
+                         ['LU-2', 'LU-2', 'LU-3', 'LU-3', 'LU-3'])
+        self.assertEqual(replayed[-1][2]['resource'], 'stores')
+        response.close()
+
+        self.app.config['EVENTS_REPLAY_LIMIT'] = 2
+        response = self.client.get(
+            url_for('api.get_events'), headers={'Last-Event-ID': '0'})
+        self.assertIn(b'event: reset', response.data)
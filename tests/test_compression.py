@@ -0,0 +1,79 @@
+import gzip
+import json
+import unittest
+import zlib
+from flask import url_for
+
+from myapp import create_app
+from myapp.models.db_orm import db
+
+from tests.helpers import load_test_data
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_gzip(self):
+        plain = self.client.get(url_for('api.get_stores'))
+        response = self.client.get(
+            url_for('api.get_stores'), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
+    def test_deflate(self):
+        plain = self.client.get(url_for('api.get_store_components'))
+        response = self.client.get(
+            url_for('api.get_store_components'),
+            headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.data), plain.data)
+
+    def test_not_accepted(self):
+        response = self.client.get(url_for('api.get_stores'))
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        json.loads(response.data.decode('utf-8'))
+
+    def test_min_size(self):
+        self.app.config['COMPRESS_MIN_SIZE'] = 10 ** 6
+        response = self.client.get(
+            url_for('api.get_stores'), headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed_chunk_by_chunk(self):
+        self.app.config['API_STREAM_BATCH_SIZE'] = 3
+        plain = self.client.get(
+            url_for('api.get_stores'),
+            headers={'Accept': 'application/x-ndjson'})
+        response = self.client.get(
+            url_for('api.get_stores'),
+            headers={'Accept': 'application/x-ndjson',
+                     'Accept-Encoding': 'gzip'},
+            buffered=False)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        # Every chunk can be decoded as soon as it is received
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = b''
+        for chunk in response.response:
+            data += decompressor.decompress(chunk)
+            self.assertTrue(data.endswith(b'\n'))
+        response.close()
+        self.assertEqual(data, plain.data)
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_cache import ReferenceCache
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import DistributionCenter
+from myapp.models.db_models import StoreStatus
+
+from tests.helpers import count_queries, load_test_data
+
+
+class TestReferenceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_lookups_are_cached(self):
+        DistributionCenter.get_all()
+        with count_queries() as queries:
+            self.assertEqual(DistributionCenter.get_id('LU', 4), 2)
+            self.assertEqual(DistributionCenter.get_name(1),
+                             'Distribution Center 1')
+            self.assertEqual(StoreStatus.get_name(1), 'Open')
+            self.assertEqual(len(StoreStatus.get_all()), 1)
+        self.assertEqual(len(queries), 0)
+
+    def test_invalidated_on_write(self):
+        self.assertEqual(len(StoreStatus.get_all()), 1)
+        db.session.add(StoreStatus(sequence=3, name='Closed'))
+        db.session.commit()
+        self.assertEqual(
+            [s.name for s in StoreStatus.get_all()], ['Open', 'Closed'])
+        db.session.query(StoreStatus).filter(
+            StoreStatus.name == 'Closed').update({'name': 'Gone'})
+        db.session.commit()
+        self.assertEqual(StoreStatus.get_all()[1].name, 'Gone')
+
+    @mock.patch.object(ReferenceCache, 'MISS_RELOAD_INTERVAL', 0)
+    def test_reloaded_on_miss(self):
+        self.assertEqual(len(ComponentType.get_all()), 2)
+        # Added by another process: no ORM event
+        db.session.execute(ComponentType.__table__.insert().values(
+            id=3, name='printer'))
+        db.session.commit()
+        self.assertEqual(ComponentType.get_name(3), 'printer')
+        with count_queries() as queries:
+            with self.assertRaises(LookupError):
+                StoreStatus.get_name(99)
+            self.assertIsNone(DistributionCenter.get(99))
+        # One reload (a query per table) per miss
+        self.assertEqual(len(queries), 2 * 4)
+
+    def test_to_dict_matches_model(self):
+        dc = DistributionCenter.query.filter_by(id=1).first()
+        self.assertEqual(DistributionCenter.get(1).to_dict(), dc.to_dict())
@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import Change
+from myapp.models.db_models import ComponentType
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_data import COMPONENTS
+from myapp.models.db_data import load_store_components_from_json
+from myapp.models import db_stats
+
+from tests.helpers import count_queries, load_test_data
+
+
+class TestDataLoaders(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        db.session.add_all([
+            ComponentType(id=3, name='network_routers'),
+            ComponentType(id=4, name='network_switches'),
+            ComponentType(id=5, name='network_access_points')])
+        db.session.commit()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def write_json(self, filename, data):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return path
+
+    def test_load_store_components(self):
+        StoreComponent.query.delete()
+        db.session.commit()
+        db_stats.rebuild_statistics()
+        stores = {str(number): {'store': {'country_code': 'BE'}}
+                  for number in range(1, 6)}
+        # Unknown stores are skipped
+        stores['99'] = {'store': {'country_code': 'BE'}}
+        path = self.write_json('stores.json', {'stores': stores})
+
+        with count_queries() as queries:
+            count = load_store_components_from_json(path)
+        # Not one query per component
+        self.assertLess(len(queries), 15)
+        self.assertEqual(StoreComponent.query.count(), count)
+        self.assertGreaterEqual(count, 5 * len(COMPONENTS))
+        self.assertLessEqual(
+            count, 5 * sum(maximum for _, _, maximum in COMPONENTS))
+        self.assertEqual(
+            StoreComponent.query.filter_by(
+                hostname='Backoffice 1').first().component_type,
+            'backoffice')
+        self.assertEqual(Change.query.filter_by(
+            table_name='store_components', action='insert').count(), count)
+        statistics = db_stats.get_statistics()
+        db_stats.rebuild_statistics()
+        self.assertEqual(statistics, db_stats.get_statistics())
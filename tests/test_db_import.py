@@ -0,0 +1,194 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import IntegrityError
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import Change
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_models import User
+from myapp.models.db_import import get_progress, import_file
+from myapp.models.db_import import reset_progress
+from myapp.models.db_import import provision_users, read_json_array
+from myapp.models import db_stats
+from myapp.utils import argon2
+
+from tests.helpers import load_test_data
+
+
+def store(number, **kwargs):
+    return dict({'country_code': 'BE', 'number': number,
+                 'name': 'Store {}'.format(number), 'dc_number': 1,
+                 'status': 'Open', 'city': 'Waregem'}, **kwargs)
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        db_stats.rebuild_statistics()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def write_file(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        return path
+
+    def write_ndjson(self, filename, records):
+        return self.write_file(filename, ''.join(
+            json.dumps(record) + '\n' for record in records))
+
+    def assertStatisticsRebuilt(self):
+        statistics = db_stats.get_statistics()
+        db_stats.rebuild_statistics()
+        self.assertEqual(statistics, db_stats.get_statistics())
+
+    def test_read_json_array(self):
+        records = [{'number': i, 'name': 'Store "{}" ]'.format(i)}
+                   for i in range(20)]
+        content = ' [\n' + ',\n'.join(json.dumps(r) for r in records) + '] '
+        # A record spans several reads
+        self.assertEqual(
+            list(read_json_array(io.StringIO(content), read_size=7)),
+            records)
+        self.assertEqual(list(read_json_array(io.StringIO('[ ]'))), [])
+        for content in ('{}', '[{"a": 1}', '[{"a": 1} {"b": 2}]'):
+            with self.assertRaises(ValueError):
+                list(read_json_array(io.StringIO(content), read_size=4))
+
+    def test_import_stores(self):
+        invalid = []
+        path = self.write_ndjson('stores.ndjson', [
+            store(6), store(7, dc_number=9), store(8, status='Unknown'),
+            store(9, name=''), store(10, street_name='Stormestraat')])
+        imported, invalid_count = import_file(
+            'stores', path, batch_size=2,
+            on_invalid=lambda *args: invalid.append(args))
+        self.assertEqual((imported, invalid_count), (2, 3))
+        self.assertEqual([number for number, _ in invalid], [2, 3, 4])
+        self.assertEqual(invalid[0][1], 'unknown distribution center BE-9')
+        imported = Store.get('BE', 10)
+        self.assertEqual(imported.street_name, 'Stormestraat')
+        self.assertEqual((imported.user_id, imported.dc_id), (1, 1))
+        self.assertEqual(Change.query.filter_by(
+            table_name='stores', action='insert').count(), 2)
+        self.assertIsNone(get_progress(path))
+        self.assertStatisticsRebuilt()
+
+    def test_import_store_components_csv(self):
+        path = self.write_file('components.csv', (
+            'country_code,store_number,store_name,component_type,hostname,'
+            'ip_address\r\n'
+            'BE,1,Store 1,pos,POS 1,10.0.0.1\r\n'
+            'BE,99,Store 99,pos,POS 1,\r\n'
+            'LU,2,Store 2,printer,Printer 1,\r\n'
+            'LU,2,Store 2,pos,POS 1,10.0.0.256\r\n'
+            'LU,2,Store 2,pos,POS 1,\r\n'))
+        invalid = []
+        self.assertEqual(
+            import_file('store_components', path, batch_size=3,
+                        on_invalid=lambda *args: invalid.append(args)),
+            (2, 3))
+        self.assertEqual(invalid, [
+            (2, 'unknown store BE-99'),
+            (3, 'unknown component type printer'),
+            (4, "invalid ip address '10.0.0.256'")])
+        components = StoreComponent.query.filter_by(hostname='POS 1').order_by(
+            StoreComponent.id).all()
+        self.assertEqual(
+            [(c.store.country_code, c.component_type, c.ip_address)
+             for c in components],
+            [('BE', 'pos', '10.0.0.1'), ('LU', 'pos', None)])
+        self.assertStatisticsRebuilt()
+
+    def test_resume_after_failure(self):
+        # Store 3 exists already: the second batch fails
+        records = [store(6), store(7), store(3), store(8), store(9)]
+        path = self.write_ndjson('stores.ndjson', records)
+        with self.assertRaises(IntegrityError):
+            import_file('stores', path, batch_size=2)
+        self.assertEqual(get_progress(path).records, 2)
+        self.assertIsNotNone(Store.get('BE', 7))
+        self.assertIsNone(Store.get('BE', 8))
+
+        records[2] = store(10)
+        self.write_ndjson('stores.ndjson', records)
+        self.assertEqual(import_file('stores', path, batch_size=2), (3, 0))
+        self.assertEqual(
+            Store.query.filter_by(country_code='BE').count(), 5 + 5)
+        self.assertIsNone(get_progress(path))
+        self.assertStatisticsRebuilt()
+
+    def test_resume_other_file(self):
+        path = self.write_ndjson(
+            'stores.ndjson', [store(6), store(7), store(3), store(8)])
+        with self.assertRaises(IntegrityError):
+            import_file('stores', path, batch_size=2)
+        # Another file at the same path: its first records weren't imported
+        path = self.write_ndjson(
+            'stores.ndjson', [store(11), store(12), store(13)])
+        with self.assertRaises(ValueError):
+            import_file('stores', path, batch_size=2)
+        self.assertEqual(get_progress(path).records, 2)
+        self.assertIsNone(Store.get('BE', 11))
+
+        reset_progress(path)
+        self.assertEqual(import_file('stores', path, batch_size=2), (3, 0))
+        self.assertIsNotNone(Store.get('BE', 11))
+
+    def test_argon2_workers(self):
+        memory = argon2.argon2_memory()
+        self.assertEqual(memory, 64 * 1024 * 1024)
+        with mock.patch('os.cpu_count', return_value=8):
+            with mock.patch.object(argon2, 'available_memory',
+                                   return_value=3 * memory):
+                # 1.5 hashes fit in half the memory
+                self.assertEqual(argon2.argon2_workers(), 1)
+                self.assertEqual(
+                    argon2.argon2_workers(memory_fraction=1), 3)
+            with mock.patch.object(argon2, 'available_memory',
+                                   return_value=None):
+                self.assertEqual(argon2.argon2_workers(), 8)
+                self.assertEqual(argon2.argon2_workers(max_workers=2), 2)
+
+    def test_provision_users(self):
+        path = self.write_file('users.csv', (
+            'email_address,password,username\r\n'
+            'manager1@myapp.com,secret1,Manager 1\r\n'
+            'ADMIN@myapp.com,secret,\r\n'
+            'manager2@myapp.com,,\r\n'
+            'manager3@myapp.com,secret3,\r\n'
+            'Manager1@myapp.com,secret1,\r\n'))
+        invalid = []
+        self.assertEqual(
+            provision_users(path, batch_size=2, workers=2,
+                            on_invalid=lambda *args: invalid.append(args)),
+            (2, 2, 1))
+        self.assertEqual(invalid, [(3, 'missing field password')])
+        manager = User.get_by_email('manager1@myapp.com')
+        self.assertEqual(
+            (manager.provider, manager.username), ('myapp', 'Manager 1'))
+        self.assertTrue(manager.verify_password('secret1'))
+        self.assertTrue(
+            User.get_by_email('manager3@myapp.com').verify_password(
+                'secret3'))
+        # Provisioning again skips them
+        self.assertEqual(provision_users(path, workers=1), (0, 4, 1))
@@ -0,0 +1,42 @@
+import unittest
+
+from myapp import create_app
+from myapp.models.db_orm import db, create_missing_indexes
+from myapp.models.db_models import User
+
+
+class TestIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_create_missing_indexes(self):
+        self.assertEqual(create_missing_indexes(), [])
+        db.session.execute('DROP INDEX ix_users_email_address')
+        db.session.execute('DROP INDEX ix_store_components_store_id')
+        db.session.commit()
+        self.assertEqual(
+            create_missing_indexes(),
+            ['ix_users_email_address', 'ix_store_components_store_id'])
+        self.assertEqual(create_missing_indexes(), [])
+
+    def test_email_lookup_uses_index(self):
+        statement = User.query.filter(
+            db.func.lower(User.email_address) == 'a').statement
+        plan = db.session.execute('EXPLAIN QUERY PLAN ' + str(
+            statement.compile(compile_kwargs={'literal_binds': True})))
+        self.assertIn('ix_users_email_address',
+                      ' '.join(str(row[-1]) for row in plan))
+
+    def test_naming_conventions(self):
+        stores = db.metadata.tables['stores']
+        self.assertIn('fk_stores_dc_id_distribution_centers',
+                      {constraint.name for constraint in stores.constraints})
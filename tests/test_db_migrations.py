@@ -0,0 +1,100 @@
+import unittest
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_migrations import migrate_component_types
+from myapp.models.db_migrations import migrate_ip_addresses
+from myapp.models import db_stats
+
+from tests.helpers import load_test_data
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_ip_address_validation(self):
+        component = StoreComponent(ip_address='::ffff:10.0.0.1')
+        self.assertEqual(component.ip_address, '10.0.0.1')
+        with self.assertRaises(ValueError):
+            StoreComponent(ip_address='10.0.0.256')
+
+    def test_migrate_ip_addresses(self):
+        # Addresses stored as strings, before the IPAddress column type
+        db.session.execute('DROP INDEX ix_store_components_ip_address')
+        db.session.execute(
+            "UPDATE store_components SET ip_address = CASE id "
+            "WHEN 1 THEN ' 10.1.2.3' WHEN 2 THEN '2001:DB8::1' "
+            "WHEN 3 THEN 'unknown' ELSE '127.0.0.1' END")
+        db.session.commit()
+
+        converted, invalid = migrate_ip_addresses()
+        self.assertEqual(converted, StoreComponent.query.count() - 1)
+        self.assertEqual(invalid, [(3, 'unknown')])
+        db.session.expire_all()
+        self.assertEqual(
+            [StoreComponent.query.get(i).ip_address for i in (1, 2, 3, 4)],
+            ['10.1.2.3', '2001:db8::1', None, '127.0.0.1'])
+        self.assertEqual(db.session.execute(
+            "SELECT count(*) FROM store_components "
+            "WHERE typeof(ip_address) = 'blob'").scalar(), converted)
+        self.assertEqual(db.session.execute(
+            "SELECT count(*) FROM sqlite_master "
+            "WHERE name = 'ix_store_components_ip_address'").scalar(), 1)
+        # Nothing left to convert
+        self.assertEqual(migrate_ip_addresses(), (0, []))
+
+    def test_migrate_component_types(self):
+        # Component types stored as strings, before table component_types
+        db.session.execute('DROP TABLE store_components')
+        db.session.execute('DROP TABLE component_types')
+        db.session.execute(
+            'CREATE TABLE store_components ('
+            'id INTEGER PRIMARY KEY, store_id INTEGER NOT NULL, '
+            'component_type VARCHAR NOT NULL, hostname VARCHAR NOT NULL, '
+            'ip_address BLOB, created_date DATETIME, updated_date DATETIME)')
+        db.session.execute(
+            'CREATE INDEX ix_store_components_store_id '
+            'ON store_components (store_id, component_type)')
+        db.session.execute(
+            'CREATE INDEX ix_store_components_component_type '
+            'ON store_components (component_type, id)')
+        db.session.execute(
+            "INSERT INTO store_components "
+            "(store_id, component_type, hostname) VALUES "
+            "(1, 'pos', 'POS 1'), (1, 'backoffice', 'Backoffice 1'), "
+            "(2, 'pos', 'POS 1')")
+        db.session.commit()
+
+        self.assertEqual(migrate_component_types(), 3)
+        self.assertEqual(
+            [(c.store_id, c.component_type, c.hostname)
+             for c in StoreComponent.query.order_by(StoreComponent.id)],
+            [(1, 'pos', 'POS 1'), (1, 'backoffice', 'Backoffice 1'),
+             (2, 'pos', 'POS 1')])
+        self.assertEqual(
+            [name for name, in db.session.execute(
+                'SELECT name FROM component_types ORDER BY id')],
+            ['backoffice', 'pos'])
+        self.assertEqual(
+            [name for name, in db.session.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND "
+                "tbl_name = 'store_components' AND sql IS NOT NULL "
+                "ORDER BY name")],
+            sorted(index.name for index in StoreComponent.__table__.indexes))
+        self.assertEqual(
+            db_stats.get_statistics()['store_components.type_id'],
+            {'1': 1, '2': 2})
+        # Nothing left to convert
+        self.assertEqual(migrate_component_types(), 0)
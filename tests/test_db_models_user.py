@@ -38,3 +38,16 @@ class TestModelUser(unittest.TestCase):
         user1 = User(password='Password!')
         user2 = User(password='Password!')
         self.assertTrue(user1.password_hash != user2.password_hash)
+
+    def test_get_by_email_case_insensitive(self):
+        db.session.add(User(provider='google', social_id='1',
+                            email_address='Admin@MyApp.com'))
+        db.session.add(User(provider='myapp', social_id='2',
+                            email_address='admin@myapp.com'))
+        db.session.commit()
+        self.assertEqual(User.get_by_email('ADMIN@myapp.com').provider,
+                         'google')
+        self.assertEqual(
+            User.get_by_email('ADMIN@myapp.com', provider='myapp').social_id,
+            '2')
+        self.assertIsNone(User.get_by_email('other@myapp.com'))
@@ -0,0 +1,119 @@
+import json
+import unittest
+from flask import url_for
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import Statistic
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models import db_stats
+
+from tests.helpers import count_queries, load_test_data
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        db_stats.rebuild_statistics()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertStatisticsRebuilt(self):
+        # The incremental counts must match a full recount
+        statistics = db_stats.get_statistics()
+        db_stats.rebuild_statistics()
+        self.assertEqual(statistics, db_stats.get_statistics())
+
+    def test_rebuild(self):
+        statistics = db_stats.get_statistics()
+        self.assertEqual(statistics['stores.country_code'], {'BE': 5, 'LU': 5})
+        self.assertEqual(statistics['stores.dc_id'], {'1': 5, '2': 5})
+        self.assertEqual(
+            statistics['store_components.type_id'], {'1': 20})
+        self.assertEqual(len(statistics['store_components.store_id']), 10)
+
+    def test_add_and_edit(self):
+        store = Store(user_id=1, country_code='BE', dc_id=1, number=6,
+                      name='Store 6', status_id=1)
+        db.session.add(store)
+        db_stats.add_stores([store])
+        db.session.commit()
+        component = StoreComponent(
+            store_id=store.id, component_type='pos', hostname='POS 1')
+        db.session.add(component)
+        db_stats.add_store_components([component])
+        db.session.commit()
+        self.assertStatisticsRebuilt()
+
+        db_stats.remove_stores([store])
+        db.session.query(Store).filter(Store.id == store.id).update(
+            {'country_code': 'LU', 'dc_id': 2})
+        db_stats.add_stores([store])
+        db.session.commit()
+        self.assertEqual(
+            db_stats.get_statistics()['stores.country_code'],
+            {'BE': 5, 'LU': 6})
+        self.assertStatisticsRebuilt()
+
+    def test_delete(self):
+        stores = Store.query.filter_by(country_code='LU').all()
+        store_ids = [store.id for store in stores]
+        with count_queries() as queries:
+            db_stats.remove_store_components(store_ids)
+            db_stats.remove_stores(stores)
+        # Statements per touched name, not per store
+        self.assertLessEqual(len(queries), 12)
+        db.session.query(StoreComponent).filter(
+            StoreComponent.store_id.in_(store_ids)).delete(
+            synchronize_session=False)
+        db.session.query(Store).filter(Store.id.in_(store_ids)).delete(
+            synchronize_session=False)
+        db.session.commit()
+        statistics = db_stats.get_statistics()
+        self.assertEqual(statistics['stores.country_code'], {'BE': 5})
+        self.assertNotIn('2', statistics['stores.dc_id'])
+        # The emptied group keeps its row
+        self.assertEqual(Statistic.query.get(('stores.dc_id', '2')).count, 0)
+        # but the groups of the deleted stores are gone
+        self.assertEqual(Statistic.query.filter(
+            Statistic.name == 'store_components.store_id',
+            Statistic.key.in_([str(store_id) for store_id in store_ids])
+            ).count(), 0)
+        self.assertStatisticsRebuilt()
+
+    def test_store_keys_use_primary_key(self):
+        with count_queries() as queries:
+            statistics = db_stats.get_statistics(store_keys=True)
+        self.assertEqual(statistics['store_components.store_id']['BE-1'], 2)
+        cursor = db.session.connection().connection.cursor()
+        plan = cursor.execute('EXPLAIN QUERY PLAN ' + queries[0],
+                              ('store_components.store_id', 0)).fetchall()
+        # One lookup per group, not a scan of the stores per group
+        self.assertIn('INTEGER PRIMARY KEY', str(plan))
+        self.assertNotIn('SCAN stores', str(plan))
+
+    def test_api_stats(self):
+        self.client.get(url_for('api.get_stats'))
+        with count_queries() as queries:
+            response = self.client.get(url_for('api.get_stats'))
+        # The store keys are joined, not looked up per chunk of stores
+        self.assertEqual(
+            [query for query in queries
+             if 'FROM stores' in ' '.join(query.split())], [])
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['stores']['total'], 10)
+        self.assertEqual(data['stores']['by_dc'], {'BE-1': 5, 'LU-4': 5})
+        self.assertEqual(data['stores']['by_status'], {'Open': 10})
+        self.assertEqual(data['store_components']['total'], 20)
+        self.assertEqual(data['store_components']['by_store']['BE-1'], 2)
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from myapp import create_app
+from myapp.models.db_orm import db
+from myapp.models.db_models import Change
+from myapp.models.db_models import Store
+from myapp.models.db_models import StoreComponent
+from myapp.models.db_sync import sync_stores
+from myapp.models import db_stats
+
+from tests.helpers import count_queries, load_test_data
+
+
+def master_store(country_code, number, **kwargs):
+    return dict({'country_code': country_code, 'number': str(number),
+                 'name': 'Store {}'.format(number),
+                 'city': 'City {}'.format(number)}, **kwargs)
+
+
+class TestSyncStores(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        load_test_data()
+        db_stats.rebuild_statistics()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stores.json')
+        # Master of the BE test stores, keyed by number as stores.json
+        self.stores = {str(number): master_store('BE', number)
+                       for number in range(1, 6)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def write_master(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'stores': {number: {'store': store}
+                                  for number, store in self.stores.items()}},
+                      f)
+
+    def sync(self, **kwargs):
+        result = sync_stores(self.path, **kwargs)
+        return (result['inserted'], result['updated'], result['deleted'],
+                result['unchanged'])
+
+    def test_unchanged(self):
+        self.write_master()
+        with count_queries() as queries:
+            self.assertEqual(self.sync(delete=True), (0, 0, 5, 5))
+            self.assertLess(len(queries), 15)
+        self.assertEqual(Store.query.count(), 5)
+        self.assertEqual(StoreComponent.query.count(), 10)
+        with count_queries() as queries:
+            self.assertEqual(self.sync(delete=True), (0, 0, 0, 5))
+        # Nothing changed: one select
+        self.assertEqual(len(queries), 1)
+
+    def test_insert_update(self):
+        self.stores['2']['street_name'] = 'Stormestraat'
+        self.stores['3']['city'] = ''
+        self.stores['6'] = master_store('BE', 6, dc_number=1)
+        self.write_master()
+        self.assertEqual(self.sync(dry_run=True), (1, 2, 0, 3))
+        self.assertIsNone(Store.get('BE', 6))
+
+        changes = Change.query.count()
+        self.assertEqual(self.sync(), (1, 2, 0, 3))
+        self.assertEqual(Store.get('BE', 2).street_name, 'Stormestraat')
+        self.assertIsNone(Store.get('BE', 3).city)
+        new_store = Store.get('BE', 6)
+        self.assertEqual((new_store.dc_id, new_store.status_id), (1, 1))
+        # LU stores are kept without --delete
+        self.assertEqual(Store.query.filter_by(country_code='LU').count(), 5)
+        self.assertEqual(
+            [(change.action, change.number) for change in
+             Change.query.order_by(Change.id).offset(changes)],
+            [('insert', 6), ('update', 2), ('update', 3)])
+        statistics = db_stats.get_statistics()
+        db_stats.rebuild_statistics()
+        self.assertEqual(statistics, db_stats.get_statistics())
+        # Idempotent
+        self.assertEqual(self.sync(), (0, 0, 0, 6))
+
+    def test_invalid_records_prevent_deletes(self):
+        self.stores['4']['name'] = ''
+        self.stores['7'] = master_store('BE', 7, dc_number=9)
+        self.write_master()
+        result = sync_stores(self.path, delete=True)
+        self.assertEqual(result['invalid'], [
+            ('4', 'missing field name'),
+            ('7', 'unknown distribution center BE-9')])
+        # Store 4 and the LU stores are missing from the valid records
+        self.assertEqual(result['deletes_skipped'], 6)
+        self.assertEqual(result['deleted'], 0)
+        self.assertEqual(Store.query.count(), 10)
@@ -41,3 +41,31 @@ class TestOAuth2Blueprint(unittest.TestCase):
             }, follow_redirects=True)
         # self.assertTrue(response.status_code == 302)
         self.assertTrue(b'Signed in successfully' in response.data)
+
+    def test_signin_with_oauth2_user_of_same_email(self):
+        # An OAuth 2 user (no password) created before the local user
+        db.session.add(User(
+            provider='google', social_id='1',
+            email_address='Admin@MyApp.com'))
+        db.session.add(User(
+            provider='myapp', social_id='2',
+            email_address='admin@myapp.com', password='only4admins'))
+        db.session.commit()
+        response = self.client.post(url_for('oauth2.signin'), data={
+            'email_address': 'ADMIN@myapp.com',
+            'password': 'only4admins'
+            }, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b'Signed in successfully' in response.data)
+
+    def test_signin_user_without_password(self):
+        db.session.add(User(
+            provider='myapp', social_id='1',
+            email_address='admin@myapp.com'))
+        db.session.commit()
+        response = self.client.post(url_for('oauth2.signin'), data={
+            'email_address': 'admin@myapp.com',
+            'password': 'only4admins'
+            }, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b'Invalid username or password' in response.data)
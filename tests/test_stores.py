@@ -1,8 +1,14 @@
+import base64
 import unittest
 from flask import url_for
 
 from myapp import create_app
 from myapp.models.db_orm import db
+from myapp.models.db_models import User
+from myapp.models.db_models import Store
+from myapp.models import db_changes
+
+from tests.helpers import count_queries, load_test_data
 
 
 class TestStoresBlueprint(unittest.TestCase):
@@ -28,3 +34,91 @@ class TestStoresBlueprint(unittest.TestCase):
         response = self.client.get(url_for('stores.index'))
         self.assertEqual(response.status_code, 200)
         self.assertTrue(b'Stores Overview' in response.data)
+
+    def store_queries(self, queries):
+        return [query for query in queries
+                if query.lstrip().startswith('SELECT stores.')]
+
+    def test_store_resolved_once_per_request(self):
+        load_test_data()
+        User.query.get(1).password = 'admin'
+        db.session.commit()
+        credentials = base64.b64encode(b'admin@myapp.com:admin').decode()
+        with count_queries() as queries:
+            response = self.client.get(
+                url_for('stores.edit_store', country_code='BE', number=2),
+                headers={'Authorization': 'Basic ' + credentials})
+        self.assertEqual(response.status_code, 200)
+        # Ownership check, form defaults and template used to query the
+        # store four times
+        self.assertEqual(len(self.store_queries(queries)), 1)
+
+        with count_queries() as queries:
+            response = self.client.get(
+                url_for('stores.components', country_code='BE', number=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.store_queries(queries)), 1)
+
+    def test_store_resolver_is_request_scoped(self):
+        load_test_data()
+        with self.app.test_request_context():
+            store = Store.get('BE', 2)
+            with count_queries() as queries:
+                self.assertIs(Store.get('BE', 2), store)
+                self.assertEqual(Store.get_id('BE', 2), store.id)
+                self.assertEqual(Store.get_dc_id('BE', 2), store.dc_id)
+            self.assertEqual(queries, [])
+        # Outside a request every lookup queries the database
+        with count_queries() as queries:
+            Store.get('BE', 2)
+            Store.get_user_id('BE', 2)
+        self.assertEqual(len(queries), 2)
+
+    def test_components_page_queries_and_fragment_cache(self):
+        load_test_data()
+        url = url_for('stores.components', country_code='BE', number=2)
+        with count_queries() as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Distribution Center 1', response.data)
+        self.assertEqual(response.data.count(b'Backoffice 1'), 1)
+        # The store with its names and all of its components
+        self.assertEqual(len(queries), 2)
+
+        # Repeat views are served from the fragment cache
+        with count_queries() as queries:
+            cached = self.client.get(url)
+        self.assertEqual(queries, [])
+        self.assertEqual(cached.data, response.data)
+
+        # Committed changes of the store drop its fragment
+        store = Store.get('BE', 2)
+        store.name = 'Renamed'
+        db_changes.record_updates(Store, [store])
+        db.session.commit()
+        response = self.client.get(url)
+        self.assertIn(b'Renamed', response.data)
+
+        response = self.client.get(
+            url_for('stores.components', country_code='BE', number=99))
+        self.assertEqual(response.status_code, 404)
+
+    def test_stores_index_single_statement(self):
+        load_test_data()
+        with count_queries() as queries:
+            response = self.client.get(url_for('stores.index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'DC1', response.data)
+        self.assertEqual(len(queries), 1)
+
+    def test_eager_loaded_relationships(self):
+        load_test_data()
+        db.session.remove()
+        with count_queries() as queries:
+            stores = Store.get_all('dc', 'status', 'user', 'components')
+            # Walking the relationships runs no more statements
+            names = {(store.dc.tag, store.status.name, store.user.id,
+                      len(store.components)) for store in stores}
+        self.assertEqual(names, {('DC1', 'Open', 1, 2), ('DC4', 'Open', 1, 2)})
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(stores[0].components[0].store, stores[0])